@@ -29,6 +29,7 @@
 
 import os
 import time
+from concurrent.futures import Future
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
@@ -93,6 +94,8 @@ class ChatControl(ChatControlBase):
         self.last_recv_message_id = None
         self.last_recv_message_marks = None
         self.last_message_timestamp = None
+        # request of the lines restore_conversation prints
+        self.restore_future = None
         # for muc use:
         # widget = self.xml.get_object('muc_window_actions_button')
         self.actions_button = self.xml.get_object('message_window_actions_button')
@@ -1398,7 +1401,8 @@ class ChatControl(ChatControlBase):
 
         gajim.nec.push_outgoing_event(MessageOutgoingEvent(None,
             account=self.account, jid=self.contact.jid, chatstate=state,
-            msg_id=contact.msg_log_id, control=self))
+            msg_id=gajim.logger.get_message_id(contact.msg_log_id),
+            control=self))
 
         contact.our_chatstate = state
         if state == 'active':
@@ -1433,6 +1437,9 @@ class ChatControl(ChatControlBase):
         # disconnect self from session
         if self.session:
             self.session.control = None
+        if self.restore_future:
+            self.restore_future.cancel()
+            self.restore_future = None
 
         # Disconnect timer callbacks
         GLib.source_remove(self.possible_paused_timeout_id)
@@ -1551,7 +1558,8 @@ class ChatControl(ChatControlBase):
             return
 
         jid_with_resource = self.contact.get_full_jid()
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid_with_resource)
+        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid_with_resource,
+            kind='chat')
         if pixbuf == 'ask':
             # we don't have the vcard
             if self.TYPE_ID == message_control.TYPE_PM:
@@ -1562,18 +1570,15 @@ class ChatControl(ChatControlBase):
                         real_jid += '/' + self.gc_contact.resource
                 else:
                     real_jid = jid_with_resource
-                gajim.connections[self.account].request_vcard(real_jid,
-                        jid_with_resource)
+                gajim.connections[self.account].queue_vcard_request(real_jid,
+                    jid_with_resource, visible=True)
             else:
-                gajim.connections[self.account].request_vcard(jid_with_resource)
+                gajim.connections[self.account].queue_vcard_request(
+                    jid_with_resource, visible=True)
             return
-        elif pixbuf:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'chat')
-        else:
-            scaled_pixbuf = None
 
         image = self.xml.get_object('avatar_image')
-        image.set_from_pixbuf(scaled_pixbuf)
+        image.set_from_pixbuf(pixbuf)
         image.show_all()
 
     def _nec_vcard_received(self, obj):
@@ -1666,20 +1671,41 @@ class ChatControl(ChatControlBase):
             pending_how_many += len(gajim.events.get_events(self.account,
                     self.contact.get_full_jid(), ['chat', 'pm']))
 
-        try:
-            rows = gajim.logger.get_last_conversation_lines(jid, restore_how_many,
-                    pending_how_many, timeout, self.account)
-        except exceptions.DatabaseMalformed:
+        self.restore_future = gajim.logger.run_async(
+            gajim.logger.get_last_conversation_lines, jid, restore_how_many,
+            pending_how_many, timeout, self.account,
+            callback=self._on_last_conversation_lines,
+            error_callback=self._on_last_conversation_lines_error)
+
+    def _on_last_conversation_lines_error(self, error):
+        if not self.restore_future:
+            # the control has been closed
+            return
+        self.restore_future = None
+        if isinstance(error, exceptions.DatabaseMalformed):
             import common.logger
             dialogs.ErrorDialog(_('Database Error'),
                 _('The database file (%s) cannot be read. Try to repair it or '
                 'remove it (all history will be lost).') % common.logger.LOG_DB_PATH)
-            rows = []
+
+    def _on_last_conversation_lines(self, rows):
+        """
+        Print the lines restore_conversation got from the logs. Messages
+        printed meanwhile are newer, the lines are inserted before them
+        """
+        if not self.restore_future:
+            # the control has been closed
+            return
+        self.restore_future = None
+        jid = self.contact.jid
         local_old_kind = None
+        lines = []
         self.conv_textview.just_cleared = True
         for row in rows: # row[0] time, row[1] has kind, row[2] the message, row[3] subject, row[4] additional_data
             msg = row[2]
             additional_data = row[4]
+            if additional_data is None:
+                additional_data = {}
             if not msg: # message is empty, we don't print it
                 continue
             if row[1] in (KindConstant.CHAT_MSG_SENT,
@@ -1706,15 +1732,21 @@ class ChatControl(ChatControlBase):
             if row[3]:
                 msg = _('Subject: %(subject)s\n%(message)s') % \
                     {'subject': row[3], 'message': msg}
-            ChatControlBase.print_conversation_line(self, msg, kind, name,
-                tim, small_attr, small_attr + ['restored_message'],
-                small_attr + ['restored_message'], False,
-                old_kind=local_old_kind, xhtml=xhtml, additional_data=additional_data)
+            lines.append({'text': msg, 'jid': jid, 'kind': kind,
+                'name': name, 'tim': tim, 'other_tags_for_name': small_attr,
+                'other_tags_for_time': small_attr + ['restored_message'],
+                'other_tags_for_text': small_attr + ['restored_message'],
+                'old_kind': local_old_kind, 'xhtml': xhtml,
+                'additional_data': additional_data})
             if row[2].startswith('/me ') or row[2].startswith('/me\n'):
                 local_old_kind = None
             else:
                 local_old_kind = kind
-        if len(rows):
+        # restored lines are not counted as new, so they only need to be
+        # printed
+        self.conv_textview.print_conversation_lines(lines)
+        if lines and self.conv_textview.message_times[-1] == lines[-1]['tim']:
+            # nothing newer was printed meanwhile
             self.conv_textview.print_empty_line()
 
     def read_queue(self):
@@ -1742,7 +1774,7 @@ class ChatControl(ChatControlBase):
                 encrypted=event.encrypted, subject=event.subject,
                 xhtml=event.xhtml, displaymarking=event.displaymarking,
                 correct_id=event.correct_id)
-            if isinstance(event.msg_log_id, int):
+            if isinstance(event.msg_log_id, (int, Future)):
                 message_ids.append(event.msg_log_id)
 
             if event.session and not self.session:
@@ -1794,7 +1826,8 @@ class ChatControl(ChatControlBase):
         # so when we show the big one we avoid seeing the small one behind.
         # It's why I set it transparent.
         image = self.xml.get_object('avatar_image')
-        pixbuf = image.get_pixbuf()
+        # The shown pixbuf comes from the avatar cache, don't blank it there
+        pixbuf = image.get_pixbuf().copy()
         pixbuf.fill(0xffffff00) # RGBA
         image.set_from_pixbuf(pixbuf)
         #image.queue_draw()
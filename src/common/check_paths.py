@@ -72,12 +72,17 @@ def create_log_db():
                     show INTEGER,
                     message TEXT,
                     subject TEXT,
-                    additional_data TEXT DEFAULT '{}'
+                    additional_data TEXT DEFAULT '{}',
+                    stanza_id TEXT
             );
 
             CREATE INDEX idx_logs_jid_id_time ON logs (jid_id, time DESC);
             '''
             )
+    cur.executescript(logger.LOGS_STANZA_ID_INDEX)
+
+    if logger.fts5_available():
+        cur.executescript(logger.LOGS_FTS_SCHEMA)
 
     con.commit()
     con.close()
@@ -122,6 +127,7 @@ def create_cache_db():
             );
             '''
             )
+    cur.executescript(logger.VCARDS_SCHEMA)
 
     con.commit()
     con.close()
@@ -259,6 +265,7 @@ def check_and_possibly_create_paths():
 
     VCARD_PATH = gajim.VCARD_PATH
     AVATAR_PATH = gajim.AVATAR_PATH
+    IMAGE_CACHE_PATH = gajim.IMAGE_CACHE_PATH
     from common import configpaths
     MY_DATA = configpaths.gajimpaths['MY_DATA']
     MY_CONFIG = configpaths.gajimpaths['MY_CONFIG']
@@ -303,6 +310,13 @@ def check_and_possibly_create_paths():
         print(_('Gajim will now exit'))
         sys.exit()
 
+    if not os.path.exists(IMAGE_CACHE_PATH):
+        create_path(IMAGE_CACHE_PATH)
+    elif os.path.isfile(IMAGE_CACHE_PATH):
+        print(_('%s is a file but it should be a directory') % IMAGE_CACHE_PATH)
+        print(_('Gajim will now exit'))
+        sys.exit()
+
     if not os.path.exists(LOG_DB_FOLDER):
         create_path(LOG_DB_FOLDER)
     elif os.path.isfile(LOG_DB_FOLDER):
@@ -33,6 +33,8 @@
 
 
 import re
+from collections import OrderedDict
+from collections.abc import MutableMapping
 from common import defs
 from gi.repository import GLib
 from enum import IntEnum
@@ -53,6 +55,67 @@ opt_one_window_types = ['never', 'always', 'always_with_roster', 'peracct', 'per
 opt_show_roster_on_startup = ['always', 'never', 'last_state']
 opt_treat_incoming_messages = ['', 'chat', 'normal']
 
+class OptionGroup(MutableMapping):
+    """
+    Options of one key of a per-key option (an account, a contact, a room...)
+
+    Only values that have been set are stored, the other ones are read from the
+    default values, which are shared by all groups of the same kind.
+    """
+    __slots__ = ('_defaults', '_values', '_removed')
+
+    def __init__(self, defaults):
+        self._defaults = defaults
+        self._values = {}
+        self._removed = None # options deleted with Config.del_per()
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if self._removed and name in self._removed:
+            raise KeyError(name)
+        return self._defaults[name]
+
+    def __setitem__(self, name, value):
+        self._values[name] = value
+        if self._removed:
+            self._removed.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._values.pop(name, None)
+        if name in self._defaults:
+            if self._removed is None:
+                self._removed = set()
+            self._removed.add(name)
+
+    def __contains__(self, name):
+        if name in self._values:
+            return True
+        if self._removed and name in self._removed:
+            return False
+        return name in self._defaults
+
+    def __iter__(self):
+        for name in self._defaults:
+            if name in self:
+                yield name
+        for name in self._values:
+            if name not in self._defaults:
+                yield name
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def get_overrides(self):
+        """
+        Return the dict of options that have been set in this group
+        """
+        return self._values
+
 class Config:
 
     DEFAULT_ICONSET = 'dcraven'
@@ -204,6 +267,10 @@ class Config:
             'notify_on_file_complete': [opt_bool, True],
             'file_transfers_port': [opt_int, 28011],
             'ft_add_hosts_to_send': [opt_str, '', _('Comma separated list of hosts that we send, in addition of local interfaces, for File Transfer in case of address translation/port forwarding.')],
+            'ft_ibb_block_size': [opt_int, 16384, _('Size in bytes of the blocks of data sent with In-Band Bytestreams. Smaller blocks are used if the contact refuses this size.')],
+            'ft_ibb_window_size': [opt_int, 8, _('Number of blocks of data sent with In-Band Bytestreams before waiting for the contact to acknowledge them.')],
+            'mam_page_size': [opt_int, 250, _('Number of messages asked per page when downloading the message archive (XEP-0313). The server may send less.')],
+            'mam_max_queries': [opt_int, 4, _('Number of message archive (XEP-0313) queries Gajim runs at the same time when catching up with the messages received while it was offline.')],
             'conversation_font': [opt_str, ''],
             'use_kib_mib': [opt_bool, False, _('IEC standard says KiB = 1024 bytes, KB = 1000 bytes.')],
             'notify_on_all_muc_messages': [opt_bool, False],
@@ -253,6 +320,8 @@ class Config:
             'show_tunes_in_roster': [opt_bool, True, '', True],
             'show_location_in_roster': [opt_bool, True, '', True],
             'avatar_position_in_roster': [opt_str, 'right', _('Define the position of the avatar in roster. Can be left or right'), True],
+            'avatar_cache_size': [opt_int, 32, _('Memory in MiB used to keep the decoded and scaled avatars of contacts. The least recently shown ones are decoded again when needed.')],
+            'image_cache_size': [opt_int, 50, _('Disk space in MiB used to keep the images downloaded for XHTML-IM messages. The least recently shown ones are removed first.')],
             'ask_avatars_on_startup': [opt_bool, True, _('If True, Gajim will ask for avatar each contact that did not have an avatar last time or has one cached that is too old.')],
             'print_status_in_chats': [opt_bool, False, _('If False, Gajim will no longer print status line in chats when a contact changes his or her status and/or his or her status message.')],
             'print_status_in_muc': [opt_str, 'none', _('Can be "none", "all" or "in_and_out". If "none", Gajim will no longer print status line in groupchats when a member changes his or her status and/or his or her status message. If "all" Gajim will print all status messages. If "in_and_out", Gajim will only print FOO enters/leaves group chat.')],
@@ -419,6 +488,7 @@ class Config:
                     'oauth2_redirect_url': [ opt_str, 'https%3A%2F%2Fgajim.org%2Fmsnauth%2Findex.cgi', _('redirect_url for OAuth 2.0 authentication.')],
                     'opened_chat_controls': [opt_str, '', _('Space separated list of JIDs for which we want to re-open a chat window on next startup.')],
                     'last_mam_id': [opt_str, '', _('Last MAM id we are syncronized with')],
+                    'last_mam_time': [opt_str, '', _('Time up to which we are synchronized with the MAM archive. Empty if not known.')],
             }, {}),
             'statusmsg': ({
                     'message': [ opt_str, '' ],
@@ -638,6 +708,7 @@ class Config:
             return
 
         self.__options[1][optname] = value
+        self._mark_changed((optname,), 'set')
         self._timeout_save()
 
     def get(self, optname=None):
@@ -677,9 +748,8 @@ class Config:
         if name in opt[1]:
             # we already have added group name before
             return 'you already have added %s before' % name
-        opt[1][name] = {}
-        for o in opt[0]:
-            opt[1][name][o] = opt[0][o][Option.VAL]
+        opt[1][name] = OptionGroup(self._get_per_key_defaults(typename))
+        self._mark_changed((typename, name), 'add')
         self._timeout_save()
 
     def del_per(self, typename, name, subname = None): # per_group_of_option
@@ -689,9 +759,11 @@ class Config:
         opt = self.__options_per_key[typename]
         if subname is None:
             del opt[1][name]
+            self._mark_changed((typename, name), 'del')
         # if subname is specified, delete the item in the group.
         elif subname in opt[1][name]:
             del opt[1][name][subname]
+            self._mark_changed((typename, name, subname), 'del')
         self._timeout_save()
 
     def set_per(self, optname, key, subname, value): # per_group_of_option
@@ -710,6 +782,7 @@ class Config:
         if value is None:
             return
         obj[subname] = value
+        self._mark_changed((optname, key, subname), 'set')
         self._timeout_save()
 
     def get_per(self, optname, key=None, subname=None): # per_group_of_option
@@ -792,6 +865,43 @@ class Config:
 
         return (account not in no_log_for) and (jid not in no_log_for)
 
+    def _get_per_key_defaults(self, typename):
+        """
+        Return the dict of default values of typename per-key options, shared
+        by all its OptionGroup
+        """
+        try:
+            return self._per_key_defaults[typename]
+        except KeyError:
+            pass
+        options = self.__options_per_key[typename][0]
+        defaults = {o: options[o][Option.VAL] for o in options}
+        self._per_key_defaults[typename] = defaults
+        return defaults
+
+    def _mark_changed(self, path, action):
+        """
+        Remember that an option (path is (optname,) or (optname, key, subname))
+        or a group of options (path is (optname, key)) has been set ('set'),
+        added ('add') or deleted ('del') since last save
+        """
+        if not self.track_changes:
+            return
+        self._changes.pop(path, None)
+        self._changes[path] = action
+
+    def get_changes(self):
+        """
+        Return the list of (path, action) changed since last call, in the
+        order they were done, and forget them
+        """
+        changes = list(self._changes.items())
+        self._changes.clear()
+        return changes
+
+    def clear_changes(self):
+        self._changes.clear()
+
     def _init_options(self):
         for opt in self.__options[0]:
             self.__options[1][opt] = self.__options[0][opt][Option.VAL]
@@ -804,7 +914,7 @@ class Config:
         return False
 
     def _timeout_save(self):
-        if self.save_timeout_id:
+        if self.save_timeout_id or not self.track_changes:
             return
         self.save_timeout_id = GLib.timeout_add(1000, self._really_save)
 
@@ -812,6 +922,11 @@ class Config:
         #init default values
         self._init_options()
         self.save_timeout_id = None
+        self._changes = OrderedDict()
+        # OptionsParser disables it while reading the config file: what is
+        # set then doesn't need to be saved
+        self.track_changes = True
+        self._per_key_defaults = {}
         for event in self.soundevents_default:
             default = self.soundevents_default[event]
             self.add_per('soundevents', event)
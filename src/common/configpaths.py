@@ -152,7 +152,7 @@ class ConfigPaths:
             self.add('MY_DATA', Type.DATA, '')
 
         d = {'CACHE_DB': 'cache.db', 'VCARD': 'vcards',
-                'AVATAR': 'avatars'}
+                'AVATAR': 'avatars', 'IMAGE_CACHE': 'images'}
         for name in d:
             d[name] += profile
             self.add(name, Type.CACHE, windowsify(d[name]))
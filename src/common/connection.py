@@ -57,6 +57,7 @@ import nbxmpp
 from common import helpers
 from common import gajim
 from common import gpg
+from common import signature_verifier
 from common import passwords
 from common import exceptions
 from common import check_X509
@@ -129,10 +130,12 @@ class CommonConnection:
         self.password = ''
         self.server_resource = self._compute_resource()
         self.gpg = None
+        self.gpg_verifier = None
         self.USE_GPG = False
         if gajim.HAVE_GPG:
             self.USE_GPG = True
             self.gpg = gpg.GnuPG(gajim.config.get('use_gpg_agent'))
+            self.gpg_verifier = signature_verifier.SignatureVerifier(self.gpg)
         self.status = ''
         self.old_show = ''
         self.priority = gajim.get_priority(name, 'offline')
@@ -542,22 +545,12 @@ class CommonConnection:
                         kind = 'chat_msg_sent'
                     else:
                         kind = 'single_msg_sent'
-                    try:
-                        if xhtml and gajim.config.get('log_xhtml_messages'):
-                            log_msg = '<body xmlns="%s">%s</body>' % (
-                                nbxmpp.NS_XHTML, xhtml)
-                        gajim.logger.write(kind, jid, log_msg, subject=subject, additional_data=additional_data)
-                    except exceptions.PysqliteOperationalError as e:
-                        self.dispatch('DB_ERROR', (_('Disk Write Error'),
-                            str(e)))
-                    except exceptions.DatabaseMalformed:
-                        pritext = _('Database Error')
-                        sectext = _('The database file (%s) cannot be read. Try'
-                            ' to repair it (see '
-                            'http://trac.gajim.org/wiki/DatabaseBackup)'
-                            ' or remove it (all history will be lost).') % \
-                            common.logger.LOG_DB_PATH
-                        self.dispatch('DB_ERROR', (pritext, sectext))
+                    if xhtml and gajim.config.get('log_xhtml_messages'):
+                        log_msg = '<body xmlns="%s">%s</body>' % (
+                            nbxmpp.NS_XHTML, xhtml)
+                    gajim.logger.write_async(kind, jid, log_msg,
+                        subject=subject, additional_data=additional_data,
+                        account=self.name)
 
     def ack_subscribed(self, jid):
         """
@@ -892,6 +885,7 @@ class Connection(CommonConnection, ConnectionHandlers):
     def disconnect(self, on_purpose=False):
         gajim.interface.music_track_changed(None, None, self.name)
         self.reset_awaiting_pep()
+        self.reset_vcard_queue()
         self.on_purpose = on_purpose
         self.connected = 0
         self.time_to_reconnect = None
@@ -32,6 +32,7 @@ import os
 import base64
 import operator
 import hashlib
+import collections
 
 from time import (altzone, daylight, gmtime, localtime, strftime,
         time as time_time, timezone, tzname)
@@ -75,6 +76,15 @@ DELIMITER_ARRIVED = 'delimiter_arrived'
 PRIVACY_ARRIVED = 'privacy_arrived'
 BLOCKING_ARRIVED = 'blocking_arrived'
 PEP_CONFIG = 'pep_config'
+
+# vCards asked with queue_vcard_request
+# number of requests waiting for an answer at the same time
+VCARD_MAX_IN_FLIGHT = 5
+# seconds after which a request without answer is forgotten
+VCARD_REQUEST_TIMEOUT = 60
+# seconds during which a contact without avatar is not asked again
+VCARD_NO_AVATAR_TIMEOUT = 3600
+
 HAS_IDLE = True
 try:
 #       import idle
@@ -273,6 +283,20 @@ class ConnectionVcard:
         self.vcard_shas = {} # sha of contacts
         # list of gc jids so that vcard are saved in a folder
         self.room_jids = []
+        # vCard requests waiting to be sent, of visible contacts and of others.
+        # An entry is skipped if it is not in vcard_queued with that priority
+        # anymore
+        self.vcard_queues = (collections.deque(), collections.deque())
+        # {avatar jid: (jid, groupchat_jid, priority)}
+        self.vcard_queued = {}
+        # {avatar jid: time the request was sent}
+        self.vcard_in_flight = {}
+        # id of the timeout forgetting the requests without answer
+        self.vcard_timeout_id = None
+        # {avatar jid: time we learnt it has no avatar}
+        self.vcard_no_avatar = {}
+        self.vcard_counters = {'queued': 0, 'deduplicated': 0, 'skipped': 0,
+            'sent': 0, 'answered': 0, 'no_avatar': 0, 'timed_out': 0}
 
     def add_sha(self, p, send_caps=True):
         c = p.setTag('x', namespace=nbxmpp.NS_VCARD_UPDATE)
@@ -290,7 +314,8 @@ class ConnectionVcard:
         c.setAttr('ver', gajim.caps_hash[self.name])
         return p
 
-    def _node_to_dict(self, node):
+    @staticmethod
+    def _node_to_dict(node):
         dict_ = {}
         for info in node.getChildren():
             name = info.getName()
@@ -308,28 +333,21 @@ class ConnectionVcard:
                     dict_[name][c.getName()] = c.getData()
         return dict_
 
-    def _save_vcard_to_hd(self, full_jid, card):
+    def _save_vcard_to_db(self, full_jid, card):
         jid, nick = gajim.get_room_and_nick_from_fjid(full_jid)
-        puny_jid = helpers.sanitize_filename(jid)
-        path = os.path.join(gajim.VCARD_PATH, puny_jid)
-        if jid in self.room_jids or os.path.isdir(path):
-            if not nick:
-                return
-            # remove room_jid file if needed
-            if os.path.isfile(path):
-                os.remove(path)
-            # create folder if needed
-            if not os.path.isdir(path):
-                os.mkdir(path, 0o700)
-            puny_nick = helpers.sanitize_filename(nick)
-            path_to_file = os.path.join(gajim.VCARD_PATH, puny_jid, puny_nick)
-        else:
-            path_to_file = path
         try:
-            fil = open(path_to_file, 'w', encoding='utf-8')
-            fil.write(str(card))
-            fil.close()
-        except IOError as e:
+            if jid in self.room_jids or gajim.logger.has_room_vcards(jid):
+                if not nick:
+                    return
+                # remove room_jid vcard if needed
+                gajim.logger.remove_vcard(jid)
+            else:
+                nick = None
+            vcard = {}
+            if card:
+                vcard = self._node_to_dict(card)
+            gajim.logger.save_vcard(jid, nick, vcard)
+        except exceptions.PysqliteOperationalError as e:
             gajim.nec.push_incoming_event(InformationEvent(None, conn=self,
                 level='error', pri_txt=_('Disk Write Error'), sec_txt=str(e)))
 
@@ -340,25 +358,11 @@ class ConnectionVcard:
         Return None if we don't have cached vcard.
         """
         jid, nick = gajim.get_room_and_nick_from_fjid(fjid)
-        puny_jid = helpers.sanitize_filename(jid)
-        if is_fake_jid:
-            puny_nick = helpers.sanitize_filename(nick)
-            path_to_file = os.path.join(gajim.VCARD_PATH, puny_jid, puny_nick)
-        else:
-            path_to_file = os.path.join(gajim.VCARD_PATH, puny_jid)
-        if not os.path.isfile(path_to_file):
-            return None
-        # We have the vcard cached
-        f = open(path_to_file, encoding='utf-8')
-        c = f.read()
-        f.close()
-        try:
-            card = nbxmpp.Node(node=c)
-        except Exception:
-            # We are unable to parse it. Remove it
-            os.remove(path_to_file)
+        if not is_fake_jid:
+            nick = None
+        vcard = gajim.logger.get_vcard(jid, nick)
+        if vcard is None:
             return None
-        vcard = self._node_to_dict(card)
         if 'PHOTO' in vcard:
             if not isinstance(vcard['PHOTO'], dict):
                 del vcard['PHOTO']
@@ -400,6 +404,109 @@ class ConnectionVcard:
             self.groupchat_jids[id_] = groupchat_jid
         self.connection.send(iq)
 
+    def queue_vcard_request(self, jid, groupchat_jid=None, visible=False,
+    avatar_changed=False):
+        """
+        Request the VCARD like request_vcard to get the avatar of a contact
+
+        Requests are sent VCARD_MAX_IN_FLIGHT at a time, those of visible
+        contacts first, and a contact is asked only once at a time. A contact
+        that had no avatar is not asked again before VCARD_NO_AVATAR_TIMEOUT
+        seconds, unless avatar_changed is True.
+        """
+        if not self.connection or self.connected < 2:
+            return
+        key = groupchat_jid or jid
+        if avatar_changed:
+            self.vcard_no_avatar.pop(key, None)
+        elif key in self.vcard_no_avatar:
+            if time_time() - self.vcard_no_avatar[key] < \
+            VCARD_NO_AVATAR_TIMEOUT:
+                self.vcard_counters['skipped'] += 1
+                return
+            del self.vcard_no_avatar[key]
+        priority = 1
+        if visible:
+            priority = 0
+        if key in self.vcard_in_flight:
+            self.vcard_counters['deduplicated'] += 1
+            return
+        if key in self.vcard_queued:
+            self.vcard_counters['deduplicated'] += 1
+            if priority >= self.vcard_queued[key][2]:
+                return
+        else:
+            self.vcard_counters['queued'] += 1
+        self.vcard_queued[key] = (jid, groupchat_jid, priority)
+        self.vcard_queues[priority].append(key)
+        self.send_queued_vcard_requests()
+
+    def send_queued_vcard_requests(self):
+        if not self.connection or self.connected < 2:
+            return
+        now = time_time()
+        for key, sent in list(self.vcard_in_flight.items()):
+            if now - sent >= VCARD_REQUEST_TIMEOUT:
+                del self.vcard_in_flight[key]
+                self.vcard_counters['timed_out'] += 1
+        for priority, queue in enumerate(self.vcard_queues):
+            while queue and len(self.vcard_in_flight) < VCARD_MAX_IN_FLIGHT:
+                key = queue.popleft()
+                if key not in self.vcard_queued or \
+                self.vcard_queued[key][2] != priority:
+                    # asked again with another priority
+                    continue
+                jid, groupchat_jid, priority_ = self.vcard_queued.pop(key)
+                self.vcard_in_flight[key] = now
+                self.vcard_counters['sent'] += 1
+                self.request_vcard(jid, groupchat_jid)
+        if self.vcard_in_flight and self.vcard_timeout_id is None:
+            # forget the oldest request when it times out, even if nothing
+            # else is asked or answered meanwhile
+            delay = min(self.vcard_in_flight.values()) + \
+                VCARD_REQUEST_TIMEOUT - now
+            self.vcard_timeout_id = GLib.timeout_add_seconds(
+                max(int(delay) + 1, 1), self._on_vcard_request_timeout)
+
+    def _on_vcard_request_timeout(self):
+        self.vcard_timeout_id = None
+        self.send_queued_vcard_requests()
+        return False
+
+    def reset_vcard_queue(self):
+        """
+        Forget the vCard requests waiting to be sent or answered, they are
+        asked again by the presences of the next connection
+        """
+        for queue in self.vcard_queues:
+            queue.clear()
+        self.vcard_queued.clear()
+        self.vcard_in_flight.clear()
+        if self.vcard_timeout_id is not None:
+            GLib.source_remove(self.vcard_timeout_id)
+            self.vcard_timeout_id = None
+
+    def _vcard_request_answered(self, key, has_avatar):
+        if key in self.vcard_in_flight:
+            del self.vcard_in_flight[key]
+            self.vcard_counters['answered'] += 1
+        if has_avatar:
+            self.vcard_no_avatar.pop(key, None)
+        else:
+            self.vcard_no_avatar[key] = time_time()
+            self.vcard_counters['no_avatar'] += 1
+        self.send_queued_vcard_requests()
+
+    def get_vcard_counters(self):
+        """
+        Return the counters of queue_vcard_request, with the number of requests
+        waiting to be sent and waiting for an answer
+        """
+        counters = dict(self.vcard_counters)
+        counters['waiting'] = len(self.vcard_queued)
+        counters['in_flight'] = len(self.vcard_in_flight)
+        return counters
+
     def send_vcard(self, vcard):
         if not self.connection or self.connected < 2:
             return
@@ -459,16 +566,16 @@ class ConnectionVcard:
         if self.awaiting_answers[id_][0] == VCARD_PUBLISHED:
             if iq_obj.getType() == 'result':
                 vcard_iq = self.awaiting_answers[id_][1]
-                # Save vcard to HD
+                # Save vcard to DB
                 if vcard_iq.getTag('PHOTO') and vcard_iq.getTag('PHOTO').getTag(
                 'SHA'):
                     new_sha = vcard_iq.getTag('PHOTO').getTagData('SHA')
                 else:
                     new_sha = ''
 
-                # Save it to file
+                # Save it to the cache database
                 our_jid = gajim.get_jid_from_account(self.name)
-                self._save_vcard_to_hd(our_jid, vcard_iq)
+                self._save_vcard_to_db(our_jid, vcard_iq)
 
                 # Send new presence if sha changed and we are not invisible
                 if self.vcard_sha != new_sha and gajim.SHOW_LIST[
@@ -499,14 +606,18 @@ class ConnectionVcard:
                 # We do as if it comes from the fake_jid
                 frm = groupchat_jid
             our_jid = gajim.get_jid_from_account(self.name)
+            vcard_tag = iq_obj.getTag('vCard')
+            self._vcard_request_answered(frm, iq_obj.getType() == 'result' \
+                and vcard_tag is not None and vcard_tag.getTag('PHOTO') \
+                is not None)
             if (not iq_obj.getTag('vCard') and iq_obj.getType() == 'result') or\
             iq_obj.getType() == 'error':
                 if id_ in self.groupchat_jids:
                     frm = self.groupchat_jids[id_]
                     del self.groupchat_jids[id_]
                 if frm:
-                    # Write an empty file
-                    self._save_vcard_to_hd(frm, '')
+                    # Write an empty vcard
+                    self._save_vcard_to_db(frm, '')
                 jid, resource = gajim.get_room_and_nick_from_fjid(frm)
                 vcard = {'jid': jid, 'resource': resource}
                 gajim.nec.push_incoming_event(VcardReceivedEvent(None,
@@ -639,8 +750,8 @@ class ConnectionVcard:
         if avatar_sha:
             card.getTag('PHOTO').setTagData('SHA', avatar_sha)
 
-        # Save it to file
-        self._save_vcard_to_hd(who, card)
+        # Save it to the cache database
+        self._save_vcard_to_db(who, card)
         # Save the decoded avatar to a separate file too, and generate files
         # for dbus notifications
         puny_jid = helpers.sanitize_filename(frm)
@@ -888,6 +999,8 @@ class ConnectionHandlersBase:
             self._nec_iq_error_received)
         gajim.ged.register_event_handler('presence-received', ged.CORE,
             self._nec_presence_received)
+        gajim.ged.register_event_handler('presence-keyid-received', ged.CORE,
+            self._nec_presence_keyid_received)
         gajim.ged.register_event_handler('gc-presence-received', ged.CORE,
             self._nec_gc_presence_received)
         gajim.ged.register_event_handler('message-received', ged.CORE,
@@ -902,6 +1015,8 @@ class ConnectionHandlersBase:
             self._nec_iq_error_received)
         gajim.ged.remove_event_handler('presence-received', ged.CORE,
             self._nec_presence_received)
+        gajim.ged.remove_event_handler('presence-keyid-received', ged.CORE,
+            self._nec_presence_keyid_received)
         gajim.ged.remove_event_handler('gc-presence-received', ged.CORE,
             self._nec_gc_presence_received)
         gajim.ged.remove_event_handler('message-received', ged.CORE,
@@ -956,7 +1071,7 @@ class ConnectionHandlersBase:
                     self.vcard_shas[obj.jid] = ''
             if obj.avatar_sha != self.vcard_shas[obj.jid]:
                 # avatar has been updated
-                self.request_vcard(obj.jid)
+                self.queue_vcard_request(obj.jid, avatar_changed=True)
 
         if obj.contact:
             if obj.contact.show in statuss:
@@ -1018,13 +1133,7 @@ class ConnectionHandlersBase:
         obj.contact.show = obj.show
         obj.contact.status = obj.status
         obj.contact.priority = obj.prio
-        attached_keys = gajim.config.get_per('accounts', account,
-            'attached_gpg_keys').split()
-        if jid in attached_keys:
-            obj.contact.keyID = attached_keys[attached_keys.index(jid) + 1]
-        else:
-            # Do not override assigned key
-            obj.contact.keyID = obj.keyID
+        self._set_contact_keyID(obj.contact, obj)
         if obj.timestamp:
             obj.contact.last_status_time = localtime(obj.timestamp)
         elif not gajim.block_signed_in_notifications[account]:
@@ -1065,18 +1174,37 @@ class ConnectionHandlersBase:
 
         if gajim.config.get('log_contact_status_changes') and \
         gajim.config.should_log(self.name, obj.jid):
-            try:
-                gajim.logger.write('status', obj.jid, obj.status, obj.show)
-            except exceptions.PysqliteOperationalError as e:
-                self.dispatch('DB_ERROR', (_('Disk Write Error'), str(e)))
-            except exceptions.DatabaseMalformed:
-                pritext = _('Database Error')
-                sectext = _('The database file (%s) cannot be read. Try to '
-                    'repair it (see http://trac.gajim.org/wiki/DatabaseBackup) '
-                    'or remove it (all history will be lost).') % LOG_DB_PATH
-                self.dispatch('DB_ERROR', (pritext, sectext))
+            gajim.logger.queue_write('status', obj.jid, obj.status, obj.show,
+                account=self.name)
             our_jid = gajim.get_jid_from_account(self.name)
 
+    def _set_contact_keyID(self, contact, obj):
+        """
+        Give contact the keyID of its presence obj, or the key attached to it
+        """
+        attached_keys = gajim.config.get_per('accounts', self.name,
+            'attached_gpg_keys').split()
+        if obj.jid in attached_keys:
+            contact.keyID = attached_keys[attached_keys.index(obj.jid) + 1]
+        elif not obj.keyID_pending:
+            # Do not override assigned key. While the signature is verified,
+            # keep the key we know, PresenceKeyIDReceivedEvent updates it
+            contact.keyID = obj.keyID
+
+    def _nec_presence_keyid_received(self, obj):
+        if obj.conn.name != self.name:
+            return
+        contact = gajim.contacts.get_contact(self.name, obj.jid,
+            obj.resource or '')
+        if not contact or contact.status != obj.status:
+            # The contact sent another presence meanwhile
+            return True
+        attached_keys = gajim.config.get_per('accounts', self.name,
+            'attached_gpg_keys').split()
+        if obj.jid not in attached_keys:
+            # Do not override assigned key
+            contact.keyID = obj.keyID
+
     def _nec_gc_presence_received(self, obj):
         if obj.conn.name != self.name:
             return
@@ -1240,18 +1368,8 @@ class ConnectionHandlersBase:
         subject = msg.getSubject()
 
         if session.is_loggable():
-            try:
-                gajim.logger.write('error', frm, error_msg, tim=tim,
-                    subject=subject)
-            except exceptions.PysqliteOperationalError as e:
-                self.dispatch('DB_ERROR', (_('Disk Write Error'), str(e)))
-            except exceptions.DatabaseMalformed:
-                pritext = _('Database Error')
-                sectext = _('The database file (%s) cannot be read. Try to '
-                    'repair it (see http://trac.gajim.org/wiki/DatabaseBackup) '
-                    'or remove it (all history will be lost).') % \
-                    common.logger.LOG_DB_PATH
-                self.dispatch('DB_ERROR', (pritext, sectext))
+            gajim.logger.write_async('error', frm, error_msg, tim=tim,
+                subject=subject, account=self.name)
         gajim.nec.push_incoming_event(MessageErrorEvent(None, conn=self,
             fjid=frm, error_code=msg.getErrorCode(), error_msg=error_msg,
             msg=msgtxt, time_=tim, session=session, stanza=msg))
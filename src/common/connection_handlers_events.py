@@ -35,9 +35,7 @@ from common import helpers
 from common import gajim
 from common import i18n
 from common import dataforms
-from common import exceptions
 from common.zeroconf.zeroconf import Constant
-from common.logger import LOG_DB_PATH
 from common.pep import SUPPORTED_PERSONAL_USER_EVENTS
 from common.jingle_transport import JingleTransportSocks5
 from common.file_props import FilesProp
@@ -554,6 +552,7 @@ class PrivateStorageBookmarksReceivedEvent(nec.NetworkIncomingEvent,
 BookmarksHelper):
     name = 'private-storage-bookmarks-received'
     base_network_events = ['private-storage-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -567,6 +566,7 @@ class BookmarksReceivedEvent(nec.NetworkIncomingEvent):
     name = 'bookmarks-received'
     base_network_events = ['private-storage-bookmarks-received',
         'pubsub-bookmarks-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -576,6 +576,7 @@ class BookmarksReceivedEvent(nec.NetworkIncomingEvent):
 class PrivateStorageRosternotesReceivedEvent(nec.NetworkIncomingEvent):
     name = 'private-storage-rosternotes-received'
     base_network_events = ['private-storage-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -597,6 +598,7 @@ class PrivateStorageRosternotesReceivedEvent(nec.NetworkIncomingEvent):
 class RosternotesReceivedEvent(nec.NetworkIncomingEvent):
     name = 'rosternotes-received'
     base_network_events = ['private-storage-rosternotes-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -626,6 +628,7 @@ class PubsubReceivedEvent(nec.NetworkIncomingEvent):
 class PubsubBookmarksReceivedEvent(nec.NetworkIncomingEvent, BookmarksHelper):
     name = 'pubsub-bookmarks-received'
     base_network_events = ['pubsub-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -715,6 +718,7 @@ class StreamReceivedEvent(nec.NetworkIncomingEvent):
 class StreamConflictReceivedEvent(nec.NetworkIncomingEvent):
     name = 'stream-conflict-received'
     base_network_events = ['stream-received']
+    prunable = True
 
     def generate(self):
         if self.base_event.stanza.getTag('conflict'):
@@ -724,6 +728,7 @@ class StreamConflictReceivedEvent(nec.NetworkIncomingEvent):
 class StreamOtherHostReceivedEvent(nec.NetworkIncomingEvent):
     name = 'stream-other-host-received'
     base_network_events = ['stream-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -769,14 +774,26 @@ PresenceHelperEvent):
 
     def _generate_keyID(self, sig_tag):
         self.keyID = ''
+        self.keyID_pending = False
         if sig_tag and self.conn.USE_GPG and self.ptype != 'error':
             # error presences contain our own signature
             # verify
             sig_msg = sig_tag.getData()
-            self.keyID = self.conn.gpg.verify(self.status, sig_msg)
+            keyID = self.conn.gpg_verifier.get_key_id(self.status, sig_msg)
+            if keyID is None:
+                # gpg is run in a thread, PresenceKeyIDReceivedEvent gives the
+                # keyID later
+                self.keyID_pending = True
+                self.conn.gpg_verifier.verify(self.jid, self.status, sig_msg,
+                    self._on_keyID_verified)
+                return
             self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
                                                                 self.jid,
-                                                                self.keyID)
+                                                                keyID)
+
+    def _on_keyID_verified(self, keyID):
+        gajim.nec.push_incoming_event(PresenceKeyIDReceivedEvent(None,
+            conn=self.conn, presence_obj=self, keyID=keyID))
 
     def _generate_prio(self):
         self.prio = self.stanza.getPriority()
@@ -894,6 +911,7 @@ class ZeroconfPresenceReceivedEvent(nec.NetworkIncomingEvent):
         self.resource = 'local'
         self.prio = 0
         self.keyID = None
+        self.keyID_pending = False
         self.timestamp = 0
         self.contact_nickname = None
         self.avatar_sha = None
@@ -946,18 +964,8 @@ class GcPresenceReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
             if jid:
                 # we know real jid, save it in db
                 st += ' (%s)' % jid
-            try:
-                gajim.logger.write('gcstatus', self.fjid, st, self.show)
-            except exceptions.PysqliteOperationalError as e:
-                self.conn.dispatch('DB_ERROR', (_('Disk Write Error'), str(e)))
-            except exceptions.DatabaseMalformed:
-                pritext = _('Database Error')
-                sectext = _('The database file (%s) cannot be read. '
-                            'Try to repair it (see '
-                            'http://trac.gajim.org/wiki/DatabaseBackup) or '
-                            'remove it (all history will be lost).') % \
-                            LOG_DB_PATH
-                self.conn.dispatch('DB_ERROR', (pritext, sectext))
+            gajim.logger.queue_write('gcstatus', self.fjid, st, self.show,
+                account=self.conn.name)
         if self.avatar_sha == '':
             # contact has no avatar
             puny_nick = helpers.sanitize_filename(self.nick)
@@ -1032,6 +1040,21 @@ class UnsubscribedPresenceReceivedEvent(nec.NetworkIncomingEvent):
         self.jid = self.presence_obj.jid
         return True
 
+class PresenceKeyIDReceivedEvent(nec.NetworkIncomingEvent):
+    name = 'presence-keyid-received'
+    base_network_events = []
+
+    def generate(self):
+        if not self.conn.connected:
+            return
+        self.jid = self.presence_obj.jid
+        self.resource = self.presence_obj.resource
+        self.status = self.presence_obj.status
+        self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
+            self.jid, self.keyID)
+        self.presence_obj.keyID = self.keyID
+        return True
+
 class OurShowEvent(nec.NetworkIncomingEvent):
     name = 'our-show'
     base_network_events = []
@@ -1046,6 +1069,8 @@ class MamMessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
 
     def init(self):
         self.additional_data = {}
+        self.query_id = None
+        self.archive_id = None
     
     def generate(self):
         if not self.stanza:
@@ -1207,7 +1232,9 @@ class MessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
         if result:
             forwarded = result.getTag('forwarded', namespace=nbxmpp.NS_FORWARD)
             gajim.nec.push_incoming_event(MamMessageReceivedEvent(None,
-                conn=self.conn, stanza=forwarded))
+                conn=self.conn, stanza=forwarded,
+                query_id=result.getAttr('queryid'),
+                archive_id=result.getAttr('id')))
             return
 
         self.enc_tag = self.stanza.getTag('x', namespace=nbxmpp.NS_ENCRYPTED)
@@ -1734,6 +1761,7 @@ class ArchivingReceivedEvent(nec.NetworkIncomingEvent):
 class ArchivingErrorReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-error-received'
     base_network_events = ['archiving-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1747,6 +1775,7 @@ class ArchivingErrorReceivedEvent(nec.NetworkIncomingEvent):
 class ArchivingPreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-preferences-changed-received'
     base_network_events = ['archiving-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1800,6 +1829,7 @@ class ArchivingPreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
 class Archiving313PreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-313-preferences-changed-received'
     base_network_events = ['archiving-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1938,6 +1968,7 @@ class CapsPresenceReceivedEvent(nec.NetworkIncomingEvent, HelperEvent,
 PresenceHelperEvent):
     name = 'caps-presence-received'
     base_network_events = ['raw-pres-received']
+    prunable = True
 
     def _extract_caps_from_presence(self):
         caps_tag = self.stanza.getTag('c', namespace=nbxmpp.NS_CAPS)
@@ -1967,6 +1998,7 @@ class CapsDiscoReceivedEvent(nec.NetworkIncomingEvent):
 class CapsReceivedEvent(nec.NetworkIncomingEvent):
     name = 'caps-received'
     base_network_events = ['caps-presence-received', 'caps-disco-received']
+    prunable = True
 
     def generate(self):
         self.conn = self.base_event.conn
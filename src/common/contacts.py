@@ -88,10 +88,66 @@ class CommonContact(XMPPEntity):
             return caps_cache.client_supports(self.client_caps, requested_feature)
 
 
+class ContactGroups(list):
+    """
+    List of groups of a contact, which tells the Contacts instance holding the
+    contact when it is modified in place, so it can update its indexes
+    """
+    def __init__(self, contact, groups=()):
+        list.__init__(self, groups)
+        self._contact = contact
+
+    def _changed(self):
+        self._contact._indexed_attribute_changed()
+
+    def append(self, group):
+        list.append(self, group)
+        self._changed()
+
+    def extend(self, groups):
+        list.extend(self, groups)
+        self._changed()
+
+    def insert(self, index, group):
+        list.insert(self, index, group)
+        self._changed()
+
+    def remove(self, group):
+        list.remove(self, group)
+        self._changed()
+
+    def pop(self, *args):
+        group = list.pop(self, *args)
+        self._changed()
+        return group
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __iadd__(self, groups):
+        list.__iadd__(self, groups)
+        self._changed()
+        return self
+
+
 class Contact(CommonContact):
     """
     Information concerning a contact
     """
+    # attributes used to compute the indexes of Contacts
+    _indexed_attributes = frozenset(('show', 'groups', 'sub', 'ask', 'name'))
+    # Contacts instance holding this contact, if any
+    _index = None
+
     def __init__(self, jid, account, name='', groups=None, show='', status='',
     sub='', ask='', resource='', priority=0, keyID='', client_caps=None,
     our_chatstate=None, chatstate=None, last_status_time=None, msg_log_id=None,
@@ -118,6 +174,17 @@ class Contact(CommonContact):
 
         self.pep = {}
 
+    def __setattr__(self, name, value):
+        if name == 'groups':
+            value = ContactGroups(self, value)
+        object.__setattr__(self, name, value)
+        if name in self._indexed_attributes:
+            self._indexed_attribute_changed()
+
+    def _indexed_attribute_changed(self):
+        if self._index is not None:
+            self._index._update_index(self.jid)
+
     def get_full_jid(self):
         if self.resource:
             return self.jid + '/' + self.resource
@@ -130,10 +197,10 @@ class Contact(CommonContact):
             return self.contact_name
         return self.jid.split('@')[0]
 
-    def get_shown_groups(self):
+    def get_shown_groups(self, check_groupchat=True):
         if self.is_observer():
             return [_('Observers')]
-        elif self.is_groupchat():
+        elif check_groupchat and self.is_groupchat():
             return [_('Groupchats')]
         elif self.is_transport():
             return [_('Transports')]
@@ -360,39 +427,87 @@ class LegacyContactsAPI:
             accounts = self.get_accounts()
         if groups is None:
             groups = []
+        if len(groups) > 1:
+            return self._count_online_total_contacts(accounts, groups)
+        group = groups[0] if groups else None
+        with_transports = _('Transports') in groups
+        # jids for which indexes may not be correct: our own jid, metacontacts
+        # and groupchats are counted the slow way
+        gc_jids = set()
+        for gc_connected in common.gajim.gc_connected.values():
+            gc_jids.update(gc_connected)
         nbr_online = 0
         nbr_total = 0
         for account in accounts:
-            our_jid = common.gajim.get_jid_from_account(account)
-            for jid in self.get_jid_list(account):
-                if jid == our_jid:
-                    continue
-                if common.gajim.jid_is_transport(jid) and not \
-                _('Transports') in groups:
-                    # do not count transports
+            contacts = self._accounts[account].contacts
+            nb_online, nb_total = contacts.get_nb_online_total(group,
+                with_transports)
+            nbr_online += nb_online
+            nbr_total += nb_total
+            special_jids = set(gc_jids)
+            special_jids.add(common.gajim.get_jid_from_account(account))
+            special_jids.update(
+                self._metacontact_manager._get_metacontacts_jids_of_account(
+                account))
+            for jid in special_jids:
+                if not contacts.get_contacts(jid):
                     continue
-                if self.has_brother(account, jid, accounts) and not \
-                self.is_big_brother(account, jid, accounts):
-                    # count metacontacts only once
-                    continue
-                contact = self._accounts[account].contacts._contacts[jid][0]
-                if _('Not in roster') in contact.groups:
-                    continue
-                in_groups = False
-                if groups == []:
-                    in_groups = True
-                else:
-                    for group in groups:
-                        if group in contact.get_shown_groups():
-                            in_groups = True
-                            break
-
-                if in_groups:
-                    if contact.show not in ('offline', 'error'):
-                        nbr_online += 1
-                    nbr_total += 1
+                indexed_online, indexed_total = \
+                    contacts.get_indexed_online_total(jid, group,
+                    with_transports)
+                nb_online, nb_total = self._count_online_total_jid(account,
+                    jid, accounts, groups)
+                nbr_online += nb_online - indexed_online
+                nbr_total += nb_total - indexed_total
         return nbr_online, nbr_total
 
+    def _count_online_total_contacts(self, accounts, groups):
+        """
+        Same as get_nb_online_total_contacts(), without using indexes
+        """
+        nbr_online = 0
+        nbr_total = 0
+        for account in accounts:
+            for jid in self.get_jid_list(account):
+                nb_online, nb_total = self._count_online_total_jid(account, jid,
+                    accounts, groups)
+                nbr_online += nb_online
+                nbr_total += nb_total
+        return nbr_online, nbr_total
+
+    def _count_online_total_jid(self, account, jid, accounts, groups):
+        """
+        Return what jid adds to the number of online contacts and the total
+        number of contacts
+        """
+        if jid == common.gajim.get_jid_from_account(account):
+            return 0, 0
+        if common.gajim.jid_is_transport(jid) and not \
+        _('Transports') in groups:
+            # do not count transports
+            return 0, 0
+        if self.has_brother(account, jid, accounts) and not \
+        self.is_big_brother(account, jid, accounts):
+            # count metacontacts only once
+            return 0, 0
+        contact = self._accounts[account].contacts._contacts[jid][0]
+        if _('Not in roster') in contact.groups:
+            return 0, 0
+        in_groups = False
+        if groups == []:
+            in_groups = True
+        else:
+            for group in groups:
+                if group in contact.get_shown_groups():
+                    in_groups = True
+                    break
+
+        if in_groups:
+            if contact.show not in ('offline', 'error'):
+                return 1, 1
+            return 0, 1
+        return 0, 0
+
     def __getattr__(self, attr_name):
         # Only called if self has no attr_name
         if hasattr(self._metacontact_manager, attr_name):
@@ -439,16 +554,104 @@ class Contacts():
     def __init__(self):
         # list of contacts  {jid1: [C1, C2]}, } one Contact per resource
         self._contacts = {}
+        # What the first contact of each jid adds to the indexes below
+        # {jid: (groups, count_entry)}, see _get_index_entry()
+        self._index_entries = {}
+        # {group: {jid1: None, jid2: None}} jids whose first contact is in group
+        self._groups_index = {}
+        # {(is_transport, group): [nb_online, nb_total]} group is None for the
+        # whole account
+        self._counters = {}
+
+    def _get_index_entry(self, jid):
+        contacts = self._contacts.get(jid)
+        if not contacts:
+            return None
+        contact = contacts[0]
+        groups = frozenset(contact.groups)
+        if _('Not in roster') in groups:
+            return (groups, None)
+        # Whether the contact is a groupchat depends on rooms we are in, this
+        # is checked when counting
+        count_entry = (contact.is_transport(),
+            contact.show not in ('offline', 'error'),
+            frozenset(contact.get_shown_groups(check_groupchat=False)))
+        return (groups, count_entry)
+
+    def _apply_index_entry(self, jid, entry, sign):
+        groups, count_entry = entry
+        for group in groups:
+            if sign > 0:
+                self._groups_index.setdefault(group, {})[jid] = None
+            else:
+                group_jids = self._groups_index[group]
+                del group_jids[jid]
+                if not group_jids:
+                    del self._groups_index[group]
+        if count_entry is None:
+            return
+        is_transport, online, shown_groups = count_entry
+        for group in (None,) + tuple(shown_groups):
+            counter = self._counters.setdefault((is_transport, group), [0, 0])
+            if online:
+                counter[0] += sign
+            counter[1] += sign
+
+    def _update_index(self, jid):
+        """
+        Update indexes after contacts of jid were added, removed or modified
+        """
+        old_entry = self._index_entries.pop(jid, None)
+        new_entry = self._get_index_entry(jid)
+        if old_entry == new_entry:
+            if new_entry is not None:
+                self._index_entries[jid] = new_entry
+            return
+        if old_entry is not None:
+            self._apply_index_entry(jid, old_entry, -1)
+        if new_entry is not None:
+            self._apply_index_entry(jid, new_entry, 1)
+            self._index_entries[jid] = new_entry
+
+    def get_nb_online_total(self, group=None, with_transports=False):
+        """
+        Return the number of online jids and the total number of jids in group,
+        or in the whole account if group is None, from the indexes. Jids in a
+        "Not in roster" group are not counted.
+        """
+        nb_online, nb_total = self._counters.get((False, group), (0, 0))
+        if with_transports:
+            transports = self._counters.get((True, group), (0, 0))
+            nb_online += transports[0]
+            nb_total += transports[1]
+        return nb_online, nb_total
+
+    def get_indexed_online_total(self, jid, group=None, with_transports=False):
+        """
+        Return what jid adds to the result of get_nb_online_total()
+        """
+        entry = self._index_entries.get(jid)
+        if entry is None or entry[1] is None:
+            return 0, 0
+        is_transport, online, shown_groups = entry[1]
+        if is_transport and not with_transports:
+            return 0, 0
+        if group is not None and group not in shown_groups:
+            return 0, 0
+        return int(online), 1
 
     def add_contact(self, contact):
+        contact._index = self
         if contact.jid not in self._contacts:
             self._contacts[contact.jid] = [contact]
+            self._update_index(contact.jid)
             return
         contacts = self._contacts[contact.jid]
         # We had only one that was offline, remove it
         if len(contacts) == 1 and contacts[0].show == 'offline':
             # Do not use self.remove_contact: it deteles
             # self._contacts[account][contact.jid]
+            contacts[0]._index = None
             contacts.remove(contacts[0])
         # If same JID with same resource already exists, use the new one
         for c in contacts:
@@ -456,21 +659,27 @@ class Contacts():
                 self.remove_contact(c)
                 break
         contacts.append(contact)
+        self._update_index(contact.jid)
 
     def remove_contact(self, contact):
         if contact.jid not in self._contacts:
             return
         if contact in self._contacts[contact.jid]:
             self._contacts[contact.jid].remove(contact)
+            contact._index = None
         if len(self._contacts[contact.jid]) == 0:
             del self._contacts[contact.jid]
+        self._update_index(contact.jid)
 
     def remove_jid(self, jid):
         """
         Remove all contacts for a given jid
         """
         if jid in self._contacts:
+            for contact in self._contacts[jid]:
+                contact._index = None
             del self._contacts[jid]
+            self._update_index(jid)
 
     def get_contacts(self, jid):
         """
@@ -524,20 +733,20 @@ class Contacts():
         Return all contacts in the given group
         """
         group_contacts = []
-        for jid in self._contacts:
-            contacts = self.get_contacts(jid)
-            if group in contacts[0].groups:
-                group_contacts += contacts
+        for jid in self._groups_index.get(group, ()):
+            group_contacts += self._contacts[jid]
         return group_contacts
 
     def change_contact_jid(self, old_jid, new_jid):
         if old_jid not in self._contacts:
             return
+        contacts = self._contacts.pop(old_jid)
+        self._update_index(old_jid)
         self._contacts[new_jid] = []
-        for _contact in self._contacts[old_jid]:
+        for _contact in contacts:
             _contact.jid = new_jid
             self._contacts[new_jid].append(_contact)
-            del self._contacts[old_jid]
+        self._update_index(new_jid)
 
 
 class GC_Contacts():
@@ -576,10 +785,9 @@ class GC_Contacts():
         return list(self._rooms[room_jid].keys())
 
     def get_gc_contact(self, room_jid, nick):
-        nick_list = self.get_nick_list(room_jid)
-        if not nick in nick_list:
+        if room_jid not in self._rooms:
             return None
-        return self._rooms[room_jid][nick]
+        return self._rooms[room_jid].get(nick)
 
     def is_gc_contact(self, jid):
         """
@@ -616,20 +824,57 @@ class MetacontactManager():
     def __init__(self, contacts):
         self._metacontacts_tags = {}
         self._contacts = contacts
+        # reverse index of _metacontacts_tags {account: {jid: tag}}
+        self._jid_tags = {}
+        # {tag: family} see _get_metacontacts_family_from_tag()
+        self._families = {}
+        # {frozenset of (account, jid): (sort_data, {(account, jid): rank})}
+        # see _get_metacontacts_big_brother()
+        self._sorted_families = {}
+
+    def _families_changed(self):
+        self._families = {}
+        self._sorted_families = {}
+
+    def _index_account(self, account):
+        jid_tags = {}
+        for tag, tag_jids in self._metacontacts_tags[account].items():
+            for data in tag_jids:
+                # a jid should have only one tag, keep the first one found
+                jid_tags.setdefault(data['jid'], tag)
+        self._jid_tags[account] = jid_tags
+
+    def _index_jid(self, account, jid):
+        """
+        Find again the tag of jid, after it was removed from a family
+        """
+        self._jid_tags[account].pop(jid, None)
+        for tag, tag_jids in self._metacontacts_tags[account].items():
+            for data in tag_jids:
+                if data['jid'] == jid:
+                    self._jid_tags[account][jid] = tag
+                    return
 
     def change_account_name(self, old_name, new_name):
         self._metacontacts_tags[new_name] = self._metacontacts_tags[old_name]
         del self._metacontacts_tags[old_name]
+        self._jid_tags[new_name] = self._jid_tags.pop(old_name)
+        self._families_changed()
 
     def add_account(self, account):
         if account not in self._metacontacts_tags:
             self._metacontacts_tags[account] = {}
+            self._jid_tags[account] = {}
 
     def remove_account(self, account):
         del self._metacontacts_tags[account]
+        del self._jid_tags[account]
+        self._families_changed()
 
     def define_metacontacts(self, account, tags_list):
         self._metacontacts_tags[account] = tags_list
+        self._index_account(account)
+        self._families_changed()
 
     def _get_new_metacontacts_tag(self, jid):
         if not jid in self._metacontacts_tags:
@@ -646,20 +891,22 @@ class MetacontactManager():
         """
         Return the tag of a jid
         """
-        if not account in self._metacontacts_tags:
+        if not account in self._jid_tags:
             return None
-        for tag in self._metacontacts_tags[account]:
-            for data in self._metacontacts_tags[account][tag]:
-                if data['jid'] == jid:
-                    return tag
-        return None
+        return self._jid_tags[account].get(jid)
 
     def add_metacontact(self, brother_account, brother_jid, account, jid, order=None):
         tag = self._get_metacontacts_tag(brother_account, brother_jid)
         if not tag:
             tag = self._get_new_metacontacts_tag(brother_jid)
+            old_tag_jids = self._metacontacts_tags[brother_account].get(tag, [])
             self._metacontacts_tags[brother_account][tag] = [{'jid': brother_jid,
                     'tag': tag}]
+            for data in old_tag_jids:
+                if self._jid_tags[brother_account].get(data['jid']) == tag:
+                    self._index_jid(brother_account, data['jid'])
+            self._jid_tags[brother_account][brother_jid] = tag
+            self._families_changed()
             if brother_account != account:
                 common.gajim.connections[brother_account].store_metacontacts(
                         self._metacontacts_tags[brother_account])
@@ -677,6 +924,8 @@ class MetacontactManager():
             else:
                 self._metacontacts_tags[account][tag].append({'jid': jid,
                         'tag': tag})
+        self._jid_tags[account][jid] = tag
+        self._families_changed()
         common.gajim.connections[account].store_metacontacts(
                 self._metacontacts_tags[account])
 
@@ -684,17 +933,28 @@ class MetacontactManager():
         if not account in self._metacontacts_tags:
             return
 
-        found = None
-        for tag in self._metacontacts_tags[account]:
-            for data in self._metacontacts_tags[account][tag]:
-                if data['jid'] == jid:
-                    found = data
-                    break
-            if found:
-                self._metacontacts_tags[account][tag].remove(found)
-                common.gajim.connections[account].store_metacontacts(
-                        self._metacontacts_tags[account])
+        tag = self._jid_tags[account].get(jid)
+        if tag is None:
+            return
+        for data in self._metacontacts_tags[account][tag]:
+            if data['jid'] == jid:
+                self._metacontacts_tags[account][tag].remove(data)
                 break
+        # jid may be in another family too if the server sent us such data
+        self._index_jid(account, jid)
+        self._families_changed()
+        common.gajim.connections[account].store_metacontacts(
+                self._metacontacts_tags[account])
+
+    def _get_metacontacts_jids_of_account(self, account):
+        """
+        Return the jids of account which are part of a metacontact family
+        """
+        jids = set()
+        for tag_jids in self._metacontacts_tags.get(account, {}).values():
+            for data in tag_jids:
+                jids.add(data['jid'])
+        return jids
 
     def has_brother(self, account, jid, accounts):
         tag = self._get_metacontacts_tag(account, jid)
@@ -738,13 +998,16 @@ class MetacontactManager():
     def _get_metacontacts_family_from_tag(self, account, tag):
         if not tag:
             return []
+        if tag in self._families:
+            return list(self._families[tag])
         answers = []
         for account in self._metacontacts_tags:
             if tag in self._metacontacts_tags[account]:
                 for data in self._metacontacts_tags[account][tag]:
                     data['account'] = account
                     answers.append(data)
-        return answers
+        self._families[tag] = answers
+        return list(answers)
 
     def _compare_metacontacts(self, data1, data2):
         """
@@ -859,7 +1122,29 @@ class MetacontactManager():
         Which of the family will be the big brother under wich all others will be
         ?
         """
-        family.sort(key=cmp_to_key(self._compare_metacontacts))
+        # Sorting with _compare_metacontacts is costly, reuse the previous
+        # order while the contacts it depends on did not change
+        sort_data = {}
+        for data in family:
+            contact = self._contacts.get_contact_with_highest_priority(
+                data['account'], data['jid'])
+            if contact:
+                sort_data[(data['account'], data['jid'])] = (data.get('order'),
+                    contact.show, contact.priority)
+            else:
+                sort_data[(data['account'], data['jid'])] = (data.get('order'),
+                    None, None)
+        members = frozenset(sort_data)
+        cached = self._sorted_families.get(members)
+        if cached and cached[0] == sort_data:
+            ranks = cached[1]
+            family.sort(key=lambda data: ranks[(data['account'], data['jid'])])
+        else:
+            family.sort(key=cmp_to_key(self._compare_metacontacts))
+            ranks = {}
+            for i, data in enumerate(family):
+                ranks[(data['account'], data['jid'])] = i
+            self._sorted_families[members] = (sort_data, ranks)
         return family[-1]
 
 
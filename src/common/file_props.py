@@ -19,6 +19,15 @@ True
 
 class FilesProp:
     _files_props = {}
+    # Secondary indexes of _files_props, each value is a list of file_props in
+    # the order they were added. They are kept up to date by setFileProp,
+    # deleteFileProp and the properties of FileProp.
+    _by_account = {}
+    _by_sid = {}
+    _by_type = {}
+    _by_transport_sid = {}
+    # Incremented each time a file_props is added
+    _added = 0
 
     def __init__(self):
         raise Exception('this class should not be instatiated')
@@ -31,43 +40,29 @@ class FilesProp:
 
     @classmethod
     def getFileProp(cls, account, sid):
-        if (account, sid) in cls._files_props.keys():
-            return cls._files_props[account, sid]
+        return cls._files_props.get((account, sid))
 
     @classmethod
     def getFilePropByAccount(cls, account):
         # Returns a list of file_props in one account
-        file_props = []
-        for account, sid in cls._files_props:
-            if account == account:
-                file_props.append(cls._files_props[account, sid])
-        return file_props
+        return list(cls._by_account.get(account, []))
 
     @classmethod
     def getFilePropByType(cls, type_, sid):
         # This method should be deleted. Getting fileprop by type and sid is not
         # unique enough. More than one fileprop might have the same type and sid
-        files_prop = cls.getAllFileProp()
-        for fp in files_prop:
-            if fp.type_ == type_ and fp.sid == sid:
-                return fp
+        return cls._get_first(cls._by_type, (type_, sid))
 
     @classmethod
     def getFilePropBySid(cls, sid):
         # This method should be deleted. It is kept to make things compatible
         # This method should be replaced and instead get the file_props by
         # account and sid
-        files_prop = cls.getAllFileProp()
-        for fp in files_prop:
-            if fp.sid == sid:
-                return fp
+        return cls._get_first(cls._by_sid, sid)
 
     @classmethod
     def getFilePropByTransportSid(cls, account, sid):
-        files_prop = cls.getAllFileProp()
-        for fp in files_prop:
-            if fp.account == account and fp.transport_sid == sid:
-                return fp
+        return cls._get_first(cls._by_transport_sid, (account, sid))
 
     @classmethod
     def getAllFileProp(cls):
@@ -75,19 +70,71 @@ class FilesProp:
 
     @classmethod
     def setFileProp(cls, fp, account, sid):
+        old_fp = cls._files_props.get((account, sid))
+        if old_fp is not None:
+            cls._unindex(old_fp)
         cls._files_props[account, sid] = fp
+        cls._added += 1
+        fp._added = cls._added
+        cls._index(fp)
 
     @classmethod
     def deleteFileProp(cls, file_prop):
-        files_props = cls._files_props
-        a = s = None
-        for account, sid in files_props:
-            fp = files_props[account, sid]
-            if fp is file_prop:
-                a = account
-                s = sid
-        if a != None and s != None:
-            del files_props[a, s]
+        key = (file_prop.account, file_prop.sid)
+        if cls._files_props.get(key) is file_prop:
+            del cls._files_props[key]
+            cls._unindex(file_prop)
+
+    @classmethod
+    def isFilePropIndexed(cls, fp):
+        return cls._files_props.get((fp.account, fp.sid)) is fp
+
+    @classmethod
+    def _get_first(cls, index, key):
+        file_props = index.get(key)
+        if file_props:
+            return file_props[0]
+
+    @classmethod
+    def _index_keys(cls, fp):
+        return ((cls._by_account, fp.account), (cls._by_sid, fp.sid),
+            (cls._by_type, (fp.type_, fp.sid)),
+            (cls._by_transport_sid, (fp.account, fp.transport_sid)))
+
+    @classmethod
+    def _index(cls, fp):
+        for index, key in cls._index_keys(fp):
+            index.setdefault(key, []).append(fp)
+
+    @classmethod
+    def _unindex(cls, fp):
+        for index, key in cls._index_keys(fp):
+            cls._remove(index, key, fp)
+
+    @classmethod
+    def _reindex(cls, fp, old_keys):
+        # Move fp in the indexes whose key changed, where it would be if it
+        # had been added with these keys
+        for (index, old_key), (_, key) in zip(old_keys,
+        cls._index_keys(fp)):
+            if key == old_key:
+                continue
+            cls._remove(index, old_key, fp)
+            file_props = index.setdefault(key, [])
+            i = len(file_props)
+            while i and file_props[i - 1]._added > fp._added:
+                i -= 1
+            file_props.insert(i, fp)
+
+    @staticmethod
+    def _remove(index, key, fp):
+        file_props = index.get(key, [])
+        for i, fp_ in enumerate(file_props):
+            if fp_ is fp:
+                del file_props[i]
+                break
+        if not file_props and key in index:
+            del index[key]
 
 
 class FileProp(object):
@@ -115,7 +162,7 @@ class FileProp(object):
         self.continue_cb = None
         self.sha_str = None
         # transfer type: 's' for sending and 'r' for receiving
-        self.type_ = None
+        self._type = None
         self.error = None
         # Elapsed time of the file transfer
         self.elapsed_time = 0
@@ -132,13 +179,15 @@ class FileProp(object):
         self.tt_account = None
         self.size = None
         self._sid = sid
-        self.transport_sid = None
+        self._transport_sid = None
         self.account = account
         self.mime_type = None
         self.algo = None
         self.direction = None
         self.syn_id = None
         self.seq = None
+        # ids of In-Band Bytestream data stanzas not acknowledged yet
+        self.pending_ibb_acks = set()
         self.hash_ = None
         self.fd = None
         self.startexmpp = None
@@ -147,6 +196,8 @@ class FileProp(object):
         self.request_id = None
         self.proxyhosts = None
         self.dstaddr = None
+        # When it was added to FilesProp, to keep its indexes in order
+        self._added = None
 
     def getsid(self):
         # Getter of the property sid
@@ -154,13 +205,40 @@ class FileProp(object):
 
     def setsid(self, value):
         # The sid value will change
-        # we need to change the in _files_props key as well
-        del FilesProp._files_props[self.account, self._sid]
+        # we need to change the in _files_props key as well (KeyError if it
+        # is not there)
+        FilesProp.deleteFileProp(FilesProp._files_props[self.account,
+            self._sid])
         self._sid = value
-        FilesProp._files_props[self.account, self._sid] = self
+        FilesProp.setFileProp(self, self.account, self._sid)
 
     sid = property(getsid, setsid)
 
+    def _set_indexed_attr(self, name, value):
+        # Keep the indexes of FilesProp up to date
+        if not FilesProp.isFilePropIndexed(self):
+            setattr(self, name, value)
+            return
+        old_keys = FilesProp._index_keys(self)
+        setattr(self, name, value)
+        FilesProp._reindex(self, old_keys)
+
+    def gettype(self):
+        return self._type
+
+    def settype(self, value):
+        self._set_indexed_attr('_type', value)
+
+    type_ = property(gettype, settype)
+
+    def gettransport_sid(self):
+        return self._transport_sid
+
+    def settransport_sid(self, value):
+        self._set_indexed_attr('_transport_sid', value)
+
+    transport_sid = property(gettransport_sid, settransport_sid)
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -58,6 +58,7 @@ gajimpaths = configpaths.gajimpaths
 
 VCARD_PATH = gajimpaths['VCARD']
 AVATAR_PATH = gajimpaths['AVATAR']
+IMAGE_CACHE_PATH = gajimpaths['IMAGE_CACHE']
 MY_EMOTS_PATH = gajimpaths['MY_EMOTS']
 MY_ICONSETS_PATH = gajimpaths['MY_ICONSETS']
 MY_MOOD_ICONSETS_PATH = gajimpaths['MY_MOOD_ICONSETS']
@@ -146,6 +147,7 @@ ZEROCONF_ACC_NAME = 'Local'
 # These will be set in gajim.gui_interface.
 idlequeue = None
 socks5queue = None
+image_fetcher = None # Downloads the images of XHTML-IM messages
 
 HAVE_ZEROCONF = True
 try:
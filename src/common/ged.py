@@ -25,6 +25,8 @@ Global Events Dispatcher module.
 :license: GPL
 '''
 
+import bisect
+import time
 import traceback
 
 from nbxmpp import NodeProcessed
@@ -55,40 +57,99 @@ OUT_PRECORE = 90
 OUT_CORE = 100
 OUT_POSTCORE = 110
 
+def handler_name(handler):
+    """
+    Return a readable name for an event handler, used as profiling key
+    """
+    name = getattr(handler, '__qualname__', None) or \
+        getattr(handler, '__name__', None) or repr(handler)
+    module = getattr(handler, '__module__', None)
+    if module:
+        return '%s.%s' % (module, name)
+    return name
+
 class GlobalEventsDispatcher(object):
 
     def __init__(self):
+        # event_name -> list of (priority, handler), sorted by priority
         self.handlers = {}
+        # event_name -> list of priorities, parallel to self.handlers, used to
+        # bisect the insertion point
+        self._priorities = {}
+        self.profiling = False
+        # (event_name, handler name) -> [number of calls, cumulative time]
+        self._stats = {}
+        # incremented each time a handler is registered or removed, so
+        # listeners can tell when cached information is outdated
+        self.version = 0
 
     def register_event_handler(self, event_name, priority, handler):
         if event_name in self.handlers:
-            handlers_list = self.handlers[event_name]
-            i = 0
-            for i, h in enumerate(handlers_list):
-                if priority < h[0]:
-                    break
-            else:
-                # no event with smaller prio found, put it at the end
-                i += 1
-
-            handlers_list.insert(i, (priority, handler))
+            priorities = self._priorities[event_name]
+            # insert after handlers with the same priority, so they are called
+            # in registration order
+            i = bisect.bisect_right(priorities, priority)
+            priorities.insert(i, priority)
+            self.handlers[event_name].insert(i, (priority, handler))
         else:
             self.handlers[event_name] = [(priority, handler)]
+            self._priorities[event_name] = [priority]
+        self.version += 1
 
     def remove_event_handler(self, event_name, priority, handler):
         if event_name in self.handlers:
             try:
-                self.handlers[event_name].remove((priority, handler))
+                i = self.handlers[event_name].index((priority, handler))
             except ValueError as error:
                 log.warning('''Function (%s) with priority "%s" never registered
                 as handler of event "%s". Couldn\'t remove. Error: %s'''
                                   %(handler, priority, event_name, error))
+                return
+            del self.handlers[event_name][i]
+            del self._priorities[event_name][i]
+            self.version += 1
+
+    def has_handlers(self, event_name):
+        return bool(self.handlers.get(event_name))
+
+    def enable_profiling(self, enable=True):
+        """
+        Start or stop recording the number of calls and time spent in each
+        event handler
+        """
+        self.profiling = enable
+
+    def reset_profiling_stats(self):
+        self._stats = {}
+
+    def get_profiling_stats(self):
+        """
+        Return a list of (event_name, handler name, calls, cumulative time in
+        seconds), most expensive first
+        """
+        stats = [(event_name, name, calls, total) for (event_name, name), \
+            (calls, total) in self._stats.items()]
+        stats.sort(key=lambda s: s[3], reverse=True)
+        return stats
+
+    def _record(self, event_name, handler, duration):
+        key = (event_name, handler_name(handler))
+        stat = self._stats.get(key)
+        if stat is None:
+            self._stats[key] = [1, duration]
+        else:
+            stat[0] += 1
+            stat[1] += duration
 
     def raise_event(self, event_name, *args, **kwargs):
-        log.debug('%s Args: %s'%(event_name, str(args)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s Args: %s'%(event_name, str(args)))
         if event_name in self.handlers:
             node_processed = False
+            profiling = self.profiling
             for priority, handler in self.handlers[event_name]:
+                if profiling:
+                    start = time.perf_counter()
                 try:
                     if handler(*args, **kwargs):
                         return True
@@ -98,5 +159,9 @@ class GlobalEventsDispatcher(object):
                     log.error('Error while running an even handler: %s' % \
                         handler)
                     traceback.print_exc()
+                finally:
+                    if profiling:
+                        self._record(event_name, handler,
+                            time.perf_counter() - start)
             if node_processed:
                 raise NodeProcessed
@@ -38,6 +38,8 @@ if HAVE_GPG:
             self.passphrase = None
             self.use_agent = use_agent
             self.always_trust = [] # list of keyID to always trust
+            # keyID -> hash algorithm of its last valid signature
+            self.hash_algorithms = {}
 
         def _setup_my_options(self):
             self.options.armor = 1
@@ -93,12 +95,22 @@ if HAVE_GPG:
                 return 'KEYEXPIRED'
             return 'BAD_PASSPHRASE'
 
-        def verify(self, str_, sign):
+        def verify(self, str_, sign, keyID=None):
+            """
+            Return the keyID of the key that made sign, or ''
+
+            keyID is the key expected to have signed, the hash algorithm it
+            used last is tried first.
+            """
             if str_ is None:
                 return ''
             # Hash algorithm is not transfered in the signed presence stanza so try
             # all algorithms. Text name for hash algorithms from RFC 4880 - section 9.4
             hash_algorithms = ['SHA512', 'SHA384', 'SHA256', 'SHA224', 'SHA1', 'RIPEMD160']
+            last_algo = self.hash_algorithms.get(keyID)
+            if last_algo:
+                hash_algorithms.remove(last_algo)
+                hash_algorithms.insert(0, last_algo)
             for algo in hash_algorithms:
                 data = os.linesep.join(
                     ['-----BEGIN PGP SIGNED MESSAGE-----',
@@ -109,6 +121,7 @@ if HAVE_GPG:
                     )
                 result = super(GnuPG, self).verify(data)
                 if result.valid:
+                    self.hash_algorithms[result.key_id] = algo
                     return result.key_id
 
             return ''
@@ -31,6 +31,7 @@
 
 import sys
 import re
+import locale
 import os
 import subprocess
 import urllib
@@ -71,6 +72,9 @@ log = logging.getLogger('gajim.c.helpers')
 
 special_groups = (_('Transports'), _('Not in Roster'), _('Observers'), _('Groupchats'))
 
+# Size of the reads when downloading an image
+IMG_CHUNK_SIZE = 64 * 1024
+
 class InvalidFormat(Exception):
     pass
 
@@ -348,6 +352,31 @@ def get_sorted_keys(adict):
     keys = sorted(adict.keys())
     return keys
 
+def _get_sort_digits(number):
+    digits = str(int(number))
+    # the number of digits first so 9 goes before 10
+    return str(len(digits)) + digits
+
+def get_sort_key(*parts):
+    """
+    Return a string of digits that sorts like the tuple of parts, strings
+    being compared with locale.strcoll()
+
+    Parts are positive integers and strings. Rows of a Gtk.TreeStore can be
+    sorted on a column holding such keys with its default sort function: it
+    compares strings with g_utf8_collate(), which sorts digits like strcmp().
+    """
+    key = []
+    for part in parts:
+        if isinstance(part, int):
+            key.append(_get_sort_digits(part))
+        else:
+            for char in locale.strxfrm(part):
+                key.append(_get_sort_digits(ord(char)))
+            # ends the string, shorter than any character
+            key.append('0')
+    return ''.join(key)
+
 def to_one_line(msg):
     msg = msg.replace('\\', '\\\\')
     msg = msg.replace('\n', '\\n')
@@ -1395,6 +1424,12 @@ def get_proxy_info(account):
             proxy[key] = proxyptr[key]
         return proxy
 
+def _get_img_alt(attrs, reason):
+    alt = attrs.get('alt', '')
+    if alt:
+        alt += '\n'
+    return alt + reason
+
 def _get_img_direct(attrs):
     """
     Download an image. This function should be launched in a separated thread.
@@ -1404,53 +1439,57 @@ def _get_img_direct(attrs):
     max_size = 2*1024*1024
     if 'max_size' in attrs:
         max_size = attrs['max_size']
-    # Wait maximum 10s for connection
-    socket.setdefaulttimeout(10)
     try:
         req = urllib.request.Request(attrs['src'])
         req.add_header('User-Agent', 'Gajim ' + gajim.version)
-        f = urllib.request.urlopen(req)
+        # Wait maximum 10s for connection and then for each read
+        f = urllib.request.urlopen(req, timeout=10)
     except Exception as ex:
         log.debug('Error loading image %s ' % attrs['src']  + str(ex))
-        pixbuf = None
         alt = attrs.get('alt', 'Broken image')
-    else:
-        # Wait 2s between each byte
+        return (mem, alt)
+    with f:
         try:
-            f.fp._sock.fp._sock.settimeout(2)
-        except Exception:
-            pass
+            length = int(f.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            length = None
+        if length is not None and length > max_size:
+            return (mem, _get_img_alt(attrs, _('Image is too big')))
+        # Read into a buffer of the announced size, or one that doubles when
+        # it is full, so the image is not copied for each chunk
+        if length is not None:
+            buf = bytearray(length)
+        else:
+            buf = bytearray(min(max_size + 1, IMG_CHUNK_SIZE))
+        view = memoryview(buf)
+        received = 0
         # On a slow internet connection with ~1000kbps you need ~10 seconds for 1 MB
         deadline = time.time() + (10 * (max_size / 1048576))
         while True:
             if time.time() > deadline:
                 log.debug('Timeout loading image %s ' % attrs['src'])
-                mem = ''
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Timeout loading image')
-                break
+                return (b'', _get_img_alt(attrs, _('Timeout loading image')))
+            if received == len(buf):
+                if length is not None:
+                    break
+                if len(buf) > max_size:
+                    return (b'', _get_img_alt(attrs, _('Image is too big')))
+                view.release()
+                buf.extend(bytes(min(len(buf), max_size + 1 - len(buf))))
+                view = memoryview(buf)
             try:
-                temp = f.read(100)
+                read = f.readinto(view[received:received + IMG_CHUNK_SIZE])
             except socket.timeout as ex:
                 log.debug('Timeout loading image %s ' % attrs['src'] + str(ex))
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Timeout loading image')
-                break
-            if temp:
-                mem += temp
-            else:
-                break
-            if len(mem) > max_size:
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Image is too big')
+                return (b'', _get_img_alt(attrs, _('Timeout loading image')))
+            except Exception as ex:
+                log.debug('Error loading image %s ' % attrs['src']  + str(ex))
+                return (b'', attrs.get('alt', 'Broken image'))
+            if not read:
                 break
-        f.close()
+            received += read
+        mem = bytes(view[:received])
+        view.release()
     return (mem, alt)
 
 def _get_img_proxy(attrs, proxy):
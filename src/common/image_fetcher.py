@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+## src/common/image_fetcher.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim. If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Download the images of XHTML-IM messages in a few threads and keep them in a
+cache on disk
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import GLib
+
+from common import gajim
+from common import helpers
+
+log = logging.getLogger('gajim.c.image_fetcher')
+
+# Number of images downloaded at the same time
+MAX_DOWNLOADS = 3
+
+class ImageCache:
+    """
+    Images stored in files named after the SHA-1 of their URL
+
+    When the cache is bigger than the image_cache_size option, the least
+    recently used images are removed. The modification time of the files is
+    updated when they are used, so the order is kept between runs. Used from
+    the download threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # {file name: size}, least recently used first
+        self._files = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def get_name(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        files = []
+        try:
+            names = os.listdir(self.path)
+        except OSError as e:
+            log.debug('Cannot list image cache %s: %s' % (self.path, e))
+            names = []
+        for name in names:
+            if name.endswith('.tmp'):
+                # left by an interrupted write
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+        self._files = OrderedDict()
+        for mtime, name, size in sorted(files):
+            self._files[name] = size
+            self.size += size
+
+    def _get_max_size(self):
+        return gajim.config.get('image_cache_size') * 1024 * 1024
+
+    def _evict(self, max_size):
+        while self.size > max_size and self._files:
+            name, size = self._files.popitem(last=False)
+            self.size -= size
+            self.evicted += 1
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError as e:
+                log.debug('Cannot remove cached image %s: %s' % (name, e))
+
+    def get(self, url):
+        """
+        Return the cached image of url, or None
+        """
+        name = self.get_name(url)
+        with self._lock:
+            if self._files is None:
+                self._load()
+            if name not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(name)
+            self.hits += 1
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError as e:
+            log.debug('Cannot read cached image %s: %s' % (url, e))
+            with self._lock:
+                size = self._files.pop(name, None)
+                if size is not None:
+                    self.size -= size
+            return None
+        return data
+
+    def set(self, url, data):
+        """
+        Store the image of url, unless it is bigger than the whole cache
+        """
+        max_size = self._get_max_size()
+        if len(data) > max_size:
+            return
+        name = self.get_name(url)
+        path = os.path.join(self.path, name)
+        tmp_path = path + '.%d.tmp' % threading.get_ident()
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.debug('Cannot cache image %s: %s' % (url, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._files is None:
+                self._load()
+            else:
+                self.size -= self._files.pop(name, 0)
+                self._files[name] = len(data)
+                self.size += len(data)
+            self._evict(max_size)
+
+    def get_stats(self):
+        """
+        Return a dict with the number and size of the cached images and the
+        hit / miss counters
+        """
+        with self._lock:
+            images = len(self._files or ())
+        total = self.hits + self.misses
+        return {'images': images, 'size': self.size // 1024,
+            'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted,
+            'hit_rate': 100.0 * self.hits / total if total else 0.0}
+
+
+class ImageFetcher:
+    """
+    Get the images of XHTML-IM messages from the cache, or download them with
+    at most MAX_DOWNLOADS threads
+    """
+
+    def __init__(self, cache_path):
+        self.cache = ImageCache(cache_path)
+        self._executor = ThreadPoolExecutor(max_workers=MAX_DOWNLOADS)
+
+    def _get_image(self, account, attrs):
+        url = attrs['src']
+        mem = self.cache.get(url)
+        if mem is not None:
+            return (mem, '')
+        mem, alt = helpers.download_image(account, attrs)
+        if mem:
+            self.cache.set(url, mem)
+        return (mem, alt)
+
+    def fetch(self, account, attrs, callback, *args):
+        """
+        Get the image at attrs['src'] in another thread
+
+        callback is called from the GLib main loop with (mem, alt) like
+        helpers.download_image returns, followed by args.
+        """
+        def on_done(future):
+            try:
+                output = future.result()
+            except Exception as e:
+                log.error('Error loading image %s: %s' % (attrs['src'], e))
+                output = (b'', attrs.get('alt', 'Broken image'))
+            GLib.idle_add(callback, output, *args)
+
+        future = self._executor.submit(self._get_image, account, attrs)
+        future.add_done_callback(on_done)
+        return future
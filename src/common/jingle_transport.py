@@ -341,7 +341,14 @@ class JingleTransportIBB(JingleTransport):
         if block_sz:
             self.block_sz = block_sz
         else:
-            self.block_sz = '4096'
+            self.block_sz = str(gajim.config.get('ft_ibb_block_size'))
+            if node and node.getAttr('block-size'):
+                # use the block size asked by the contact if it is smaller
+                try:
+                    self.block_sz = str(min(int(node.getAttr('block-size')),
+                        int(self.block_sz)))
+                except ValueError:
+                    pass
 
         self.connection = None
         self.sid = None
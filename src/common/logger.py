@@ -31,8 +31,17 @@ This module allows to access the on-disk database of logs
 import os
 import sys
 import time
+import base64
+import binascii
+import hashlib
 import datetime
 import json
+import queue
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import Future
 from gzip import GzipFile
 from io import BytesIO
 from gi.repository import GLib
@@ -96,11 +105,342 @@ class SubscriptionConstant(IntEnum):
     FROM = 2
     BOTH = 3
 
+# Full-text index over logs.message and logs.subject. It is an external content
+# FTS5 table, so it only stores the index, and triggers keep it in sync with
+# every INSERT / UPDATE / DELETE done on logs (by Logger or history_manager)
+LOGS_FTS_SCHEMA = '''
+    DROP TRIGGER IF EXISTS logs_fts_ai;
+    DROP TRIGGER IF EXISTS logs_fts_ad;
+    DROP TRIGGER IF EXISTS logs_fts_au;
+    DROP TABLE IF EXISTS logs_fts;
+
+    CREATE VIRTUAL TABLE logs_fts USING fts5(
+            message,
+            subject,
+            content='logs',
+            content_rowid='log_line_id'
+    );
+
+    CREATE TRIGGER logs_fts_ai AFTER INSERT ON logs BEGIN
+        INSERT INTO logs_fts(rowid, message, subject)
+        VALUES (new.log_line_id, new.message, new.subject);
+    END;
+
+    CREATE TRIGGER logs_fts_ad AFTER DELETE ON logs BEGIN
+        INSERT INTO logs_fts(logs_fts, rowid, message, subject)
+        VALUES ('delete', old.log_line_id, old.message, old.subject);
+    END;
+
+    CREATE TRIGGER logs_fts_au AFTER UPDATE ON logs BEGIN
+        INSERT INTO logs_fts(logs_fts, rowid, message, subject)
+        VALUES ('delete', old.log_line_id, old.message, old.subject);
+        INSERT INTO logs_fts(rowid, message, subject)
+        VALUES (new.log_line_id, new.message, new.subject);
+    END;
+    '''
+
+# vCards in the cache database. data is the vCard as a JSON dict without the
+# photo, the photos are stored once per SHA-1 of their data
+VCARDS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS vcards(
+            jid TEXT,
+            nick TEXT,
+            data TEXT,
+            photo_sha TEXT,
+            PRIMARY KEY (jid, nick)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_vcards_photo_sha ON vcards (photo_sha);
+
+    CREATE TABLE IF NOT EXISTS vcard_photos(
+            sha TEXT PRIMARY KEY,
+            data BLOB
+    );
+    '''
+
+def store_vcard(cur, jid, nick, vcard):
+    """
+    Write vcard, a dict like ConnectionVcard._node_to_dict returns, for jid
+    (nick is '' if jid is not a room) with the cursor cur
+    """
+    vcard = dict(vcard)
+    photo_sha = None
+    photo = vcard.get('PHOTO')
+    if isinstance(photo, dict) and photo.get('BINVAL'):
+        try:
+            photo_data = base64.b64decode(photo['BINVAL'].encode('utf-8'))
+        except (binascii.Error, ValueError):
+            photo_data = None
+        if photo_data:
+            photo_sha = hashlib.sha1(photo_data).hexdigest()
+            vcard['PHOTO'] = dict(photo)
+            del vcard['PHOTO']['BINVAL']
+            cur.execute('INSERT OR IGNORE INTO vcard_photos (sha, data) '
+                'VALUES (?, ?)', (photo_sha, memoryview(photo_data)))
+    cur.execute('SELECT photo_sha FROM vcards WHERE jid = ? AND nick = ?',
+        (jid, nick))
+    row = cur.fetchone()
+    cur.execute('REPLACE INTO vcards (jid, nick, data, photo_sha) '
+        'VALUES (?, ?, ?, ?)', (jid, nick, json.dumps(vcard), photo_sha))
+    if row and row[0] != photo_sha:
+        remove_unused_vcard_photo(cur, row[0])
+
+def remove_unused_vcard_photo(cur, photo_sha):
+    if photo_sha is None:
+        return
+    cur.execute('DELETE FROM vcard_photos WHERE sha = ? AND NOT EXISTS '
+        '(SELECT 1 FROM vcards WHERE photo_sha = ?)', (photo_sha, photo_sha))
+
+# Rows queued with Logger.queue_write() are written at most LOG_BATCH_LATENCY ms
+# later, or as soon as LOG_BATCH_SIZE rows are waiting
+LOG_BATCH_LATENCY = 500
+LOG_BATCH_SIZE = 500
+
+# How many logs rows are indexed per transaction when building the index for
+# an existing database
+LOGS_FTS_BUILD_CHUNK = 10000
+
+# Index of the archive ids of messages, only the rows that have one are in it
+LOGS_STANZA_ID_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_logs_stanza_id ON logs (stanza_id)
+    WHERE stanza_id IS NOT NULL;
+    '''
+
+# Number of archive ids of saved messages kept in memory to detect duplicates
+# without querying the database
+RECENT_STANZA_IDS_SIZE = 10000
+
+# Messages from server archives are duplicates of logged ones if they have the
+# same text and are less than that many seconds apart
+ARCHIVE_DUPLICATE_WINDOW = 300
+
+def fts5_available():
+    """
+    Return True if the sqlite library has been built with FTS5 support
+    """
+    con = sqlite.connect(':memory:')
+    try:
+        con.execute('CREATE VIRTUAL TABLE fts_test USING fts5(content)')
+    except sqlite.OperationalError:
+        return False
+    finally:
+        con.close()
+    return True
+
+def has_fts_index(cur):
+    """
+    Return True if the logs full-text index exists in the database of cur
+    """
+    try:
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'logs_fts'")
+    except sqlite.DatabaseError:
+        return False
+    return cur.fetchone() is not None
+
+def build_fts_index(con):
+    """
+    Create the logs full-text index and fill it with existing rows
+
+    Rows are indexed by chunks of LOGS_FTS_BUILD_CHUNK, each one in its own
+    transaction, so that a huge history doesn't need a huge journal.
+    """
+    cur = con.cursor()
+    cur.executescript(LOGS_FTS_SCHEMA)
+    con.commit()
+    cur.execute('SELECT MAX(log_line_id) FROM logs')
+    max_id = cur.fetchone()[0] or 0
+    last_id = 0
+    while last_id < max_id:
+        cur.execute('''
+            INSERT INTO logs_fts(rowid, message, subject)
+            SELECT log_line_id, message, subject FROM logs
+            WHERE log_line_id > ? AND log_line_id <= ?
+            ''', (last_id, last_id + LOGS_FTS_BUILD_CHUNK))
+        con.commit()
+        last_id += LOGS_FTS_BUILD_CHUNK
+        log.info('Full-text index: %d / %d log lines indexed',
+            min(last_id, max_id), max_id)
+
+def build_fts_query(text):
+    """
+    Convert what the user typed into a FTS5 MATCH expression
+
+    Words between double quotes are searched as a phrase, other words are
+    searched as prefixes, so that "hel wor" matches "Hello world". Every token
+    is quoted so that FTS5 operators and special characters typed by the user
+    can't produce an invalid query. Like the LIKE search, only the message
+    column is searched, not the subject.
+    """
+    terms = []
+    parts = text.split('"')
+    for i, part in enumerate(parts):
+        if i % 2:
+            # inside quotes: a phrase
+            if part.strip():
+                terms.append('"%s"' % part.strip())
+            continue
+        for word in part.split():
+            word = word.rstrip('*')
+            if word:
+                terms.append('"%s"*' % word)
+    if not terms:
+        return ''
+    return 'message : (%s)' % ' '.join(terms)
+
+# Number of jids kept in memory by JidCache
+JID_CACHE_SIZE = 20000
+# Minimum interval (in seconds) between two checks that the jids table was not
+# changed by another process (history manager)
+JID_CACHE_CHECK_INTERVAL = 1
+
+class JidCache:
+    """
+    Bounded LRU cache of the jids table: jid -> (jid_id, type)
+    """
+    def __init__(self, size=JID_CACHE_SIZE):
+        self.size = size
+        self._jids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._jids)
+
+    def get(self, jid):
+        """
+        Return (jid_id, type) or None if jid is not in cache
+        """
+        try:
+            value = self._jids[jid]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._jids.move_to_end(jid)
+        self.hits += 1
+        return value
+
+    def set(self, jid, jid_id, type_):
+        self._jids[jid] = (jid_id, type_)
+        self._jids.move_to_end(jid)
+        if len(self._jids) > self.size:
+            self._jids.popitem(last=False)
+
+    def preload(self, rows):
+        """
+        Fill the cache with (jid, jid_id, type) rows. When there are more rows
+        than the cache size, the last ones are kept.
+        """
+        self.clear()
+        for jid, jid_id, type_ in rows:
+            self.set(jid, jid_id, type_)
+
+    def remove(self, jid):
+        self._jids.pop(jid, None)
+
+    def remove_jid_id(self, jid_id):
+        for jid, value in list(self._jids.items()):
+            if value[0] == jid_id:
+                del self._jids[jid]
+
+    def clear(self):
+        self._jids.clear()
+
+    def get_stats(self):
+        """
+        Return a dict with the cache size and its hit / miss counters
+        """
+        total = self.hits + self.misses
+        return {'size': len(self._jids), 'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0}
+
+class DatabaseWorker(threading.Thread):
+    """
+    Thread that owns the sqlite connection and runs database requests one
+    after the other, in the order they were submitted
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, name='gajim-db-worker')
+        self.daemon = True
+        self._requests = queue.Queue()
+
+    def run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            future, func, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def is_current(self):
+        return threading.current_thread() is self
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) and return a concurrent.futures.Future
+        """
+        future = Future()
+        self._requests.put((future, func, args, kwargs))
+        return future
+
+    def stop(self):
+        """
+        Stop the thread once all already queued requests are done
+        """
+        self._requests.put(None)
+
+def in_db_thread(func):
+    """
+    Decorator for Logger methods that access the database
+
+    When called from another thread the call is run in the database thread and
+    the caller waits for the result, so the synchronous API stays the same.
+    Generators are consumed in the database thread.
+    """
+    is_generator = inspect.isgeneratorfunction(func)
+
+    def run(self, *args, **kwargs):
+        if is_generator:
+            return list(func(self, *args, **kwargs))
+        return func(self, *args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.worker is None or self.worker.is_current():
+            result = run(self, *args, **kwargs)
+        else:
+            result = self.worker.submit(run, self, *args, **kwargs).result()
+        if is_generator:
+            return iter(result)
+        return result
+    return wrapper
+
 class Logger:
     def __init__(self):
         self.jids_already_in = [] # holds jids that we already have in DB
+        self.jid_cache = JidCache()
+        self._data_version = None
+        self._data_version_checked = 0
         self.con = None
         self.commit_timout_id = None
+        self.fts_available = False
+        # rows queued by queue_write(), protected by _batch_lock
+        self._batch = []
+        self._batch_lock = threading.Lock()
+        self._batch_timeout_id = None
+        # archive ids of the messages saved by save_many(), oldest first. Only
+        # used in the database thread
+        self.recent_stanza_ids = OrderedDict()
+        self.worker = DatabaseWorker()
+        self.worker.start()
 
         if not os.path.exists(LOG_DB_PATH):
             # this can happen only the first time (the time we create the db)
@@ -115,12 +455,40 @@ class Logger:
         gajim.ged.register_event_handler('gc-message-received',
             ged.POSTCORE, self._nec_gc_message_received)
 
+    def run_async(self, func, *args, callback=None, error_callback=None,
+    **kwargs):
+        """
+        Run func (usually a Logger method) in the database thread
+
+        callback is called with the result, or error_callback with the
+        exception, from the GLib main loop. Return a
+        concurrent.futures.Future.
+        """
+        def on_done(future):
+            if future.cancelled():
+                return
+            exception = future.exception()
+            if exception is not None:
+                if error_callback:
+                    GLib.idle_add(error_callback, exception)
+                else:
+                    log.error('Database request %s failed: %s' % (
+                        func.__name__, exception))
+            elif callback:
+                GLib.idle_add(callback, future.result())
+
+        future = self.worker.submit(func, *args, **kwargs)
+        future.add_done_callback(on_done)
+        return future
+
+    @in_db_thread
     def close_db(self):
         if self.con:
             self.con.close()
         self.con = None
         self.cur = None
 
+    @in_db_thread
     def open_db(self):
         self.close_db()
 
@@ -137,8 +505,11 @@ class Logger:
                 isolation_level='IMMEDIATE')
         os.chdir(back)
         self.cur = self.con.cursor()
+        self.set_journal_mode_wal()
         self.set_synchronous(False)
+        self.get_jids_already_in_db()
 
+    @in_db_thread
     def attach_cache_database(self):
         try:
             self.cur.execute("ATTACH DATABASE '%s' AS cache" % \
@@ -146,6 +517,18 @@ class Logger:
         except sqlite.Error as e:
             log.debug("Failed to attach cache database: %s" % str(e))
 
+    @in_db_thread
+    def set_journal_mode_wal(self):
+        """
+        Use a write-ahead log: writers don't block readers and a commit only
+        appends to the log instead of rewriting database pages
+        """
+        try:
+            self.cur.execute('PRAGMA journal_mode = WAL')
+        except sqlite.Error as e:
+            log.debug('Failed to set WAL journal mode: %s' % str(e))
+
+    @in_db_thread
     def set_synchronous(self, sync):
         try:
             if sync:
@@ -155,10 +538,12 @@ class Logger:
         except sqlite.Error as e:
             log.debug("Failed to set_synchronous(%s): %s" % (sync, str(e)))
 
+    @in_db_thread
     def init_vars(self):
         self.open_db()
-        self.get_jids_already_in_db()
+        self.fts_available = has_fts_index(self.cur)
 
+    @in_db_thread
     def _really_commit(self):
         try:
             self.con.commit()
@@ -167,11 +552,16 @@ class Logger:
         self.commit_timout_id = None
         return False
 
+    def _on_commit_timeout(self):
+        self.worker.submit(self._really_commit)
+        return False
+
     def _timeout_commit(self):
         if self.commit_timout_id:
             return
-        self.commit_timout_id = GLib.timeout_add(500, self._really_commit)
+        self.commit_timout_id = GLib.timeout_add(500, self._on_commit_timeout)
 
+    @in_db_thread
     def simple_commit(self, sql_to_commit):
         """
         Helper to commit
@@ -179,25 +569,66 @@ class Logger:
         self.cur.execute(sql_to_commit)
         self._timeout_commit()
 
+    @in_db_thread
     def get_jids_already_in_db(self):
         try:
-            self.cur.execute('SELECT jid FROM jids')
-            # list of tupples: [('aaa@bbb',), ('cc@dd',)]
+            self.cur.execute('SELECT jid, jid_id, type FROM jids ORDER BY jid_id')
+            # list of tupples: [('aaa@bbb', 1, 0), ('cc@dd', 2, 1)]
             rows = self.cur.fetchall()
         except sqlite.DatabaseError:
             raise exceptions.DatabaseMalformed
         self.jids_already_in = []
         for row in rows:
-            # row[0] is first item of row (the only result here, the jid)
+            # row[0] is first item of row, the jid
             if row[0] == '':
                 # malformed jid, ignore line
                 pass
             else:
                 self.jids_already_in.append(row[0])
+        self.jid_cache.preload(row for row in rows if row[0])
+        self._data_version = self._get_data_version()
+        self._data_version_checked = time.time()
+
+    def _get_data_version(self):
+        try:
+            self.cur.execute('PRAGMA data_version')
+        except sqlite.Error:
+            return None
+        return self.cur.fetchone()[0]
+
+    def _check_jid_cache(self):
+        """
+        Reload jids if the database has been modified by another process, the
+        history manager may have removed some of them
+        """
+        now = time.time()
+        if now - self._data_version_checked < JID_CACHE_CHECK_INTERVAL:
+            return
+        self._data_version_checked = now
+        data_version = self._get_data_version()
+        if data_version != self._data_version:
+            log.debug('Database changed by another process, reloading jids')
+            self.get_jids_already_in_db()
+
+    def _get_cached_jid(self, jid):
+        """
+        Return (jid_id, type) of jid, or None if jid is not in DB
+        """
+        self._check_jid_cache()
+        cached = self.jid_cache.get(jid)
+        if cached is not None:
+            return cached
+        self.cur.execute('SELECT jid_id, type FROM jids WHERE jid=?', (jid,))
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        self.jid_cache.set(jid, row[0], row[1])
+        return row
 
     def get_jids_in_db(self):
         return self.jids_already_in
 
+    @in_db_thread
     def jid_is_from_pm(self, jid):
         """
         If jid is gajim@conf/nkour it's likely a pm one, how we know gajim@conf
@@ -214,19 +645,20 @@ class Logger:
             # it's not a full jid, so it's not a pm one
             return False
 
+    @in_db_thread
     def jid_is_room_jid(self, jid):
         """
         Return True if it's a room jid, False if it's not, None if we don't know
         """
-        self.cur.execute('SELECT type FROM jids WHERE jid=?', (jid,))
-        row = self.cur.fetchone()
+        row = self._get_cached_jid(jid)
         if row is None:
             return None
         else:
-            if row[0] == JIDConstant.ROOM_TYPE:
+            if row[1] == JIDConstant.ROOM_TYPE:
                 return True
             return False
 
+    @in_db_thread
     def get_jid_id(self, jid, typestr=None):
         """
         jids table has jid and jid_id logs table has log_id, jid_id,
@@ -240,11 +672,9 @@ class Logger:
             jid_is_from_pm = self.jid_is_from_pm(jid)
             if not jid_is_from_pm: # it's normal jid with resource
                 jid = jid.split('/', 1)[0] # remove the resource
-        if jid in self.jids_already_in: # we already have jids in DB
-            self.cur.execute('SELECT jid_id FROM jids WHERE jid=?', [jid])
-            row = self.cur.fetchone()
-            if row:
-                return row[0]
+        row = self._get_cached_jid(jid)
+        if row: # we already have jid in DB
+            return row[0]
         # oh! a new jid :), we add it now
         if typestr == 'ROOM':
             typ = JIDConstant.ROOM_TYPE
@@ -253,7 +683,8 @@ class Logger:
         try:
             self.cur.execute('INSERT INTO jids (jid, type) VALUES (?, ?)', (jid,
                     typ))
-            self.con.commit()
+            # committed with the log line that needs it
+            self._timeout_commit()
         except sqlite.IntegrityError:
             # Jid already in DB, maybe added by another instance. re-read DB
             self.get_jids_already_in_db()
@@ -262,6 +693,7 @@ class Logger:
             raise exceptions.PysqliteOperationalError(str(e))
         jid_id = self.cur.lastrowid
         self.jids_already_in.append(jid)
+        self.jid_cache.set(jid, jid_id, typ)
         return jid_id
 
     def convert_human_values_to_db_api_values(self, kind, show):
@@ -402,6 +834,7 @@ class Logger:
         if sub == SubscriptionConstant.BOTH:
             return 'both'
 
+    @in_db_thread
     def commit_to_db(self, values, write_unread=False):
         sql = '''INSERT INTO logs (jid_id, contact_name, time, kind, show,
                 message, subject, additional_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
@@ -424,6 +857,7 @@ class Logger:
             self.insert_unread_events(message_id, values[0])
         return message_id
 
+    @in_db_thread
     def insert_unread_events(self, message_id, jid_id):
         """
         Add unread message with id: message_id
@@ -432,14 +866,21 @@ class Logger:
                 jid_id)
         self.simple_commit(sql)
 
+    @in_db_thread
     def set_read_messages(self, message_ids):
         """
         Mark all messages with ids in message_ids as read
+
+        message_ids can contain the futures returned by write_async().
         """
-        ids = ','.join([str(i) for i in message_ids])
+        message_ids = [self.get_message_id(i) for i in message_ids]
+        ids = ','.join([str(i) for i in message_ids if i is not None])
+        if not ids:
+            return
         sql = 'DELETE FROM unread_messages WHERE message_id IN (%s)' % ids
         self.simple_commit(sql)
 
+    @in_db_thread
     def set_shown_unread_msgs(self, msg_log_id):
         """
         Mark unread message as shown un GUI
@@ -448,6 +889,7 @@ class Logger:
                 msg_log_id
         self.simple_commit(sql)
 
+    @in_db_thread
     def reset_shown_unread_messages(self):
         """
         Set shown field to False in unread_messages table
@@ -455,6 +897,7 @@ class Logger:
         sql = 'UPDATE unread_messages SET shown = 0'
         self.simple_commit(sql)
 
+    @in_db_thread
     def get_unread_msgs(self):
         """
         Get all unread messages
@@ -490,6 +933,7 @@ class Logger:
             all_messages.append(results[0])
         return all_messages
 
+    @in_db_thread
     def write(self, kind, jid, message=None, show=None, tim=None, subject=None, additional_data=None):
         """
         Write a row (status, gcstatus, message etc) to logs database
@@ -504,11 +948,25 @@ class Logger:
                 ROOM_JID/nick if pm-related.
         """
 
-        if additional_data is None:
-            additional_data = {}
         if self.jids_already_in == []: # only happens if we just created the db
             self.open_db()
 
+        result = self._get_log_values(kind, jid, message, show, tim, subject,
+            additional_data)
+        if result is None:
+            return
+        values, write_unread = result
+        return self.commit_to_db(values, write_unread)
+
+    def _get_log_values(self, kind, jid, message, show, tim, subject,
+    additional_data):
+        """
+        Return the values of the logs row to write and if the message must be
+        saved as unread, or None if the row must not be logged
+        """
+        if additional_data is None:
+            additional_data = {}
+
         contact_name_col = None # holds nickname for kinds gcstatus, gc_msg
         # message holds the message unless kind is status or gcstatus,
         # then it holds status message
@@ -575,8 +1033,160 @@ class Logger:
 
         values = (jid_id, contact_name_col, time_col, kind_col, show_col,
                 message_col, subject_col, additional_data_col)
-        return self.commit_to_db(values, write_unread)
+        return values, write_unread
+
+    def write_async(self, kind, jid, message=None, show=None, tim=None,
+    subject=None, additional_data=None, account=None):
+        """
+        Same as write() but run in the database thread without waiting for it
+
+        Return a concurrent.futures.Future of what write() returns, the id of
+        the row if it is saved as unread. account is used to report database
+        errors.
+        """
+        if not tim:
+            tim = time.time()
+        return self.run_async(self.write, kind, jid, message, show, tim,
+            subject, additional_data,
+            error_callback=lambda e: self._on_write_error(e, [account], 1))
+
+    @staticmethod
+    def get_message_id(message_id):
+        """
+        Return message_id, or the id of the row if it is a future returned by
+        write_async() which is done, else None
+        """
+        if not isinstance(message_id, Future):
+            return message_id
+        if not message_id.done() or message_id.cancelled() or \
+        message_id.exception() is not None:
+            return None
+        return message_id.result()
+
+    def queue_write(self, kind, jid, message=None, show=None, tim=None,
+    subject=None, additional_data=None, account=None):
+        """
+        Same as write() but the row is buffered and written later in a single
+        transaction with other queued rows
+
+        Rows are written at most LOG_BATCH_LATENCY ms after being queued, or as
+        soon as LOG_BATCH_SIZE rows are waiting. account is used to report
+        database errors.
+        """
+        if not tim:
+            tim = time.time()
+        with self._batch_lock:
+            self._batch.append((kind, jid, message, show, tim, subject,
+                additional_data, account))
+            if len(self._batch) >= LOG_BATCH_SIZE:
+                self._flush_batch()
+            elif not self._batch_timeout_id:
+                self._batch_timeout_id = GLib.timeout_add(LOG_BATCH_LATENCY,
+                    self._on_batch_timeout)
+
+    def _on_batch_timeout(self):
+        with self._batch_lock:
+            self._batch_timeout_id = None
+            self._flush_batch()
+        return False
+
+    def _flush_batch(self):
+        # Must be called with self._batch_lock held
+        if self._batch_timeout_id:
+            GLib.source_remove(self._batch_timeout_id)
+            self._batch_timeout_id = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        return self.run_async(self._write_batch, batch,
+            error_callback=lambda e: self._on_batch_error(e, batch))
+
+    def flush_pending_writes(self):
+        """
+        Write all queued rows now and wait until they are committed
+        """
+        with self._batch_lock:
+            future = self._flush_batch()
+        if future:
+            try:
+                future.result()
+            except Exception:
+                # Already reported by the error callback
+                pass
+
+    @in_db_thread
+    def _write_batch(self, batch):
+        """
+        Write queued rows in one transaction, new jids included
+
+        A row that cannot be written is skipped and reported, the other rows
+        are still written.
+        """
+        start = time.time()
+        sql = '''INSERT INTO logs (jid_id, contact_name, time, kind, show,
+                message, subject, additional_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+        nb_rows = 0
+        failed_accounts = set()
+        nb_failed = 0
+        error = None
+        for kind, jid, message, show, tim, subject, additional_data, \
+        account in batch:
+            if self.jids_already_in == []:
+                self.open_db()
+            try:
+                result = self._get_log_values(kind, jid, message, show, tim,
+                    subject, additional_data)
+                if result is None:
+                    continue
+                values, write_unread = result
+                if write_unread:
+                    # we need the log_line_id, write it alone
+                    self.commit_to_db(values, write_unread)
+                else:
+                    self.cur.execute(sql, values)
+                    nb_rows += 1
+            except sqlite.OperationalError as e:
+                error = exceptions.PysqliteOperationalError(str(e))
+            except sqlite.DatabaseError:
+                error = exceptions.DatabaseMalformed()
+            except (exceptions.PysqliteOperationalError,
+            exceptions.DatabaseMalformed) as e:
+                error = e
+            else:
+                continue
+            log.warning('Skipping log line of %s: %s' % (jid, error))
+            failed_accounts.add(account)
+            nb_failed += 1
+        try:
+            self.con.commit()
+        except sqlite.OperationalError as e:
+            raise exceptions.PysqliteOperationalError(str(e))
+        except sqlite.DatabaseError:
+            raise exceptions.DatabaseMalformed
+        if nb_failed:
+            GLib.idle_add(self._on_write_error, error, failed_accounts,
+                nb_failed)
+        log.debug('Wrote a batch of %d log lines in %.1f ms' % (nb_rows,
+            (time.time() - start) * 1000))
+
+    def _on_batch_error(self, error, batch):
+        self._on_write_error(error, set(row[7] for row in batch), len(batch))
+
+    def _on_write_error(self, error, accounts, nb_rows):
+        for account in accounts:
+            if account not in gajim.connections:
+                continue
+            conn = gajim.connections[account]
+            if isinstance(error, exceptions.DatabaseMalformed):
+                conn.dispatch('DB_ERROR', (_('Database Error'),
+                    _('The database file (%s) cannot be read. Try to repair '
+                    'it (see http://trac.gajim.org/wiki/DatabaseBackup) or '
+                    'remove it (all history will be lost).') % LOG_DB_PATH))
+            else:
+                conn.dispatch('DB_ERROR', (_('Disk Write Error'), str(error)))
+        log.error('Failed to write %d log lines: %s' % (nb_rows, error))
 
+    @in_db_thread
     def get_last_conversation_lines(self, jid, restore_how_many_rows,
                     pending_how_many, timeout, account):
         """
@@ -626,6 +1236,7 @@ class Logger:
         start_of_day = int(time.mktime(local_time))
         return start_of_day
 
+    @in_db_thread
     def get_conversation_for_date(self, jid, year, month, day, account):
         """
         Return contact_name, time, kind, show, message, subject
@@ -657,6 +1268,7 @@ class Logger:
             entry[6] = json.loads(entry[6])
         return results
 
+    @in_db_thread
     def get_search_results_for_query(self, jid, query, account, year=False,
         month=False, day=False):
         """
@@ -671,37 +1283,45 @@ class Logger:
             # Error trying to create a new jid_id. This means there is no log
             return []
 
-        if False: # query.startswith('SELECT '): # it's SQL query (FIXME)
+        where_sql, jid_tuple = self._build_contact_where(account, jid)
+        time_sql = ''
+        if year:
+            start_of_day = self.get_unix_time_from_date(year, month, day)
+            seconds_in_a_day = 86400 # 60 * 60 * 24
+            last_second_of_day = start_of_day + seconds_in_a_day - 1
+            time_sql = 'AND time BETWEEN %d AND %d' % (start_of_day,
+                last_second_of_day)
+
+        if self.fts_available:
+            fts_query = build_fts_query(query)
+            if not fts_query:
+                return []
             try:
-                self.cur.execute(query)
+                # best matches first
+                self.cur.execute('''
+                    SELECT contact_name, time, kind, show, logs.message,
+                    logs.subject FROM logs_fts
+                    JOIN logs ON logs.log_line_id = logs_fts.rowid
+                    WHERE logs_fts MATCH ? AND (%s) %s
+                    ORDER BY logs_fts.rank
+                    ''' % (where_sql, time_sql), (fts_query,) + jid_tuple)
+                return self.cur.fetchall()
             except sqlite.OperationalError as e:
-                results = [('', '', '', '', str(e))]
-                return results
+                log.debug('Full-text search failed, using LIKE: %s' % str(e))
 
-        else: # user just typed something, we search in message column
-            where_sql, jid_tuple = self._build_contact_where(account, jid)
-            like_sql = '%' + query.replace("'", "''") + '%'
-            if year:
-                start_of_day = self.get_unix_time_from_date(year, month, day)
-                seconds_in_a_day = 86400 # 60 * 60 * 24
-                last_second_of_day = start_of_day + seconds_in_a_day - 1
-                self.cur.execute('''
-                SELECT contact_name, time, kind, show, message, subject FROM logs
-                WHERE (%s) AND message LIKE '%s'
-                AND time BETWEEN %d AND %d
-                ORDER BY time
-                ''' % (where_sql, like_sql, start_of_day, last_second_of_day),
-                    jid_tuple)
-            else:
-                self.cur.execute('''
-                SELECT contact_name, time, kind, show, message, subject FROM logs
-                WHERE (%s) AND message LIKE '%s'
-                ORDER BY time
-                ''' % (where_sql, like_sql), jid_tuple)
+        # user just typed something, we search in message column
+        like_sql = '%' + query + '%'
+        self.cur.execute('''
+            SELECT contact_name, time, kind, show, message, subject FROM logs
+            WHERE (%s) AND message LIKE ?
+            %s
+            ORDER BY time
+            ''' % (where_sql, time_sql), jid_tuple + (like_sql,))
 
         results = self.cur.fetchall()
         return results
 
+    @in_db_thread
     def get_days_with_logs(self, jid, year, month, max_day, account):
         """
         Return the list of days that have logs (not status messages)
@@ -739,6 +1359,7 @@ class Logger:
 
         return days_with_logs
 
+    @in_db_thread
     def get_last_date_that_has_logs(self, jid, account=None, is_room=False):
         """
         Return last time (in seconds since EPOCH) for which we had logs
@@ -769,6 +1390,7 @@ class Logger:
             result = None
         return result
 
+    @in_db_thread
     def get_room_last_message_time(self, jid):
         """
         Return FASTLY last time (in seconds since EPOCH) for which we had logs
@@ -792,6 +1414,7 @@ class Logger:
             result = None
         return result
 
+    @in_db_thread
     def set_room_last_message_time(self, jid, time):
         """
         Set last time (in seconds since EPOCH) for which we had logs for that
@@ -828,6 +1451,7 @@ class Logger:
             jid_tuple += (jid_id,)
         return where_sql, jid_tuple
 
+    @in_db_thread
     def save_transport_type(self, jid, type_):
         """
         Save the type of the transport in DB
@@ -850,6 +1474,7 @@ class Logger:
         sql = 'INSERT INTO transports_cache VALUES ("%s", %d)' % (jid, type_id)
         self.simple_commit(sql)
 
+    @in_db_thread
     def get_transports_type(self):
         """
         Return all the type of the transports in DB
@@ -872,6 +1497,7 @@ class Logger:
     # When retrieving, we need to convert it back to a string to decompress it.
     # (2)
     # GzipFile needs a file-like object, StringIO emulates file for plain strings
+    @in_db_thread
     def iter_caps_data(self):
         """
         Iterate over caps cache data stored in the database
@@ -926,6 +1552,7 @@ class Logger:
                     hash = "%s"''' % (hash_method, hash_)
             self.simple_commit(sql)
 
+    @in_db_thread
     def add_caps_entry(self, hash_method, hash_, identities, features):
         data = []
         for identity in identities:
@@ -950,12 +1577,14 @@ class Logger:
         # (1) -- note above
         self._timeout_commit()
 
+    @in_db_thread
     def update_caps_time(self, method, hash_):
         sql = '''UPDATE caps_cache SET last_seen = %d
                 WHERE hash_method = "%s" and hash = "%s"''' % \
                 (int(time.time()), method, hash_)
         self.simple_commit(sql)
 
+    @in_db_thread
     def clean_caps_table(self):
         """
         Remove caps which was not seen for 3 months
@@ -964,6 +1593,7 @@ class Logger:
                 int(time.time() - 3*30*24*3600)
         self.simple_commit(sql)
 
+    @in_db_thread
     def replace_roster(self, account_name, roster_version, roster):
         """
         Replace current roster in DB by a new one
@@ -995,6 +1625,7 @@ class Logger:
         gajim.config.set_per('accounts', account_name, 'roster_version',
             roster_version)
 
+    @in_db_thread
     def del_contact(self, account_jid, jid):
         """
         Remove jid from account_jid roster
@@ -1012,6 +1643,7 @@ class Logger:
                 (account_jid_id, jid_id))
         self._timeout_commit()
 
+    @in_db_thread
     def add_or_update_contact(self, account_jid, jid, name, sub, ask, groups,
     commit=True):
         """
@@ -1047,6 +1679,7 @@ class Logger:
         if commit:
             self._timeout_commit()
 
+    @in_db_thread
     def get_roster(self, account_jid):
         """
         Return the accound_jid roster in NonBlockingRoster format
@@ -1091,6 +1724,7 @@ class Logger:
 
         return data
 
+    @in_db_thread
     def remove_roster(self, account_jid):
         """
         Remove all entry from account_jid roster
@@ -1103,53 +1737,229 @@ class Logger:
                 (account_jid_id,))
         self._timeout_commit()
 
-    def save_if_not_exists(self, with_, direction, tim, msg='', nick=None, additional_data=None):
-        if additional_data is None:
-            additional_data = {}
-        if tim:
-            time_col = float(tim)
-        else:
-            time_col = float(time.time())
-        if not msg:
+    @in_db_thread
+    def get_vcard(self, jid, nick=None):
+        """
+        Return the cached vCard of jid, or of the occupant nick if jid is a
+        room, as a dict. Return None if we don't have it
+        """
+        try:
+            self.cur.execute('''
+                    SELECT v.data, p.data FROM vcards v
+                    LEFT JOIN vcard_photos p ON p.sha = v.photo_sha
+                    WHERE v.jid = ? AND v.nick = ?''', (jid, nick or ''))
+        except sqlite.OperationalError:
+            # might happen when there's no vcards table yet
+            return None
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        vcard = json.loads(row[0])
+        if row[1] is not None:
+            vcard['PHOTO']['BINVAL'] = base64.b64encode(row[1]).decode('utf-8')
+        return vcard
+
+    @in_db_thread
+    def save_vcard(self, jid, nick, vcard):
+        """
+        Cache the vCard of jid, or of the occupant nick if jid is a room
+        """
+        try:
+            store_vcard(self.cur, jid, nick or '', vcard)
+        except sqlite.OperationalError as e:
+            raise exceptions.PysqliteOperationalError(str(e))
+        self._timeout_commit()
+
+    @in_db_thread
+    def has_room_vcards(self, jid):
+        """
+        Return True if we cached vCards of occupants of jid
+        """
+        try:
+            self.cur.execute('SELECT 1 FROM vcards WHERE jid = ? AND nick != '
+                "'' LIMIT 1", (jid,))
+        except sqlite.OperationalError:
+            return False
+        return self.cur.fetchone() is not None
+
+    @in_db_thread
+    def remove_vcard(self, jid, nick=None):
+        try:
+            self.cur.execute('SELECT photo_sha FROM vcards WHERE jid = ? AND '
+                'nick = ?', (jid, nick or ''))
+            row = self.cur.fetchone()
+            if row is None:
+                return
+            self.cur.execute('DELETE FROM vcards WHERE jid = ? AND nick = ?',
+                (jid, nick or ''))
+            remove_unused_vcard_photo(self.cur, row[0])
+        except sqlite.OperationalError as e:
+            raise exceptions.PysqliteOperationalError(str(e))
+        self._timeout_commit()
+
+    @in_db_thread
+    def rename_vcard(self, jid, nick, new_nick):
+        """
+        Keep the vCard of the occupant nick of the room jid under new_nick
+        """
+        if nick == new_nick:
             return
-        if self.jid_is_from_pm(with_) or nick:
-            # It's a groupchat message
-            if nick:
-                # It's a message from a groupchat occupent
-                type_ = 'gc_msg'
-                with_ = with_ + '/' + nick
+        self.remove_vcard(jid, new_nick)
+        try:
+            self.cur.execute('UPDATE vcards SET nick = ? WHERE jid = ? AND '
+                'nick = ?', (new_nick, jid, nick))
+        except sqlite.OperationalError as e:
+            raise exceptions.PysqliteOperationalError(str(e))
+        self._timeout_commit()
+
+    @in_db_thread
+    def save_if_not_exists(self, with_, direction, tim, msg='', nick=None,
+    additional_data=None, stanza_id=None):
+        self.save_many([(with_, direction, tim, msg, nick, additional_data,
+            stanza_id)])
+
+    @in_db_thread
+    def save_many(self, rows):
+        """
+        Log the messages from server archives that are not logged yet, in one
+        transaction
+
+        rows are (with_, direction, tim, msg, nick, additional_data, stanza_id)
+        tuples, stanza_id being the archive id of the message or None. A
+        message is a duplicate if its archive id is already logged or, for the
+        ones logged without id, if the same text is logged less than
+        ARCHIVE_DUPLICATE_WINDOW seconds apart. Return the number of messages
+        written.
+        """
+        start = time.time()
+        if self.jids_already_in == []:
+            self.open_db()
+        messages = []
+        for with_, direction, tim, msg, nick, additional_data, stanza_id in \
+        rows:
+            if not msg:
+                continue
+            if stanza_id in self.recent_stanza_ids:
+                continue
+            if tim:
+                time_col = float(tim)
             else:
-                # It's a server message message, we don't log them
-                return
-        else:
-            if direction == 'from':
-                type_ = 'chat_msg_recv'
-            elif direction == 'to':
-                type_ = 'chat_msg_sent'
-        jid_id = self.get_jid_id(with_)
-        where_sql = 'jid_id = %s AND message=?' % jid_id
-        if type_ == 'gc_msg':
-            # We cannot differentiate gc message and pm messages, so look in
-            # both logs
-            with_2 = gajim.get_jid_without_resource(with_)
-            if with_ != with_2:
-                jid_id2 = self.get_jid_id(with_2)
-                where_sql = 'jid_id in (%s, %s) AND message=?' % (jid_id,
-                    jid_id2)
-        start_time = time_col - 300 # 5 minutes arrount given time
-        end_time = time_col + 300 # 5 minutes arrount given time
+                time_col = float(time.time())
+            if self.jid_is_from_pm(with_) or nick:
+                # It's a groupchat message
+                if nick:
+                    # It's a message from a groupchat occupent
+                    type_ = 'gc_msg'
+                    with_ = with_ + '/' + nick
+                else:
+                    # It's a server message message, we don't log them
+                    continue
+            else:
+                if direction == 'from':
+                    type_ = 'chat_msg_recv'
+                elif direction == 'to':
+                    type_ = 'chat_msg_sent'
+            jid_ids = (self.get_jid_id(with_),)
+            if type_ == 'gc_msg':
+                # We cannot differentiate gc message and pm messages, so look in
+                # both logs
+                with_2 = gajim.get_jid_without_resource(with_)
+                if with_ != with_2:
+                    jid_ids += (self.get_jid_id(with_2),)
+            messages.append((type_, with_, jid_ids, time_col, msg, tim,
+                additional_data, stanza_id))
+        if not messages:
+            return 0
+
+        try:
+            known_ids = self._get_logged_stanza_ids([message[7] for message in \
+                messages if message[7]])
+            # {jid_ids: {message: [times]}} of what is logged around the
+            # messages without known archive id
+            logged = {}
+            periods = {}
+            for message in messages:
+                if message[7] not in known_ids:
+                    jid_ids, time_col = message[2], message[3]
+                    first, last = periods.get(jid_ids, (time_col, time_col))
+                    periods[jid_ids] = (min(first, time_col), max(last,
+                        time_col))
+            for jid_ids, (first, last) in periods.items():
+                logged[jid_ids] = self._get_logged_texts(jid_ids,
+                    first - ARCHIVE_DUPLICATE_WINDOW,
+                    last + ARCHIVE_DUPLICATE_WINDOW)
+
+            written = 0
+            for type_, with_, jid_ids, time_col, msg, tim, additional_data, \
+            stanza_id in messages:
+                if stanza_id in known_ids:
+                    continue
+                times = logged[jid_ids].setdefault(msg, [])
+                if any(abs(time_col - t) <= ARCHIVE_DUPLICATE_WINDOW for t in \
+                times):
+                    continue
+                result = self._get_log_values(type_, with_, msg, None, tim,
+                    None, additional_data)
+                if result is None:
+                    continue
+                values, write_unread = result
+                self.cur.execute('''INSERT INTO logs (jid_id, contact_name,
+                    time, kind, show, message, subject, additional_data,
+                    stanza_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    values + (stanza_id,))
+                if write_unread:
+                    self.cur.execute('''INSERT INTO unread_messages
+                        (message_id, jid_id, shown) VALUES (?, ?, 0)''',
+                        (self.cur.lastrowid, values[0]))
+                times.append(time_col)
+                if stanza_id:
+                    known_ids.add(stanza_id)
+                written += 1
+            self.con.commit()
+        except sqlite.OperationalError as e:
+            raise exceptions.PysqliteOperationalError(str(e))
+        except sqlite.DatabaseError:
+            raise exceptions.DatabaseMalformed
+        self._remember_stanza_ids(known_ids)
+        log.debug('Saved %d of %d archived messages in %.1f ms' % (written,
+            len(rows), (time.time() - start) * 1000))
+        return written
+
+    def _get_logged_stanza_ids(self, stanza_ids):
+        """
+        Return the set of stanza_ids that are already logged
+        """
+        known_ids = set()
+        for i in range(0, len(stanza_ids), 500):
+            chunk = stanza_ids[i:i + 500]
+            self.cur.execute('''
+                SELECT stanza_id FROM logs
+                WHERE stanza_id IS NOT NULL AND stanza_id IN (%s)
+                ''' % ', '.join('?' * len(chunk)), chunk)
+            known_ids.update(row[0] for row in self.cur)
+        return known_ids
+
+    def _get_logged_texts(self, jid_ids, start_time, end_time):
+        """
+        Return {message: [times]} of what is logged for jid_ids between
+        start_time and end_time
+        """
+        texts = {}
         self.cur.execute('''
-            SELECT log_line_id FROM logs
-            WHERE (%s)
-            AND time BETWEEN %d AND %d
-            ORDER BY time
-            ''' % (where_sql, start_time, end_time), (msg,))
-        results = self.cur.fetchall()
-        if results:
-            log.debug('Log already in DB, ignoring it')
-            return
-        log.debug('New log received from server archives, storing it')
-        self.write(type_, with_, message=msg, tim=tim, additional_data=additional_data)
+            SELECT time, message FROM logs
+            WHERE jid_id IN (%s) AND time BETWEEN ? AND ?
+            ''' % ', '.join('?' * len(jid_ids)), jid_ids + (start_time,
+            end_time))
+        for time_col, message in self.cur:
+            texts.setdefault(message, []).append(time_col)
+        return texts
+
+    def _remember_stanza_ids(self, stanza_ids):
+        for stanza_id in stanza_ids:
+            self.recent_stanza_ids[stanza_id] = None
+            self.recent_stanza_ids.move_to_end(stanza_id)
+        while len(self.recent_stanza_ids) > RECENT_STANZA_IDS_SIZE:
+            self.recent_stanza_ids.popitem(last=False)
 
     def _nec_gc_message_received(self, obj):
         tim_f = float(obj.timestamp)
@@ -1160,19 +1970,11 @@ class Logger:
             # if not obj.nick, it means message comes from room itself
             # usually it hold description and can be send at each connection
             # so don't store it in logs
-            try:
-                self.write('gc_msg', obj.fjid, obj.msgtxt, tim=obj.timestamp, additional_data=obj.additional_data)
-                # store in memory time of last message logged.
-                # this will also be saved in rooms_last_message_time table
-                # when we quit this muc
-                obj.conn.last_history_time[obj.jid] = tim_f
-
-            except exceptions.PysqliteOperationalError as e:
-                obj.conn.dispatch('DB_ERROR', (_('Disk Write Error'), str(e)))
-            except exceptions.DatabaseMalformed:
-                pritext = _('Database Error')
-                sectext = _('The database file (%s) cannot be read. Try to '
-                    'repair it (see http://trac.gajim.org/wiki/DatabaseBackup) '
-                    'or remove it (all history will be lost).') % \
-                    LOG_DB_PATH
-                obj.conn.dispatch('DB_ERROR', (pritext, sectext))
+            # History replay on join can bring thousands of messages, write
+            # them in batches
+            self.queue_write('gc_msg', obj.fjid, obj.msgtxt, tim=obj.timestamp,
+                additional_data=obj.additional_data, account=obj.conn.name)
+            # store in memory time of last message logged.
+            # this will also be saved in rooms_last_message_time table
+            # when we quit this muc
+            obj.conn.last_history_time[obj.jid] = tim_f
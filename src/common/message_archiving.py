@@ -24,6 +24,7 @@ from common import ged
 from common import helpers
 from common.connection_handlers_events import ArchivingReceivedEvent
 
+import time
 from calendar import timegm
 from time import localtime
 
@@ -35,6 +36,25 @@ ARCHIVING_COLLECTION_ARRIVED = 'archiving_collection_arrived'
 ARCHIVING_MODIFICATIONS_ARRIVED = 'archiving_modifications_arrived'
 MAM_RESULTS_ARRIVED = 'mam_results_arrived'
 
+# Where the archive is read from when we never synchronized with it
+MAM_FIRST_SYNC_START = '2013-02-24T03:51:42Z'
+# A catch-up is split in queries over periods of at least this many seconds
+MAM_MIN_PERIOD = 3600
+
+class MamQuery:
+    """
+    Query of the archive over a period, asked page after page until the server
+    says it is complete
+    """
+    def __init__(self, start=None, end=None, after=None):
+        self.start = start
+        self.end = end
+        # archive id of the last message received
+        self.last = after
+        self.complete = False
+        # messages received in the current page, not written yet
+        self.rows = []
+
 class ConnectionArchive:
     def __init__(self):
         pass
@@ -46,6 +66,12 @@ class ConnectionArchive313(ConnectionArchive):
         self.archiving_313_supported = False
         self.mam_awaiting_disco_result = {}
         self.iq_answer = []
+        # catch-up queries, oldest period first, and the ones waiting for a
+        # page: {queryid: MamQuery}
+        self.mam_queries = []
+        self.mam_running = {}
+        self.mam_catchup_time = None
+        self.mam_counters = {'pages': 0, 'messages': 0}
         gajim.ged.register_event_handler('raw-message-received', ged.CORE,
             self._nec_raw_message_313_received)
         gajim.ged.register_event_handler('agent-info-error-received', ged.CORE,
@@ -112,6 +138,11 @@ class ConnectionArchive313(ConnectionArchive):
         else:
             return
 
+        if queryid_ in self.mam_running:
+            del self.awaiting_answers[queryid_]
+            self._mam_page_received(self.mam_running.pop(queryid_), fin_)
+            return
+
         if self.awaiting_answers[queryid_][0] == MAM_RESULTS_ARRIVED:
             set_ = fin_.getTag('set', namespace=nbxmpp.NS_RSM)
             if set_:
@@ -127,11 +158,156 @@ class ConnectionArchive313(ConnectionArchive):
     def _nec_mam_decrypted_message_received(self, obj):
         if obj.conn.name != self.name:
             return
+        query = self.mam_running.get(obj.msg_obj.query_id)
+        if query:
+            # written with the rest of the page
+            query.rows.append((obj.with_, obj.direction, obj.tim, obj.msgtxt,
+                obj.nick, obj.additional_data, obj.msg_obj.archive_id))
+            self.mam_counters['messages'] += 1
+            return
         gajim.logger.save_if_not_exists(obj.with_, obj.direction, obj.tim,
-            msg=obj.msgtxt, nick=obj.nick, additional_data=obj.additional_data)
+            msg=obj.msgtxt, nick=obj.nick, additional_data=obj.additional_data,
+            stanza_id=obj.msg_obj.archive_id)
+
+    def request_archive_catchup(self):
+        """
+        Download the messages archived since last_mam_id
+
+        When we know when we were synchronized, the time since then is split
+        in periods queried at the same time, up to mam_max_queries of them.
+        last_mam_id and last_mam_time only move past a period once it and all
+        the previous ones are complete, so an interrupted catch-up starts
+        again from there.
+        """
+        for query in self.mam_queries:
+            self._write_mam_rows(query)
+        self.mam_queries = []
+        self.mam_running = {}
+        self.mam_catchup_time = time.time()
+        for key in self.mam_counters:
+            self.mam_counters[key] = 0
+
+        last_id = gajim.config.get_per('accounts', self.name, 'last_mam_id')
+        last_time = gajim.config.get_per('accounts', self.name,
+            'last_mam_time')
+        if not last_id:
+            last_time = MAM_FIRST_SYNC_START
+        if not last_time:
+            # we only know where we stopped, read from there
+            self.mam_queries.append(MamQuery(after=last_id))
+        else:
+            start = timegm(helpers.datetime_tuple(last_time))
+            duration = max(self.mam_catchup_time - start, 0)
+            nb_queries = max(1, min(gajim.config.get('mam_max_queries'),
+                int(duration // MAM_MIN_PERIOD)))
+            period = duration / nb_queries
+            for i in range(nb_queries):
+                end = start + period
+                if i == nb_queries - 1:
+                    # get what is archived during the catch-up too
+                    end = None
+                self.mam_queries.append(MamQuery(start, end))
+                start += period
+            self.mam_queries[0].last = last_id or None
+        self._send_mam_queries()
+
+    def _send_mam_queries(self):
+        max_queries = max(gajim.config.get('mam_max_queries'), 1)
+        for query in self.mam_queries:
+            if len(self.mam_running) >= max_queries:
+                return
+            if query.complete or query in self.mam_running.values():
+                continue
+            self._request_mam_page(query)
+
+    def _request_mam_page(self, query):
+        start = end = None
+        if query.start is not None and query.last is None:
+            start = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+                query.start))
+        if query.end is not None:
+            end = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(query.end))
+        queryid_ = self.request_archive(start=start, end=end, after=query.last)
+        self.mam_running[queryid_] = query
+
+    def _mam_page_received(self, query, fin_):
+        self.mam_counters['pages'] += 1
+        last = None
+        set_ = fin_.getTag('set', namespace=nbxmpp.NS_RSM)
+        if set_:
+            last = set_.getTagData('last')
+        if last:
+            query.last = last
+        if fin_.getAttr('complete') == 'true' or not last:
+            query.complete = True
+        else:
+            # ask the next page before writing this one
+            self._request_mam_page(query)
+        self._write_mam_rows(query)
+        self._update_mam_sync_point()
+        if all(query.complete for query in self.mam_queries):
+            self._mam_catchup_finished()
+        else:
+            self._send_mam_queries()
+
+    def _write_mam_rows(self, query):
+        if not query.rows:
+            return
+        rows = query.rows
+        query.rows = []
+        gajim.logger.run_async(gajim.logger.save_many, rows)
+
+    def _update_mam_sync_point(self):
+        last_id = None
+        last_time = None
+        for query in self.mam_queries:
+            if query.last:
+                last_id = query.last
+            if not query.complete:
+                break
+            if query.end is not None:
+                last_time = query.end
+        if last_id:
+            gajim.config.set_per('accounts', self.name, 'last_mam_id', last_id)
+        if last_time:
+            gajim.config.set_per('accounts', self.name, 'last_mam_time',
+                time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(last_time)))
+
+    def _mam_catchup_finished(self):
+        gajim.config.set_per('accounts', self.name, 'last_mam_time',
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+            self.mam_catchup_time)))
+        counters = self.get_mam_counters()
+        log.info('Archive of %s downloaded: %d messages in %d pages, %.1f s, '
+            '%.1f messages/s', self.name, counters['messages'],
+            counters['pages'], counters['duration'], counters['throughput'])
+
+    def get_mam_counters(self):
+        """
+        Progress of the last archive catch-up
+        """
+        counters = dict(self.mam_counters)
+        counters['periods'] = len(self.mam_queries)
+        counters['complete'] = len([query for query in self.mam_queries if \
+            query.complete])
+        counters['running'] = len(self.mam_running)
+        duration = 0
+        if self.mam_catchup_time:
+            duration = time.time() - self.mam_catchup_time
+        counters['duration'] = duration
+        counters['throughput'] = counters['messages'] / duration if duration \
+            else 0
+        return counters
 
     def request_archive(self, start=None, end=None, with_=None, after=None,
-    max=30):
+    max=None):
+        """
+        Ask a page of the archive, of max messages (mam_page_size by default)
+
+        Return the queryid of the request.
+        """
+        if max is None:
+            max = gajim.config.get('mam_page_size')
         iq_ = nbxmpp.Iq('set')
         query = iq_.addChild('query', namespace=nbxmpp.NS_MAM)
         x = query.addChild(node=nbxmpp.DataForm(typ='submit'))
@@ -152,6 +328,7 @@ class ConnectionArchive313(ConnectionArchive):
         iq_.setID(id_)
         self.awaiting_answers[queryid_] = (MAM_RESULTS_ARRIVED, )
         self.connection.send(iq_)
+        return queryid_
 
     def request_archive_preferences(self):
         if not gajim.account_is_connected(self.name):
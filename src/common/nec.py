@@ -43,6 +43,20 @@ class NetworkEventsController(object):
         Values: list of class objects that are subclasses
         of `NetworkOutgoingEvent`
         '''
+        self._version = 0
+        self._compiled_version = None
+        self._live_incoming_generators = {}
+        self._live_outgoing_generators = {}
+        '''
+        Same as above, without the prunable event classes that nobody listens
+        to, directly or through the events generated from them. Computed again
+        when an event class or a handler is (un)registered.
+        '''
+        self.counters = {'created': 0, 'dispatched': 0, 'pruned': 0}
+        '''
+        Number of event objects generated, dispatched to Global Events
+        Dispatcher, and never created because nobody listens to them
+        '''
 
     def register_incoming_event(self, event_class):
         for base_event_name in event_class.base_network_events:
@@ -50,12 +64,14 @@ class NetworkEventsController(object):
                 base_event_name, [])
             if not event_class in event_list:
                 event_list.append(event_class)
+        self._version += 1
 
     def unregister_incoming_event(self, event_class):
         for base_event_name in event_class.base_network_events:
             if base_event_name in self.incoming_events_generators:
                 self.incoming_events_generators[base_event_name].remove(
                     event_class)
+        self._version += 1
 
     def register_outgoing_event(self, event_class):
         for base_event_name in event_class.base_network_events:
@@ -63,22 +79,78 @@ class NetworkEventsController(object):
                 base_event_name, [])
             if not event_class in event_list:
                 event_list.append(event_class)
+        self._version += 1
 
     def unregister_outgoing_event(self, event_class):
         for base_event_name in event_class.base_network_events:
             if base_event_name in self.outgoing_events_generators:
                 self.outgoing_events_generators[base_event_name].remove(
                     event_class)
+        self._version += 1
 
-    def push_incoming_event(self, event_object):
+    def get_counters(self):
+        return dict(self.counters)
+
+    def reset_counters(self):
+        for key in self.counters:
+            self.counters[key] = 0
+
+    def _is_live(self, event_name, generators, cache, visiting):
+        '''
+        :return: True if a handler is registered for event_name or for an
+        event generated from it, or if one of those events must always be
+        generated.
+        '''
+        if event_name in cache:
+            return cache[event_name]
+        if event_name in visiting:
+            # loop in the events graph, the other paths decide
+            return False
+        visiting.add(event_name)
+        live = gajim.ged.has_handlers(event_name)
+        if not live:
+            for event_class in generators.get(event_name, []):
+                if not event_class.prunable or self._is_live(event_class.name,
+                generators, cache, visiting):
+                    live = True
+                    break
+        visiting.discard(event_name)
+        cache[event_name] = live
+        return live
+
+    def _compile_generators(self, generators):
+        cache = {}
+        live_generators = {}
+        for base_event_name, event_classes in generators.items():
+            live_generators[base_event_name] = [event_class for event_class \
+                in event_classes if not event_class.prunable or \
+                self._is_live(event_class.name, generators, cache, set())]
+        return live_generators
+
+    def _compile(self):
+        version = (self._version, gajim.ged.version)
+        if version == self._compiled_version:
+            return
+        self._live_incoming_generators = self._compile_generators(
+            self.incoming_events_generators)
+        self._live_outgoing_generators = self._compile_generators(
+            self.outgoing_events_generators)
+        self._compiled_version = version
+
+    def _dispatch(self, event_object):
+        self.counters['created'] += 1
         if event_object.generate():
-            if not gajim.ged.raise_event(event_object.name, event_object):
-                self._generate_events_based_on_incoming_event(event_object)
+            self.counters['dispatched'] += 1
+            return not gajim.ged.raise_event(event_object.name, event_object)
+        return False
+
+    def push_incoming_event(self, event_object):
+        if self._dispatch(event_object):
+            self._generate_events_based_on_incoming_event(event_object)
 
     def push_outgoing_event(self, event_object):
-        if event_object.generate():
-            if not gajim.ged.raise_event(event_object.name, event_object):
-                self._generate_events_based_on_outgoing_event(event_object)
+        if self._dispatch(event_object):
+            self._generate_events_based_on_outgoing_event(event_object)
 
     def _generate_events_based_on_incoming_event(self, event_object):
         '''
@@ -89,17 +161,18 @@ class NetworkEventsController(object):
         :note: replacing mechanism is not implemented currently, but will be
         based on attribute in new network events object.
         '''
+        self._compile()
         base_event_name = event_object.name
-        if base_event_name in self.incoming_events_generators:
-            for new_event_class in self.incoming_events_generators[
-            base_event_name]:
+        if base_event_name in self._live_incoming_generators:
+            event_classes = self._live_incoming_generators[base_event_name]
+            self.counters['pruned'] += len(self.incoming_events_generators[
+                base_event_name]) - len(event_classes)
+            for new_event_class in event_classes:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
-                    if not gajim.ged.raise_event(new_event_object.name,
-                    new_event_object):
-                        self._generate_events_based_on_incoming_event(
-                            new_event_object)
+                if self._dispatch(new_event_object):
+                    self._generate_events_based_on_incoming_event(
+                        new_event_object)
 
     def _generate_events_based_on_outgoing_event(self, event_object):
         '''
@@ -110,20 +183,27 @@ class NetworkEventsController(object):
         :note: replacing mechanism is not implemented currently, but will be
         based on attribute in new network events object.
         '''
+        self._compile()
         base_event_name = event_object.name
-        if base_event_name in self.outgoing_events_generators:
-            for new_event_class in self.outgoing_events_generators[
-            base_event_name]:
+        if base_event_name in self._live_outgoing_generators:
+            event_classes = self._live_outgoing_generators[base_event_name]
+            self.counters['pruned'] += len(self.outgoing_events_generators[
+                base_event_name]) - len(event_classes)
+            for new_event_class in event_classes:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
-                    if not gajim.ged.raise_event(new_event_object.name,
-                    new_event_object):
-                        self._generate_events_based_on_outgoing_event(
-                            new_event_object)
+                if self._dispatch(new_event_object):
+                    self._generate_events_based_on_outgoing_event(
+                        new_event_object)
 
 class NetworkEvent(object):
     name = ''
+    prunable = False
+    '''
+    True if generate() only computes the attributes of this event, without
+    side effects. Such events are not created when no handler is registered
+    for them or for the events generated from them.
+    '''
 
     def __init__(self, new_name, **kwargs):
         if new_name:
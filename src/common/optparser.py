@@ -30,6 +30,8 @@ import os
 import sys
 import re
 from time import time
+from encodings.punycode import punycode_decode
+import nbxmpp
 from common import gajim
 from common import helpers
 from common import caps_cache
@@ -40,11 +42,26 @@ from common import logger
 import logging
 log = logging.getLogger('gajim.c.optparser')
 
+# optname = value or optname.key.subname = value
+LINE_REGEX = re.compile(r"(?P<optname>[^.=]+)(?:(?:\.(?P<key>.+))?\.(?P<subname>[^.=]+))?\s=\s(?P<value>.*)")
+# deletions appended by write_changes(): -optname.key = [subname]
+DELETION_REGEX = re.compile(r"-(?P<optname>[^.=]+)\.(?P<key>.+)\s=\s(?P<subname>.*)")
+
+# Once more than COMPACT_MIN_LINES changes have been appended to the config file
+# and they are more than the lines of the last full write, the file is
+# rewritten from scratch
+COMPACT_MIN_LINES = 500
+
 class OptionsParser:
     def __init__(self, filename):
         self.__filename = os.path.realpath(filename)
         self.old_values = {}    # values that are saved in the file and maybe
                                                         # no longer valid
+        # Changes are appended to the file, that is compacted from time to
+        # time. Lines written by the last full write / appended since then
+        self.__compacted_lines = 0
+        self.__appended_lines = 0
+        self.__needs_compaction = True
 
     def read(self):
         try:
@@ -59,27 +76,67 @@ class OptionsParser:
         new_version = gajim.config.get('version')
         new_version = new_version.split('-', 1)[0]
         seen = set()
-        regex = re.compile(r"(?P<optname>[^.=]+)(?:(?:\.(?P<key>.+))?\.(?P<subname>[^.=]+))?\s=\s(?P<value>.*)")
-
-        for line in fd:
-            match = regex.match(line)
-            if match is None:
-                log.warn('Invalid configuration line, ignoring it: %s', line)
-                continue
-            optname, key, subname, value = match.groups()
-            if key is None:
-                self.old_values[optname] = value
-                gajim.config.set(optname, value)
-            else:
-                if (optname, key) not in seen:
-                    if optname in self.old_values:
-                        self.old_values[optname][key] = {}
-                    else:
-                        self.old_values[optname] = {key: {}}
-                    gajim.config.add_per(optname, key)
-                    seen.add((optname, key))
-                self.old_values[optname][key][subname] = value
-                gajim.config.set_per(optname, key, subname, value)
+        match_line = LINE_REGEX.match
+        match_deletion = DELETION_REGEX.match
+        # Everything read is already saved, and what was set before are
+        # defaults that don't need to be
+        gajim.config.clear_changes()
+        gajim.config.track_changes = False
+
+        set_option = gajim.config.set
+        add_per = gajim.config.add_per
+        set_per = gajim.config.set_per
+        old_values = self.old_values
+        nb_lines = 0
+        nb_deletions = 0
+        nb_overrides = 0
+        try:
+            for line in fd:
+                nb_lines += 1
+                if line.startswith('-'):
+                    match = match_deletion(line)
+                    if match is None:
+                        log.warn('Invalid configuration line, ignoring it: %s',
+                            line)
+                        continue
+                    nb_deletions += 1
+                    optname, key, subname = match.groups()
+                    self.delete_old_value(optname, key, subname)
+                    if not subname:
+                        seen.discard((optname, key))
+                    continue
+                match = match_line(line)
+                if match is None:
+                    log.warn('Invalid configuration line, ignoring it: %s',
+                        line)
+                    continue
+                optname, key, subname, value = match.groups()
+                if key is None:
+                    if optname in old_values:
+                        # value has been changed and appended to the file
+                        nb_overrides += 1
+                    old_values[optname] = value
+                    set_option(optname, value)
+                else:
+                    if (optname, key) not in seen:
+                        if optname in old_values:
+                            old_values[optname][key] = {}
+                        else:
+                            old_values[optname] = {key: {}}
+                        add_per(optname, key)
+                        seen.add((optname, key))
+                    values = old_values[optname][key]
+                    if subname in values:
+                        nb_overrides += 1
+                    values[subname] = value
+                    set_per(optname, key, subname, value)
+        finally:
+            gajim.config.track_changes = True
+
+        self.__compacted_lines = nb_lines
+        self.__appended_lines = 0
+        # Don't keep overridden values and deletions in the file forever
+        self.__needs_compaction = nb_deletions + nb_overrides > 0
 
         old_version = gajim.config.get('version')
         old_version = old_version.split('-', 1)[0]
@@ -103,8 +160,89 @@ class OptionsParser:
                 s += p + '.'
         s += opt
         fd.write(s + ' = ' + value + '\n')
+        return True
+
+    def delete_old_value(self, optname, key, subname):
+        """
+        Apply a deletion line read from the config file
+        """
+        keys = gajim.config.get_per(optname)
+        if keys is None or key not in keys:
+            return
+        if not subname:
+            gajim.config.del_per(optname, key)
+            if optname in self.old_values:
+                self.old_values[optname].pop(key, None)
+            return
+        gajim.config.del_per(optname, key, subname)
+        if optname in self.old_values and key in self.old_values[optname]:
+            self.old_values[optname][key].pop(subname, None)
+
+    def count_and_write_line(self, fd, opt, parents, value):
+        if self.write_line(fd, opt, parents, value):
+            self.__compacted_lines += 1
 
     def write(self):
+        """
+        Save the config: append what changed since last save, or rewrite the
+        whole file when it needs to be compacted
+        """
+        if self.__needs_compaction or not os.path.exists(self.__filename) or \
+        (self.__appended_lines > COMPACT_MIN_LINES and \
+        self.__appended_lines > self.__compacted_lines):
+            return self.write_all()
+        return self.write_changes()
+
+    def write_changes(self):
+        """
+        Append options changed since last save to the config file
+        """
+        changes = gajim.config.get_changes()
+        if not changes:
+            return
+        lines = []
+        added_groups = set()
+        for path, action in changes:
+            if action == 'del':
+                subname = path[2] if len(path) == 3 else ''
+                lines.append('-%s.%s = %s\n' % (path[0], path[1], subname))
+            elif len(path) == 1:
+                value = gajim.config.get(path[0])
+                if value is not None:
+                    lines.append('%s = %s\n' % (path[0], value))
+            elif len(path) == 2:
+                # a new group: write all its options, as write_all() does
+                group = gajim.config.get_per(path[0], path[1])
+                if path[1] not in gajim.config.get_per(path[0]):
+                    # deleted since
+                    continue
+                for subname, value in group.items():
+                    if value is not None:
+                        lines.append('%s.%s.%s = %s\n' % (path[0], path[1],
+                            subname, value))
+                added_groups.add(path)
+            else:
+                if path[:2] in added_groups or \
+                path[1] not in gajim.config.get_per(path[0]):
+                    continue
+                value = gajim.config.get_per(*path)
+                if value is not None:
+                    lines.append('%s.%s.%s = %s\n' % (path + (value,)))
+        try:
+            with open(self.__filename, 'a') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError) as e:
+            # We don't know what has been written, rewrite everything next time
+            self.__needs_compaction = True
+            return str(e)
+        self.__appended_lines += len(lines)
+
+    def write_all(self):
+        """
+        Rewrite the whole config file
+        """
         (base_dir, filename) = os.path.split(self.__filename)
         self.__tempfile = os.path.join(base_dir, '.' + filename)
         try:
@@ -112,8 +250,11 @@ class OptionsParser:
                 os.O_CREAT|os.O_WRONLY|os.O_TRUNC, 0o600), 'w')
         except IOError as e:
             return str(e)
+        gajim.config.clear_changes()
+        self.__needs_compaction = True
+        self.__compacted_lines = 0
         try:
-            gajim.config.foreach(self.write_line, f)
+            gajim.config.foreach(self.count_and_write_line, f)
         except IOError as e:
             return str(e)
         f.flush()
@@ -130,6 +271,8 @@ class OptionsParser:
             os.rename(self.__tempfile, self.__filename)
         except IOError as e:
             return str(e)
+        self.__needs_compaction = False
+        self.__appended_lines = 0
 
     def update_config(self, old_version, new_version):
         old_version_list = old_version.split('.') # convert '0.x.y' to (0, x, y)
@@ -234,6 +377,12 @@ class OptionsParser:
             self.update_config_to_016101()
         if old < [0, 16, 10, 2] and new >= [0, 16, 10, 2]:
             self.update_config_to_016102()
+        if old < [0, 16, 10, 3] and new >= [0, 16, 10, 3]:
+            self.update_config_to_016103()
+        if old < [0, 16, 10, 4] and new >= [0, 16, 10, 4]:
+            self.update_config_to_016104()
+        if old < [0, 16, 10, 5] and new >= [0, 16, 10, 5]:
+            self.update_config_to_016105()
 
         gajim.logger.init_vars()
         gajim.logger.attach_cache_database()
@@ -975,3 +1124,112 @@ class OptionsParser:
         con.close()
 
         gajim.config.set('version', '0.16.10.2')
+
+    def update_config_to_016103(self):
+        if not logger.fts5_available():
+            log.info('sqlite has no FTS5 support, history search will not be '
+                'indexed')
+            gajim.config.set('version', '0.16.10.3')
+            return
+        back = os.getcwd()
+        os.chdir(logger.LOG_DB_FOLDER)
+        con = sqlite.connect(logger.LOG_DB_FILE)
+        os.chdir(back)
+        try:
+            logger.build_fts_index(con)
+        except sqlite.OperationalError as e:
+            log.warning('Cannot build full-text index: %s', str(e))
+        con.close()
+        gajim.config.set('version', '0.16.10.3')
+
+    def update_config_to_016104(self):
+        """
+        Move the vCards from one file per jid (and per occupant of rooms) in
+        VCARD_PATH to the cache database
+        """
+        con = sqlite.connect(logger.CACHE_DB_PATH)
+        cur = con.cursor()
+        try:
+            cur.executescript(logger.VCARDS_SCHEMA)
+            if os.path.isdir(gajim.VCARD_PATH):
+                for name in os.listdir(gajim.VCARD_PATH):
+                    path = os.path.join(gajim.VCARD_PATH, name)
+                    jid = self._get_name_from_filename(name)
+                    if not os.path.isdir(path):
+                        self._import_vcard_file(cur, path, jid, '')
+                        continue
+                    for nick_name in os.listdir(path):
+                        self._import_vcard_file(cur, os.path.join(path,
+                            nick_name), jid, self._get_name_from_filename(
+                            nick_name))
+                    try:
+                        os.rmdir(path)
+                    except OSError:
+                        pass
+            con.commit()
+        except sqlite.OperationalError as e:
+            log.warning('Cannot move vCards to the cache database: %s', str(e))
+        con.close()
+        gajim.config.set('version', '0.16.10.4')
+
+    def update_config_to_016105(self):
+        back = os.getcwd()
+        os.chdir(logger.LOG_DB_FOLDER)
+        con = sqlite.connect(logger.LOG_DB_FILE)
+        os.chdir(back)
+        cur = con.cursor()
+        try:
+            cur.executescript(
+                    '''
+                    ALTER TABLE logs ADD COLUMN 'stanza_id' TEXT;
+                    '''
+            )
+            con.commit()
+        except sqlite.OperationalError:
+            pass
+        try:
+            cur.executescript(logger.LOGS_STANZA_ID_INDEX)
+            con.commit()
+        except sqlite.OperationalError as e:
+            log.warning('Cannot index the archive ids of messages: %s', str(e))
+        con.close()
+        gajim.config.set('version', '0.16.10.5')
+
+    @staticmethod
+    def _get_name_from_filename(filename):
+        """
+        Return the jid or nick that helpers.sanitize_filename turned into
+        filename, or None if it was hashed
+        """
+        try:
+            name = punycode_decode(filename, 'strict')
+        except (UnicodeError, ValueError):
+            return None
+        if helpers.sanitize_filename(name) != filename:
+            return None
+        return name
+
+    @staticmethod
+    def _import_vcard_file(cur, path, jid, nick):
+        from common.connection_handlers import ConnectionVcard
+        # the vCards that cannot be read are fetched again when needed
+        if jid is not None and nick is not None:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = f.read()
+                vcard = {}
+                if data:
+                    vcard = ConnectionVcard._node_to_dict(nbxmpp.Node(
+                        node=data))
+                logger.store_vcard(cur, jid, nick, vcard)
+            except (IOError, UnicodeError) as e:
+                log.debug('Cannot read vCard file %s: %s', path, str(e))
+            except sqlite.OperationalError:
+                raise
+            except Exception as e:
+                # nbxmpp cannot parse it
+                log.debug('Cannot parse vCard file %s: %s', path, str(e))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -44,6 +44,12 @@ from common.socks5 import Socks5SenderClient
 import logging
 log = logging.getLogger('gajim.c.p.bytestream')
 
+# Block sizes of In-Band Bytestreams, in bytes before base64 encoding. We ask
+# for ft_ibb_block_size and try smaller blocks, down to IBB_MIN_BLOCK_SIZE, if
+# the contact refuses. We accept blocks up to IBB_MAX_BLOCK_SIZE.
+IBB_MIN_BLOCK_SIZE = 4096
+IBB_MAX_BLOCK_SIZE = 65535
+
 def is_transfer_paused(file_props):
     if file_props.stopped:
         return False
@@ -251,8 +257,9 @@ class ConnectionBytestream:
         if field.getValue() == nbxmpp.NS_IBB:
             sid = file_props.sid
             file_props.transport_sid = sid
-            fp = open(file_props.file_name, 'r')
-            self.OpenStream(sid, file_props.receiver, fp)
+            fp = open(file_props.file_name, 'rb')
+            self.OpenStream(sid, file_props.receiver, fp,
+                gajim.config.get('ft_ibb_block_size'))
             raise nbxmpp.NodeProcessed
 
     def _siSetCB(self, con, iq_obj):
@@ -797,6 +804,9 @@ class ConnectionIBBytestream(ConnectionBytestream):
             err = nbxmpp.ERR_BAD_REQUEST
         elif not file_props:
             err = nbxmpp.ERR_UNEXPECTED_REQUEST
+        elif blocksize > IBB_MAX_BLOCK_SIZE:
+            # the sender can try again with smaller blocks
+            err = nbxmpp.ERR_RESOURCE_CONSTRAINT
         if err:
             rep = nbxmpp.Error(stanza, err)
         else:
@@ -815,7 +825,7 @@ class ConnectionIBBytestream(ConnectionBytestream):
             file_props.disconnect_cb = None
             file_props.continue_cb = None
             file_props.syn_id = stanza.getID()
-            file_props.fp = open(file_props.file_name, 'w')
+            file_props.fp = open(file_props.file_name, 'wb')
         conn.send(rep)
 
     def CloseIBBStream(self, file_props):
@@ -835,13 +845,14 @@ class ConnectionIBBytestream(ConnectionBytestream):
             if session.weinitiate:
                 session.cancel_session()
 
-    def OpenStream(self, sid, to, fp, blocksize=4096):
+    def OpenStream(self, sid, to, fp, blocksize=IBB_MIN_BLOCK_SIZE):
         """
         Start new stream. You should provide stream id 'sid', the endpoind jid
-        'to', the file object containing info for send 'fp'. Also the desired
-        blocksize can be specified.
-        Take into account that recommended stanza size is 4k and IBB uses
-        base64 encoding that increases size of data by 1/3.
+        'to', the file object opened in binary mode containing info for send
+        'fp'. Also the desired blocksize can be specified.
+        Take into account that IBB uses base64 encoding that increases size of
+        data by 1/3. If the contact refuses the blocksize, the stream is opened
+        again with smaller blocks.
         """
         if not nbxmpp.JID(to).getResource():
             return
@@ -849,6 +860,7 @@ class ConnectionIBBytestream(ConnectionBytestream):
         file_props.direction = '|>' + to
         file_props.block_size = blocksize
         file_props.fp = fp
+        file_props.pending_ibb_acks = set()
         file_props.seq = 0
         file_props.error = 0
         file_props.paused = False
@@ -867,10 +879,12 @@ class ConnectionIBBytestream(ConnectionBytestream):
 
     def SendHandler(self):
         """
-        Send next portion of data if it is time to do it. Used internally.
+        Send next portions of data while less than ft_ibb_window_size of them
+        wait for an acknowledgement. Used internally.
         """
         log.debug('SendHandler called')
-        for file_props in FilesProp.getAllFileProp():
+        window_size = max(1, gajim.config.get('ft_ibb_window_size'))
+        for file_props in FilesProp.getFilePropByAccount(self.name):
             if not file_props.direction:
                 # it's socks5 bytestream
                 continue
@@ -879,17 +893,20 @@ class ConnectionIBBytestream(ConnectionBytestream):
                 # We waitthat other part accept stream
                 continue
             if file_props.direction[0] == '>':
-                if file_props.paused:
+                if file_props.paused or file_props.completed:
                     continue
                 if not file_props.connected:
                     #TODO: Reply with out of order error
                     continue
-                chunk = file_props.fp.read(file_props.block_size)
-                if chunk:
+                sent = False
+                while len(file_props.pending_ibb_acks) < window_size:
+                    chunk = file_props.fp.read(file_props.block_size)
+                    if not chunk:
+                        break
                     datanode = nbxmpp.Node(nbxmpp.NS_IBB + ' data', {
                         'sid': file_props.transport_sid,
-                        'seq': file_props.seq}, base64.b64encode(chunk.encode(
-                        'utf-8')).decode('utf-8'))
+                        'seq': file_props.seq},
+                        base64.b64encode(chunk).decode('ascii'))
                     file_props.seq += 1
                     file_props.started = True
                     if file_props.seq == 65536:
@@ -897,13 +914,17 @@ class ConnectionIBBytestream(ConnectionBytestream):
                     self.last_sent_ibb_id = self.connection.send(
                         nbxmpp.Protocol(name='iq', to=file_props.direction[1:],
                         typ='set', payload=[datanode]))
+                    file_props.pending_ibb_acks.add(self.last_sent_ibb_id)
+                    file_props.received_len += len(chunk)
+                    sent = True
+                if sent:
                     current_time = time.time()
                     file_props.elapsed_time += current_time - file_props.last_time
                     file_props.last_time = current_time
-                    file_props.received_len += len(chunk)
                     gajim.socks5queue.progress_transfer_cb(self.name,
                         file_props)
-                else:
+                elif not file_props.pending_ibb_acks:
+                    # all data has been acknowledged
                     # notify the other side about stream closing
                     # notify the local user about sucessfull send
                     # delete the local stream
@@ -924,10 +945,10 @@ class ConnectionIBBytestream(ConnectionBytestream):
         log.debug('ReceiveHandler called sid->%s seq->%s' % (sid, seq))
         try:
             seq = int(seq)
-            data = base64.b64decode(data.encode('utf-8')).decode('utf-8')
+            data = base64.b64decode(data)
         except Exception:
             seq = ''
-            data = ''
+            data = b''
         err = None
         file_props = FilesProp.getFilePropByTransportSid(self.name, sid)
         if file_props is None:
@@ -989,14 +1010,21 @@ class ConnectionIBBytestream(ConnectionBytestream):
         """
         syn_id = stanza.getID()
         log.debug('IBBAllIqHandler called syn_id->%s' % syn_id)
-        for file_props in FilesProp.getAllFileProp():
+        for file_props in FilesProp.getFilePropByAccount(self.name):
             if not file_props.direction or not file_props.connected:
                 # It's socks5 bytestream
                 # Or we closed the IBB stream
                 continue
             if file_props.syn_id == syn_id:
                 if stanza.getType() == 'error':
-                    if file_props.direction[0] == '<':
+                    if file_props.direction[:2] == '|>' and \
+                    stanza.getError() == 'resource-constraint' and \
+                    file_props.block_size > IBB_MIN_BLOCK_SIZE:
+                        # try again with smaller blocks
+                        self.OpenStream(file_props.sid,
+                            file_props.direction[2:], file_props.fp,
+                            max(file_props.block_size // 2, IBB_MIN_BLOCK_SIZE))
+                    elif file_props.direction[0] == '<':
                         conn.Event('IBB', 'ERROR ON RECEIVE', file_props)
                     else:
                         conn.Event('IBB', 'ERROR ON SEND', file_props)
@@ -1008,6 +1036,14 @@ class ConnectionIBBytestream(ConnectionBytestream):
                         conn.send(nbxmpp.Error(stanza,
                             nbxmpp.ERR_UNEXPECTED_REQUEST))
                 break
+            if syn_id in file_props.pending_ibb_acks:
+                # acknowledgement of a data stanza
+                file_props.pending_ibb_acks.discard(syn_id)
+                if stanza.getType() == 'error':
+                    conn.Event('IBB', 'ERROR ON SEND', file_props)
+                else:
+                    self.SendHandler()
+                break
         else:
             if stanza.getTag('data'):
                 sid = stanza.getTagAttr('data', 'sid')
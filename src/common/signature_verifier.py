@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+## src/common/signature_verifier.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim. If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Verify the OpenPGP signatures of presences in a few threads and remember the
+results
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import GLib
+
+log = logging.getLogger('gajim.c.signature_verifier')
+
+# Number of gpg processes verifying signatures at the same time
+MAX_VERIFICATIONS = 2
+# Number of (status, signature) results kept
+CACHE_SIZE = 1000
+
+class SignatureVerifier:
+    """
+    Give the keyID of the key that signed a presence status
+
+    Contacts send the same signed status again each time they change their
+    show or priority, and with each of their resources, so the keyID of a
+    (status, signature) pair is kept. Other signatures are verified by at most
+    MAX_VERIFICATIONS threads, each verification being able to run gpg once
+    per hash algorithm.
+    """
+
+    def __init__(self, gpg):
+        self.gpg = gpg
+        self._executor = ThreadPoolExecutor(max_workers=MAX_VERIFICATIONS)
+        self._lock = threading.Lock()
+        # {(status, signature): keyID}, least recently used first
+        self._key_ids = OrderedDict()
+        # {(status, signature): [(callback, args)]} of running verifications
+        self._pending = {}
+        # {jid: keyID of its last valid signature}
+        self._jid_keys = {}
+
+    def get_key_id(self, status, signature):
+        """
+        Return the keyID of a signature already verified, '' if it is not
+        valid or None if it was not verified yet
+        """
+        key = (status, signature)
+        with self._lock:
+            key_id = self._key_ids.get(key)
+            if key_id is not None:
+                self._key_ids.move_to_end(key)
+            return key_id
+
+    def _set_key_id(self, key, key_id):
+        with self._lock:
+            self._key_ids[key] = key_id
+            self._key_ids.move_to_end(key)
+            while len(self._key_ids) > CACHE_SIZE:
+                self._key_ids.popitem(last=False)
+
+    def _verify(self, jid, status, signature):
+        key_id = self.gpg.verify(status, signature, self._jid_keys.get(jid))
+        if key_id:
+            self._jid_keys[jid] = key_id
+        return key_id
+
+    def verify(self, jid, status, signature, callback, *args):
+        """
+        Verify signature of the status sent by jid in another thread
+
+        callback is called from the GLib main loop with the keyID, '' if the
+        signature is not valid, followed by args. A signature being verified
+        is not verified twice.
+        """
+        key = (status, signature)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key].append((callback, args))
+                return
+            self._pending[key] = [(callback, args)]
+
+        def on_done(future):
+            try:
+                key_id = future.result()
+            except Exception as e:
+                log.error('Error verifying the signature of %s: %s' % (jid, e))
+                key_id = ''
+            else:
+                self._set_key_id(key, key_id)
+            with self._lock:
+                callbacks = self._pending.pop(key)
+            for callback_, args_ in callbacks:
+                GLib.idle_add(callback_, key_id, *args_)
+
+        future = self._executor.submit(self._verify, jid, status, signature)
+        future.add_done_callback(on_done)
@@ -28,7 +28,10 @@ import hashlib
 import os
 import time
 from errno import EWOULDBLOCK
+from errno import EAGAIN
 from errno import ENOBUFS
+from errno import EINVAL
+from errno import ENOSYS
 from errno import EINTR
 from errno import EISCONN
 from errno import EINPROGRESS
@@ -42,6 +45,11 @@ if jingle_xtls.PYOPENSSL_PRESENT:
 import logging
 log = logging.getLogger('gajim.c.socks5')
 MAX_BUFF_LEN = 65536
+# the buffer used to transfer files grows from MAX_BUFF_LEN up to this size
+# while reads and writes fill it completely
+MAX_TRANSFER_BUFF_LEN = 1048576
+# minimum delay between two progress notifications of a transfer, in seconds
+PROGRESS_INTERVAL = 0.1
 # after foo seconds without activity label transfer as 'stalled'
 STALLED_TIMEOUT = 10
 # after foo seconds of waiting to connect, disconnect from
@@ -371,6 +379,12 @@ class SocksQueue:
                 account = actor.file_props.tt_account
             self.complete_transfer_cb(account, actor.file_props)
         elif self.progress_transfer_cb is not None:
+            # don't update the GUI for each chunk of data
+            current_time = time.time()
+            last_time = getattr(actor, 'last_progress_time', 0)
+            if 0 <= current_time - last_time < PROGRESS_INTERVAL:
+                return
+            actor.last_progress_time = current_time
             self.progress_transfer_cb(actor.account, actor.file_props)
 
     def remove_receiver_by_key(self, key, do_disconnect=True):
@@ -462,6 +476,11 @@ class Socks5(object):
         self.file = None
         self.connected = False
         self.mode = ''
+        # buffer used to transfer file contents, see _get_buffer()
+        self.buff_len = MAX_BUFF_LEN
+        self._buffer = None
+        self.use_sendfile = hasattr(os, 'sendfile')
+        self.last_progress_time = 0
         self.ssl_cert = None
         self.ssl_errnum = 0
 
@@ -652,10 +671,68 @@ class Socks5(object):
             self.disconnect()
         return len(raw_data)
 
+    def _is_plain_socket(self):
+        """
+        True if data is not encrypted, so the socket can be used directly
+        """
+        return isinstance(self._sock, socket.socket)
+
+    def _get_buffer(self):
+        if self._buffer is None or len(self._buffer) != self.buff_len:
+            self._buffer = bytearray(self.buff_len)
+        return self._buffer
+
+    def _adapt_buffer(self, length):
+        """
+        Use a bigger buffer while the current one is filled completely
+        """
+        if length >= self.buff_len and self.buff_len < MAX_TRANSFER_BUFF_LEN:
+            self.buff_len = min(self.buff_len * 2, MAX_TRANSFER_BUFF_LEN)
+
+    def _update_file_props(self):
+        current_time = time.time()
+        self.file_props.elapsed_time += current_time - \
+            self.file_props.last_time
+        self.file_props.last_time = current_time
+
+    def _read_next(self):
+        """
+        Read the next chunk of the file. Return a memoryview on the buffer
+        """
+        if not self._is_plain_socket():
+            return self.file.read(MAX_BUFF_LEN)
+        buffer_ = self._get_buffer()
+        length = self.file.readinto(buffer_)
+        return memoryview(buffer_)[:length]
+
+    def _sendfile_next(self):
+        """
+        Let the kernel copy the next chunk of the file to the socket. Return
+        the number of bytes sent, -1 if the file is at its end, or None if
+        os.sendfile can't be used
+        """
+        count = min(self.buff_len, self.file_props.size - self.size)
+        try:
+            lenn = os.sendfile(self._sock.fileno(), self.file.fileno(),
+                self.size, count)
+        except OSError as e:
+            if e.errno in (EINTR, ENOBUFS, EWOULDBLOCK, EAGAIN):
+                return 0
+            if e.errno in (EINVAL, ENOSYS):
+                # not supported for this file, read it ourselves
+                log.debug('os.sendfile failed, using buffers: %s' % e)
+                self.use_sendfile = False
+                self.file.seek(self.size)
+                return None
+            raise
+        if lenn == 0:
+            return -1
+        self._adapt_buffer(lenn)
+        return lenn
+
     def write_next(self):
-        if self.remaining_buff != b'':
-            buff = self.remaining_buff
-        else:
+        lenn = None
+        if len(self.remaining_buff) == 0:
             try:
                 self.open_file_for_reading()
             except IOError:
@@ -663,8 +740,29 @@ class Socks5(object):
                 self.disconnect()
                 self.file_props.error = -7 # unable to read from file
                 return -1
-            buff = self.file.read(MAX_BUFF_LEN)
-        if len(buff) > 0:
+            if self.use_sendfile and self._is_plain_socket() and \
+            self.size < self.file_props.size:
+                try:
+                    lenn = self._sendfile_next()
+                except Exception:
+                    # peer stopped reading
+                    self.state = 8 # end connection
+                    self.disconnect()
+                    self.file_props.error = -1
+                    return -1
+                if lenn == -1:
+                    self.state = 8 # end connection
+                    self.disconnect()
+                    return -1
+        if lenn is None:
+            if len(self.remaining_buff) > 0:
+                buff = self.remaining_buff
+            else:
+                buff = self._read_next()
+            if len(buff) == 0:
+                self.state = 8 # end connection
+                self.disconnect()
+                return -1
             lenn = 0
             try:
                 lenn = self._send(buff)
@@ -679,30 +777,25 @@ class Socks5(object):
                     self.disconnect()
                     self.file_props.error = -1
                     return -1
-            self.size += lenn
-            current_time = time.time()
-            self.file_props.elapsed_time += current_time - \
-                self.file_props.last_time
-            self.file_props.last_time = current_time
-            self.file_props.received_len = self.size
-            if self.size >= self.file_props.size:
-                self.state = 8 # end connection
-                self.file_props.error = 0
-                self.disconnect()
-                return -1
             if lenn != len(buff):
+                # slicing a memoryview doesn't copy data
                 self.remaining_buff = buff[lenn:]
             else:
                 self.remaining_buff = b''
-            self.state = 7 # continue to write in the socket
-            if lenn == 0:
-                return None
-            self.file_props.stalled = False
-            return lenn
-        else:
+                self._adapt_buffer(lenn)
+        self.size += lenn
+        self._update_file_props()
+        self.file_props.received_len = self.size
+        if self.size >= self.file_props.size:
             self.state = 8 # end connection
+            self.file_props.error = 0
             self.disconnect()
             return -1
+        self.state = 7 # continue to write in the socket
+        if lenn == 0:
+            return None
+        self.file_props.stalled = False
+        return lenn
 
     def get_file_contents(self, timeout):
         """
@@ -721,10 +814,7 @@ class Socks5(object):
                 return 0
             fd.write(self.remaining_buff)
             lenn = len(self.remaining_buff)
-            current_time = time.time()
-            self.file_props.elapsed_time += current_time - \
-                self.file_props.last_time
-            self.file_props.last_time = current_time
+            self._update_file_props()
             self.file_props.received_len += lenn
             self.remaining_buff = b''
             if self.file_props.received_len == self.file_props.size:
@@ -741,17 +831,20 @@ class Socks5(object):
                 self.file_props.error = -6 # file system error
                 return 0
             try:
-                buff = self._recv(MAX_BUFF_LEN)
+                if self._is_plain_socket():
+                    # receive directly in our buffer, without copy
+                    buffer_ = self._get_buffer()
+                    buff = memoryview(buffer_)[:self._sock.recv_into(buffer_)]
+                    self._adapt_buffer(len(buff))
+                else:
+                    buff = self._recv(MAX_BUFF_LEN)
             except (OpenSSL.SSL.WantReadError, OpenSSL.SSL.WantWriteError,
             OpenSSL.SSL.WantX509LookupError) as e:
                 log.info('SSL rehandshake request :' + repr(e))
                 raise e
             except Exception:
                 buff = b''
-            current_time = time.time()
-            self.file_props.elapsed_time += current_time - \
-                self.file_props.last_time
-            self.file_props.last_time = current_time
+            self._update_file_props()
             self.file_props.received_len += len(buff)
             if len(buff) == 0:
                 # Transfer stopped  somehow:
@@ -0,0 +1,229 @@
+# -*- coding:utf-8 -*-
+## src/common/special_text.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim. If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Find the special text (links, mail addresses, ASCII formatting and emoticons)
+of the messages printed in a conversation
+"""
+
+import re
+
+# regexp meta characters are:  . ^ $ * + ? { } [ ] \ | ( )
+# one escapes the metachars with \
+# \S matches anything but ' ' '\t' '\n' '\r' '\f' and '\v'
+# \s matches any whitespace character
+# \w any alphanumeric character
+# \W any non-alphanumeric character
+# \b means word boundary. This is a zero-width assertion that
+#    matches only at the beginning or end of a word.
+# ^ matches at the beginning of lines
+#
+# * means 0 or more times
+# + means 1 or more times
+# ? means 0 or 1 time
+# | means or
+# [^*] anything but '*' (inside [] you don't have to escape metachars)
+# [^\s*] anything but whitespaces and '*'
+# (?<!\S) is a one char lookbehind assertion and asks for any leading
+#         whitespace
+# and mathces beginning of lines so we have correct formatting detection
+# even if the the text is just '*foo*'
+# (?!\S) is the same thing but it's a lookahead assertion
+# \S*[^\s\W] --> in the matching string don't match ? or ) etc.. if at
+#                the end
+# so http://be) will match http://be and http://be)be) will match
+# http://be)be
+
+LEGACY_PREFIXES = r"((?<=\()(www|ftp)\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$"\
+    r"&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+(?=\)))"\
+    r"|((www|ftp)\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]"\
+    r"|%[A-Fa-f0-9]{2})+"\
+    r"\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+)"
+# NOTE: it's ok to catch www.gr such stuff exist!
+
+# FIXME: recognize xmpp: and treat it specially
+LINKS = r"((?<=\()[A-Za-z][A-Za-z0-9\+\.\-]*:"\
+    r"([\w\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+"\
+    r"(?=\)))|(\w[\w\+\.\-]*:([^<>\s]|%[A-Fa-f0-9]{2})+)"
+
+# 2nd one: at_least_one_char@at_least_one_char.at_least_one_char
+MAIL = r'\bmailto:\S*[^\s\W]|' r'\b\S+@\S+\.\S*[^\s\W]'
+
+# detects eg. *b* *bold* *bold bold* test *bold* *bold*! (*bold*)
+# doesn't detect (it's a feature :P) * bold* *bold * * bold * test*bold*
+FORMATTING = r'|(?<!\w)' r'\*[^\s*]' r'([^*]*[^\s*])?' r'\*(?!\w)|'\
+    r'(?<!\S)' r'/[^\s/]' r'([^/]*[^\s/])?' r'/(?!\S)|'\
+    r'(?<!\w)' r'_[^\s_]' r'([^_]*[^\s_])?' r'_(?!\w)'
+
+LINK_PATTERN = LINKS + '|' + MAIL + '|' + LEGACY_PREFIXES
+
+# Every link or mail address contains one of them
+LINK_MARKERS = (':', '@')
+LEGACY_MARKERS = ('www.', 'ftp.')
+FORMATTING_MARKERS = ('*', '/', '_')
+
+def get_basic_pattern(ascii_formatting):
+    """
+    Return the pattern of links, mail addresses and, if ascii_formatting is
+    True, *bold*, /italic/ and _underlined_ text
+    """
+    if ascii_formatting:
+        return LINK_PATTERN + FORMATTING
+    return LINK_PATTERN
+
+def _fold(char):
+    """
+    Fold the case of one character the way the emoticons keys are, keeping
+    characters whose upper case is longer than one character (like ß)
+    """
+    upper = char.upper()
+    if len(upper) == 1:
+        return upper
+    return char
+
+def _fold_text(text):
+    return ''.join(_fold(char) for char in text)
+
+
+class EmoticonMatcher:
+    """
+    Trie of the emoticons of a theme
+
+    The trie is turned into a pattern where emoticons sharing a prefix share
+    the same branch, so the regular expression engine looks at each character
+    of a message once instead of trying every emoticon in turn.
+    """
+
+    def __init__(self, emoticons):
+        self.emoticons = set(_fold_text(emoticon) for emoticon in emoticons
+            if emoticon)
+
+    @staticmethod
+    def _get_trie(emoticons):
+        trie = {}
+        for emoticon in emoticons:
+            node = trie
+            for char in emoticon:
+                node = node.setdefault(char, {})
+            # the end of an emoticon
+            node[''] = {}
+        return trie
+
+    @classmethod
+    def _get_trie_pattern(cls, node):
+        # Longer emoticons come first, the end of the emoticon last, so the
+        # longest emoticon matches first and the engine goes back to the
+        # shorter ones if what follows it does not fit
+        alternatives = [re.escape(char) + cls._get_trie_pattern(node[char])
+            for char in sorted(node) if char]
+        if '' in node:
+            alternatives.append('')
+        if len(alternatives) == 1:
+            return alternatives[0]
+        if len(alternatives) == 2 and not alternatives[1]:
+            return '(?:%s)?' % alternatives[0]
+        return '(?:%s)' % '|'.join(alternatives)
+
+    def get_pattern(self):
+        """
+        Return the pattern matching the emoticons, or '' if there is none
+
+        When an emoticon is bordered by an alpha-numeric character it is NOT
+        expanded.  e.g., foo:) NO, foo :) YES, (brb) NO, (:)) YES, etc
+        We still allow multiple emoticons side-by-side like :P:P:P
+        """
+        if not self.emoticons:
+            return ''
+        emoticons_pattern = self._get_trie_pattern(self._get_trie(
+            self.emoticons))
+        # a lookbehind needs emoticons of the same length
+        by_length = {}
+        for emoticon in self.emoticons:
+            by_length.setdefault(len(emoticon), []).append(emoticon)
+        prematch = ''.join('|(?<=%s)' % self._get_trie_pattern(
+            self._get_trie(by_length[length])) for length in sorted(by_length,
+            reverse=True))
+        first_chars = ''.join(sorted(set(re.escape(emoticon[0]) for emoticon \
+            in self.emoticons)))
+        # Only look around the positions where an emoticon may start. Then
+        # emoticons must either have whitespace, or another emoticon next to
+        # it to match successfully
+        # [\w.] alphanumeric and dot (for not matching 8) in (2.8))
+        return r'(?=[' + first_chars + r'])(?:(?<![\w.])' + prematch + ')' + \
+            emoticons_pattern + r'(?:(?!\w)|(?=' + emoticons_pattern + '))'
+
+
+class SpecialTextTokenizer:
+    """
+    Find the spans of the special text of a message
+
+    Build one each time the emoticons theme or the ascii_formatting option
+    changes. The basic pattern is only tried on texts that may contain a link
+    or some formatting.
+    """
+
+    def __init__(self, emoticons=(), ascii_formatting=True):
+        self.ascii_formatting = ascii_formatting
+        self.basic_pattern = get_basic_pattern(ascii_formatting)
+        self.emoticons_pattern = EmoticonMatcher(emoticons).get_pattern()
+        self.basic_re = re.compile(self.basic_pattern, re.IGNORECASE)
+        self.emoticons_re = None
+        self.special_re = None
+        if self.emoticons_pattern:
+            self.emoticons_re = re.compile(self.emoticons_pattern,
+                re.IGNORECASE + re.UNICODE)
+            # because emoticons match later (in the string) they need to be
+            # after basic matches that may occur earlier
+            self.special_re = re.compile(self.basic_pattern + '|' + \
+                self.emoticons_pattern, re.IGNORECASE + re.UNICODE)
+
+    def _may_contain_basic(self, text):
+        for marker in LINK_MARKERS:
+            if marker in text:
+                return True
+        if self.ascii_formatting:
+            for marker in FORMATTING_MARKERS:
+                if marker in text:
+                    return True
+        lowered = text.lower()
+        for marker in LEGACY_MARKERS:
+            if marker in lowered:
+                return True
+        return False
+
+    def tokenize(self, text, emoticons=True):
+        """
+        Yield the (start, end) spans of the special text of text, in order
+
+        Where a link or some formatting and an emoticon start at the same
+        position, the link or formatting wins.
+        """
+        if not text:
+            return
+        basic = self._may_contain_basic(text)
+        if emoticons and self.special_re:
+            if basic:
+                regex = self.special_re
+            else:
+                regex = self.emoticons_re
+        elif basic:
+            regex = self.basic_re
+        else:
+            return
+        for match in regex.finditer(text):
+            yield match.span()
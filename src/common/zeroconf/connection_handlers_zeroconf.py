@@ -58,6 +58,10 @@ class ConnectionVcard(connection_handlers.ConnectionVcard):
     def request_vcard(self, jid = None, is_fake_jid = False):
         pass
 
+    def queue_vcard_request(self, jid, groupchat_jid=None, visible=False,
+    avatar_changed=False):
+        pass
+
     def send_vcard(self, vcard):
         pass
 
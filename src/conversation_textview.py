@@ -37,6 +37,7 @@ from gi.repository import GObject
 from gi.repository import GLib
 import time
 import os
+import bisect
 import tooltips
 import dialogs
 import queue
@@ -187,7 +188,12 @@ class ConversationTextview(GObject.GObject):
         GObject.GObject.__init__(self)
         self.used_in_history_window = used_in_history_window
         self.line = 0
+        # [(timestamp, line_start_mark, msg_stanza_id)] sorted by timestamp
         self.message_list = []
+        # timestamps of message_list, to find where to insert a line
+        self.message_times = []
+        # True while print_conversation_lines prints a batch of lines
+        self.printing_lines = False
         self.corrected_text_list = {}
         self.fc = FuzzyClock()
 
@@ -500,7 +506,7 @@ class ConversationTextview(GObject.GObject):
             return None
 
         end_mark, index = self.get_end_mark(correct_id, start_mark)
-        if not index:
+        if index is None:
             log.debug('Could not find line to correct')
             return None
 
@@ -1046,17 +1052,14 @@ class ConversationTextview(GObject.GObject):
         specials_limit = 100
 
         # basic: links + mail + formatting is always checked (we like that)
-        if gajim.config.get('emoticons_theme') and graphics:
-            # search for emoticons & urls
-            iterator = gajim.interface.emot_and_basic_re.finditer(otext)
-        else: # search for just urls + mail + formatting
-            iterator = gajim.interface.basic_pattern_re.finditer(otext)
+        # and emoticons are searched too if we show them
+        iterator = gajim.interface.special_text_tokenizer.tokenize(otext,
+            emoticons=graphics)
         if iter_:
             end_iter = iter_
         else:
             end_iter = buffer_.get_end_iter()
-        for match in iterator:
-            start, end = match.span()
+        for start, end in iterator:
             special_text = otext[start:end]
             if start > index:
                 text_before_special_text = otext[index:start]
@@ -1253,23 +1256,39 @@ class ConversationTextview(GObject.GObject):
         return None, None
 
     def get_insert_mark(self, timestamp):
-        # message_list = [(timestamp, line_start_mark, msg_stanza_id)]
-        # We check if this is a new Message
-        try:
-            if self.message_list[-1][0] <= timestamp:
-                return None, None
-        except IndexError:
-            # We have no Messages in the TextView
+        # Search for the first message newer than this one
+        index = bisect.bisect_right(self.message_times, timestamp)
+        if index == len(self.message_times):
+            # We have no Messages in the TextView or this is a new Message
             return None, None
+        return self.message_list[index][1], index
 
-        # Not a new Message
-        # Search for insertion point
-        for index, msg in enumerate(self.message_list):
-            if msg[0] > timestamp:
-                return msg[1], index
+    def print_conversation_lines(self, lines):
+        """
+        Print several 'chat' type messages sorted by time, like the ones
+        restored from the logs. lines is a list of dicts of the arguments of
+        print_conversation_line.
 
-        # Should not happen, but who knows
-        return None, None
+        They are inserted in one user action and the textview is scrolled only
+        once, at the end.
+        """
+        if not lines:
+            return
+        buffer_ = self.tv.get_buffer()
+        at_the_end = self.at_the_end()
+        buffer_.begin_user_action()
+        self.printing_lines = True
+        try:
+            for line in lines:
+                self.print_conversation_line(**line)
+        finally:
+            self.printing_lines = False
+            buffer_.end_user_action()
+        if at_the_end:
+            if gajim.config.get('use_smooth_scrolling'):
+                GLib.idle_add(self.smooth_scroll_to_end)
+            else:
+                GLib.idle_add(self.scroll_to_end)
 
     def print_conversation_line(self, text, jid, kind, name, tim,
     other_tags_for_name=None, other_tags_for_time=None, other_tags_for_text=None,
@@ -1330,7 +1349,8 @@ class ConversationTextview(GObject.GObject):
         # even if we insert directly at the mark iter
         temp_mark = buffer_.create_mark('temp', iter_, left_gravity=True)
 
-        at_the_end = self.at_the_end()
+        if not self.printing_lines:
+            at_the_end = self.at_the_end()
 
         if text.startswith('/me '):
             direction_mark = i18n.paragraph_direction_mark(str(text[3:]))
@@ -1400,22 +1420,25 @@ class ConversationTextview(GObject.GObject):
         new_mark = buffer_.create_mark(
             str(self.line), temp_iter, left_gravity=False)
 
-        if not index:
+        if index is None:
             # New Message
             self.message_list.append((tim, new_mark, msg_stanza_id))
+            self.message_times.append(tim)
         elif corrected:
-            # Replace the corrected message
-            self.message_list[index] = (tim, new_mark, msg_stanza_id)
+            # Replace the corrected message, it keeps its place in the list
+            self.message_list[index] = (self.message_times[index], new_mark,
+                msg_stanza_id)
         else:
             # We insert the message at index
             self.message_list.insert(index, (tim, new_mark, msg_stanza_id))
+            self.message_times.insert(index, tim)
 
         if kind == 'incoming':
             self.last_received_message_id[name] = (msg_stanza_id, new_mark)
         elif kind == 'outgoing':
             self.last_sent_message_id = (msg_stanza_id, new_mark)
 
-        if not insert_mark:
+        if not insert_mark and not self.printing_lines:
             if at_the_end or kind == 'outgoing':
                 # we are at the end or we are sending something
                 # scroll to the end (via idle in case the scrollbar has appeared)
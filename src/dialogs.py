@@ -3378,6 +3378,8 @@ class XMLConsoleWindow:
 
         self.enabled = True
         self.xml.get_object('enable_checkbutton').set_active(True)
+        self.xml.get_object('profile_events_checkbutton').set_active(
+            gajim.ged.profiling)
 
         col = Gdk.RGBA()
         Gdk.RGBA.parse(col, color)
@@ -3415,6 +3417,51 @@ class XMLConsoleWindow:
     def on_enable_checkbutton_toggled(self, widget):
         self.enabled = widget.get_active()
 
+    def on_profile_events_checkbutton_toggled(self, widget):
+        gajim.ged.enable_profiling(widget.get_active())
+
+    def on_event_stats_button_clicked(self, widget):
+        stats = gajim.ged.get_profiling_stats()
+        if not stats:
+            text = _('No event statistics recorded. Enable event profiling '
+                'first.')
+        else:
+            lines = [_('Event handler statistics (calls, total time):')]
+            for event_name, handler, calls, total in stats:
+                lines.append('%s %s: %d, %.3f ms' % (event_name, handler, calls,
+                    total * 1000))
+            text = '\n'.join(lines)
+        counters = gajim.nec.get_counters()
+        text += '\n' + _('Network events created: %(created)d, dispatched: '
+            '%(dispatched)d, pruned: %(pruned)d') % counters
+        if self.account in gajim.connections:
+            counters = gajim.connections[self.account].get_vcard_counters()
+            text += '\n' + _('Avatar vCard requests queued: %(queued)d, '
+                'deduplicated: %(deduplicated)d, skipped (no avatar): '
+                '%(skipped)d, sent: %(sent)d, answered: %(answered)d, without '
+                'avatar: %(no_avatar)d, timed out: %(timed_out)d, waiting: '
+                '%(waiting)d, in flight: %(in_flight)d') % counters
+        if self.account in gajim.connections and hasattr(
+        gajim.connections[self.account], 'get_mam_counters'):
+            counters = gajim.connections[self.account].get_mam_counters()
+            text += '\n' + _('Message archive catch-up: %(complete)d of '
+                '%(periods)d periods complete, %(running)d queries running, '
+                '%(pages)d pages, %(messages)d messages in %(duration).1f s '
+                '(%(throughput).1f messages/s)') % counters
+        stats = gtkgui_helpers.avatar_cache.get_stats()
+        text += '\n' + _('Decoded avatars cache: %(hit_rate).1f%% hits '
+            '(%(hits)d hits, %(misses)d misses), decoded: %(decoded)d, '
+            'scaled: %(scaled)d, evicted: %(evicted)d, %(images)d images in '
+            '%(size)d KiB') % stats
+        stats = gajim.image_fetcher.cache.get_stats()
+        text += '\n' + _('XHTML-IM images cache: %(hit_rate).1f%% hits '
+            '(%(hits)d hits, %(misses)d misses), evicted: %(evicted)d, '
+            '%(images)d images in %(size)d KiB') % stats
+        buffer_ = self.stanzas_log_textview.get_buffer()
+        end_iter = buffer_.get_end_iter()
+        buffer_.insert(end_iter, text + '\n\n')
+        GLib.idle_add(gtkgui_helpers.scroll_to_end, self.parent)
+
     def on_in_stanza_checkbutton_toggled(self, widget):
         active = widget.get_active()
         self.tagIn.set_property('invisible', active)
@@ -215,6 +215,14 @@ class GajimRemote:
                                         'file'),
                                 [ ]
                         ],
+                'events_profiling': [
+                                _('Shows the number of calls and time spent in each '
+                                        'event handler'),
+                                [
+                                        (_('action'), _('\'start\' or \'stop\' recording, '
+                                                '\'reset\' the statistics'), False)
+                                ]
+                        ],
                 'remove_contact': [
                                 _('Removes contact from roster'),
                                 [
@@ -367,6 +375,10 @@ class GajimRemote:
                 for pref_key in pref_keys:
                     result = '%s = %s' % (pref_key, res[pref_key])
                     print(result)
+            elif self.command == 'events_profiling':
+                for event_name, handler, calls, total in res:
+                    print('%s\t%s\t%d\t%.3f ms' % (event_name, handler,
+                        calls, total * 1000))
             elif self.command == 'contact_info':
                 print(self.print_info(0, res, True))
             elif res:
@@ -30,6 +30,7 @@
 import os
 import time
 import locale
+import collections
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
@@ -71,6 +72,12 @@ class Column(IntEnum):
     TYPE = 2 # type of the row ('contact' or 'role')
     TEXT = 3 # text shown in the cellrenderer
     AVATAR = 4 # avatar of the contact
+    SORT_KEY = 5 # the model is sorted on it, see _get_sort_key
+
+# Avatars of the occupants present when we join are loaded and asked by groups
+# of AVATAR_QUEUE_BATCH every AVATAR_QUEUE_INTERVAL milliseconds
+AVATAR_QUEUE_BATCH = 5
+AVATAR_QUEUE_INTERVAL = 250
 
 empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
@@ -427,11 +434,25 @@ class GroupchatControl(ChatControlBase):
         hpaned_position = gajim.config.get('gc-hpaned-position')
         self.hpaned.set_position(hpaned_position)
 
-        #status_image, shown_nick, type, nickname, avatar
-        self.columns = [Gtk.Image, str, str, str, GdkPixbuf.Pixbuf]
+        #status_image, shown_nick, type, nickname, avatar, sort_key
+        self.columns = [Gtk.Image, str, str, str, GdkPixbuf.Pixbuf, str]
         self.model = Gtk.TreeStore(*self.columns)
-        self.model.set_sort_func(Column.NICK, self.tree_compare_iters)
-        self.model.set_sort_column_id(Column.NICK, Gtk.SortType.ASCENDING)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+        # nick -> Gtk.TreeRowReference of the contact row in self.model
+        self.nick_rows = {}
+        # role -> Gtk.TreeIter of the role row in self.model
+        self.role_iters = {}
+        # presences of the occupants received before our own one when we join
+        # {nick: GcPresenceReceivedEvent}
+        self.join_presences = collections.OrderedDict()
+        # True while the occupants of join_presences are added
+        self.bulk_joining = False
+        # (nick, real jid) of the occupants whose avatar must be loaded
+        self.avatar_queue = collections.deque()
+        # {nick: GcPresenceReceivedEvent} of the occupants of join_presences
+        # waiting in avatar_queue, their avatar SHA is checked with it
+        self.avatar_presences = {}
+        self.avatar_queue_id = None
 
         # columns
         column = Gtk.TreeViewColumn()
@@ -567,44 +588,22 @@ class GroupchatControl(ChatControlBase):
             renderer.set_property(self.renderers_propertys[renderer][0],
                 self.renderers_propertys[renderer][1])
 
-    def tree_compare_iters(self, model, iter1, iter2, data=None):
-        """
-        Compare two iters to sort them
-        """
-        type1 = model[iter1][Column.TYPE]
-        type2 = model[iter2][Column.TYPE]
-        if not type1 or not type2:
-            return 0
-        nick1 = model[iter1][Column.NICK]
-        nick2 = model[iter2][Column.NICK]
-        if not nick1 or not nick2:
-            return 0
-        if type1 == 'role':
-            return locale.strcoll(nick1, nick2)
-        if type1 == 'contact':
-            gc_contact1 = gajim.contacts.get_gc_contact(self.account,
-                    self.room_jid, nick1)
-            if not gc_contact1:
-                return 0
-        if type2 == 'contact':
-            gc_contact2 = gajim.contacts.get_gc_contact(self.account,
-                    self.room_jid, nick2)
-            if not gc_contact2:
-                return 0
-        if type1 == 'contact' and type2 == 'contact' and \
-        gajim.config.get('sort_by_show_in_muc'):
+    def _get_sort_key(self, type_, nick, show=None):
+        """
+        Return the sort key of a row, so the model sorts its rows with the
+        default comparison of strings
+
+        Roles are sorted by name and occupants by nick, after their show if
+        sort_by_show_in_muc is True. Must be called again when the show
+        changes, draw_contact does it.
+        """
+        if type_ == 'role':
+            return helpers.get_sort_key(nick)
+        if gajim.config.get('sort_by_show_in_muc'):
             cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
                 'invisible': 5, 'offline': 6, 'error': 7}
-            show1 = cshow[gc_contact1.show]
-            show2 = cshow[gc_contact2.show]
-            if show1 < show2:
-                return -1
-            elif show1 > show2:
-                return 1
-        # We compare names
-        name1 = gc_contact1.get_shown_name()
-        name2 = gc_contact2.get_shown_name()
-        return locale.strcoll(name1.lower(), name2.lower())
+            return helpers.get_sort_key(cshow.get(show, 8), nick.lower())
+        return helpers.get_sort_key(nick.lower())
 
     def on_msg_textview_populate_popup(self, textview, menu):
         """
@@ -1100,16 +1099,23 @@ class GroupchatControl(ChatControlBase):
             gajim.interface.roster.draw_contact(self.room_jid, self.account)
 
     def get_contact_iter(self, nick):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            user_iter = self.model.iter_children(role_iter)
-            while user_iter:
-                if nick == self.model[user_iter][Column.NICK]:
-                    return user_iter
-                else:
-                    user_iter = self.model.iter_next(user_iter)
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        row_ref = self.nick_rows.get(nick)
+        if not row_ref:
+            return None
+        path = row_ref.get_path()
+        if not path:
+            # row has been removed
+            del self.nick_rows[nick]
+            return None
+        return self.model.get_iter(path)
+
+    def clear_model(self):
+        """
+        Remove all rows from the occupant list
+        """
+        self.model.clear()
+        self.nick_rows = {}
+        self.role_iters = {}
 
     def print_old_conversation(self, text, contact='', tim=None, xhtml = None,
     displaymarking=None, msg_stanza_id=None):
@@ -1408,7 +1414,9 @@ class GroupchatControl(ChatControlBase):
         change_subject_button = self.xml.get_object('change_subject_button')
         change_subject_button.set_sensitive(False)
         self.list_treeview.set_model(None)
-        self.model.clear()
+        self.clear_model()
+        self.join_presences.clear()
+        self.stop_avatar_queue()
         nick_list = gajim.contacts.get_nick_list(self.account, self.room_jid)
         for nick in nick_list:
             # Update pm chat window
@@ -1451,7 +1459,7 @@ class GroupchatControl(ChatControlBase):
         return True
 
     def draw_roster(self):
-        self.model.clear()
+        self.clear_model()
         for nick in gajim.contacts.get_nick_list(self.account, self.room_jid):
             gc_contact = gajim.contacts.get_gc_contact(self.account,
                 self.room_jid, nick)
@@ -1486,6 +1494,10 @@ class GroupchatControl(ChatControlBase):
             return
         gc_contact = gajim.contacts.get_gc_contact(self.account, self.room_jid,
                 nick)
+        sort_key = self._get_sort_key('contact', gc_contact.get_shown_name(),
+            gc_contact.show)
+        if self.model[iter_][Column.SORT_KEY] != sort_key:
+            self.model[iter_][Column.SORT_KEY] = sort_key
         state_images = gajim.interface.jabber_state_images['16']
         if len(gajim.events.get_events(self.account, self.room_jid + '/' + \
         nick)):
@@ -1540,14 +1552,11 @@ class GroupchatControl(ChatControlBase):
         if not iter_:
             return
         fake_jid = self.room_jid + '/' + nick
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid)
+        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid,
+            kind='roster')
         if pixbuf in ('ask', None):
-            scaled_pixbuf = empty_pixbuf
-        else:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'roster')
-            if not scaled_pixbuf:
-                scaled_pixbuf = empty_pixbuf
-        self.model[iter_][Column.AVATAR] = scaled_pixbuf
+            pixbuf = empty_pixbuf
+        self.model[iter_][Column.AVATAR] = pixbuf
 
     def draw_role(self, role):
         role_iter = self.get_role_iter(role)
@@ -1570,6 +1579,21 @@ class GroupchatControl(ChatControlBase):
         if obj.ptype == 'error':
             return
 
+        if not gajim.gc_connected[self.account].get(self.room_jid) and \
+        obj.nick != self.nick and not (obj.status_code and \
+        '110' in obj.status_code):
+            # We are joining: show all occupants at once when our own presence
+            # comes
+            if obj.show in ('offline', 'error'):
+                self.join_presences.pop(obj.nick, None)
+            else:
+                self.join_presences[obj.nick] = obj
+            return
+        if self.join_presences:
+            self.add_join_presences()
+        # this presence is newer than the one of join_presences
+        self.avatar_presences.pop(obj.nick, None)
+
         role = obj.role
         if not role:
             role = 'visitor'
@@ -1705,14 +1729,12 @@ class GroupchatControl(ChatControlBase):
                         self.gc_custom_colors[obj.new_nick] = \
                             self.gc_custom_colors[obj.nick]
                     # rename vcard / avatar
+                    gajim.logger.rename_vcard(self.room_jid, obj.nick,
+                        obj.new_nick)
                     puny_jid = helpers.sanitize_filename(self.room_jid)
                     puny_nick = helpers.sanitize_filename(obj.nick)
                     puny_new_nick = helpers.sanitize_filename(obj.new_nick)
-                    old_path = os.path.join(gajim.VCARD_PATH, puny_jid,
-                        puny_nick)
-                    new_path = os.path.join(gajim.VCARD_PATH, puny_jid,
-                        puny_new_nick)
-                    files = {old_path: new_path}
+                    files = {}
                     path = os.path.join(gajim.AVATAR_PATH, puny_jid)
                     # possible extensions
                     for ext in ('.png', '.jpeg', '_notif_size_bw.png',
@@ -1729,6 +1751,10 @@ class GroupchatControl(ChatControlBase):
                                 # will also remove 'TEST'
                                 os.remove(files[old_file])
                             os.rename(old_file, files[old_file])
+                    gtkgui_helpers.avatar_cache.invalidate(self.room_jid,
+                        obj.nick)
+                    gtkgui_helpers.avatar_cache.invalidate(self.room_jid,
+                        obj.new_nick)
                     self.print_conversation(s, 'info', graphics=False)
                 elif '321' in obj.status_code:
                     s = _('%(nick)s has been removed from the room '
@@ -1794,35 +1820,7 @@ class GroupchatControl(ChatControlBase):
                     log.error('%s has an iter, but no gc_contact instance' % \
                         obj.nick)
                     return
-                # Re-get vcard if avatar has changed
-                # We do that here because we may request it to the real JID if
-                # we knows it. connections.py doesn't know it.
-                con = gajim.connections[self.account]
-                if gc_c and gc_c.jid:
-                    real_jid = gc_c.jid
-                else:
-                    real_jid = obj.fjid
-                if obj.fjid in obj.conn.vcard_shas:
-                    if obj.avatar_sha != obj.conn.vcard_shas[obj.fjid]:
-                        server = gajim.get_server_from_jid(self.room_jid)
-                        if not server.startswith('irc'):
-                            obj.conn.request_vcard(real_jid, obj.fjid)
-                else:
-                    cached_vcard = obj.conn.get_cached_vcard(obj.fjid, True)
-                    if cached_vcard and 'PHOTO' in cached_vcard and \
-                    'SHA' in cached_vcard['PHOTO']:
-                        cached_sha = cached_vcard['PHOTO']['SHA']
-                    else:
-                        cached_sha = ''
-                    if cached_sha != obj.avatar_sha:
-                        # avatar has been updated
-                        # sha in mem will be updated later
-                        server = gajim.get_server_from_jid(self.room_jid)
-                        if not server.startswith('irc'):
-                            obj.conn.request_vcard(real_jid, obj.fjid)
-                    else:
-                        # save sha in mem NOW
-                        obj.conn.vcard_shas[obj.fjid] = obj.avatar_sha
+                self.check_avatar_sha(obj, gc_c)
 
                 actual_affiliation = gc_c.affiliation
                 if affiliation != actual_affiliation:
@@ -1894,6 +1892,41 @@ class GroupchatControl(ChatControlBase):
                     st += ' (' + obj.status + ')'
                 self.print_conversation(st, graphics=False)
 
+    def check_avatar_sha(self, obj, gc_c):
+        """
+        Re-get the vCard of an occupant if the avatar SHA of its presence obj
+        changed
+        """
+        # We do that here because we may request it to the real JID if
+        # we knows it. connections.py doesn't know it.
+        if gc_c and gc_c.jid:
+            real_jid = gc_c.jid
+        else:
+            real_jid = obj.fjid
+        if obj.fjid in obj.conn.vcard_shas:
+            if obj.avatar_sha != obj.conn.vcard_shas[obj.fjid]:
+                server = gajim.get_server_from_jid(self.room_jid)
+                if not server.startswith('irc'):
+                    obj.conn.queue_vcard_request(real_jid, obj.fjid,
+                        avatar_changed=True)
+        else:
+            cached_vcard = obj.conn.get_cached_vcard(obj.fjid, True)
+            if cached_vcard and 'PHOTO' in cached_vcard and \
+            'SHA' in cached_vcard['PHOTO']:
+                cached_sha = cached_vcard['PHOTO']['SHA']
+            else:
+                cached_sha = ''
+            if cached_sha != obj.avatar_sha:
+                # avatar has been updated
+                # sha in mem will be updated later
+                server = gajim.get_server_from_jid(self.room_jid)
+                if not server.startswith('irc'):
+                    obj.conn.queue_vcard_request(real_jid, obj.fjid,
+                        avatar_changed=True)
+            else:
+                # save sha in mem NOW
+                obj.conn.vcard_shas[obj.fjid] = obj.avatar_sha
+
     def add_contact_to_roster(self, nick, show, role, affiliation, status,
     jid=''):
         role_name = helpers.get_uf_role(role, plural=True)
@@ -1909,23 +1942,44 @@ class GroupchatControl(ChatControlBase):
 
         name = nick
 
+        if nick in self.nick_rows:
+            # Don't show the same nick twice
+            self.remove_contact_row(nick)
         role_iter = self.get_role_iter(role)
         if not role_iter:
             role_iter = self.model.append(None,
                 [gajim.interface.jabber_state_images['16']['closed'], role,
-                'role', role_name,  None] + [None] * self.nb_ext_renderers)
-            self.draw_all_roles()
-        iter_ = self.model.append(role_iter, [None, nick, 'contact', name, None] + \
+                'role', role_name,  None, self._get_sort_key('role', role)] + \
                 [None] * self.nb_ext_renderers)
-        if not nick in gajim.contacts.get_nick_list(self.account,
-        self.room_jid):
+            self.role_iters[role] = role_iter
+            self.draw_all_roles()
+        iter_ = self.model.append(role_iter, [None, nick, 'contact', name, None,
+            self._get_sort_key('contact', nick, show)] + \
+            [None] * self.nb_ext_renderers)
+        self.nick_rows[nick] = Gtk.TreeRowReference.new(self.model,
+            self.model.get_path(iter_))
+        if not gajim.contacts.get_gc_contact(self.account, self.room_jid,
+        nick):
             gc_contact = gajim.contacts.create_gc_contact(
                 room_jid=self.room_jid, account=self.account,
                 name=nick, show=show, status=status, role=role,
                 affiliation=affiliation, jid=j, resource=resource)
             gajim.contacts.add_gc_contact(self.account, gc_contact)
         self.draw_contact(nick)
-        self.draw_avatar(nick)
+        if self.bulk_joining:
+            self.avatar_queue.append((nick, j))
+        else:
+            self.draw_avatar(nick)
+            self.ask_avatar(nick, j)
+        if nick == self.nick: # we became online
+            self.got_connected()
+        if self.list_treeview.get_model():
+            self.list_treeview.expand_row((self.model.get_path(role_iter)), False)
+        if self.is_continued:
+            self.draw_banner_text()
+        return iter_
+
+    def ask_avatar(self, nick, jid):
         # Do not ask avatar to irc rooms as irc transports reply with messages
         server = gajim.get_server_from_jid(self.room_jid)
         if gajim.config.get('ask_avatars_on_startup') and \
@@ -1933,43 +1987,111 @@ class GroupchatControl(ChatControlBase):
             fake_jid = self.room_jid + '/' + nick
             pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid)
             if pixbuf == 'ask':
-                if j and not self.is_anonymous:
-                    gajim.connections[self.account].request_vcard(j, fake_jid)
-                else:
-                    gajim.connections[self.account].request_vcard(fake_jid,
+                if jid and not self.is_anonymous:
+                    gajim.connections[self.account].queue_vcard_request(jid,
                         fake_jid)
-        if nick == self.nick: # we became online
-            self.got_connected()
-        if self.list_treeview.get_model():
-            self.list_treeview.expand_row((self.model.get_path(role_iter)), False)
-        if self.is_continued:
-            self.draw_banner_text()
-        return iter_
+                else:
+                    gajim.connections[self.account].queue_vcard_request(
+                        fake_jid, fake_jid)
+
+    def add_join_presences(self):
+        """
+        Add the occupants whose presence came before ours when we joined. The
+        model is sorted once they are all added, and their avatars are loaded
+        later by process_avatar_queue
+        """
+        presences = self.join_presences
+        self.join_presences = collections.OrderedDict()
+        treeview_model = self.list_treeview.get_model()
+        self.list_treeview.set_model(None)
+        sort_column_id, sort_order = self.model.get_sort_column_id()
+        self.model.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+            Gtk.SortType.ASCENDING)
+        self.bulk_joining = True
+        try:
+            for obj in presences.values():
+                role = obj.role or 'visitor'
+                affiliation = obj.affiliation or 'none'
+                if not self.get_contact_iter(obj.nick):
+                    self.add_contact_to_roster(obj.nick, obj.show, role,
+                        affiliation, obj.status, obj.real_jid)
+                gc_c = gajim.contacts.get_gc_contact(self.account,
+                    self.room_jid, obj.nick)
+                if not gc_c:
+                    continue
+                gc_c.show = obj.show
+                gc_c.status = obj.status
+                gc_c.role = role
+                gc_c.affiliation = affiliation
+                self.avatar_presences[obj.nick] = obj
+        finally:
+            self.bulk_joining = False
+            self.model.set_sort_column_id(sort_column_id, sort_order)
+            self.list_treeview.set_model(treeview_model)
+        self.draw_all_roles()
+        if treeview_model:
+            self.list_treeview.expand_all()
+        if self.avatar_queue and not self.avatar_queue_id:
+            self.avatar_queue_id = GLib.timeout_add(AVATAR_QUEUE_INTERVAL,
+                self.process_avatar_queue)
+
+    def process_avatar_queue(self):
+        """
+        Load and ask the avatars of some occupants of avatar_queue
+        """
+        for i in range(AVATAR_QUEUE_BATCH):
+            if not self.avatar_queue:
+                self.avatar_queue_id = None
+                return False
+            nick, jid = self.avatar_queue.popleft()
+            obj = self.avatar_presences.pop(nick, None)
+            if not self.get_contact_iter(nick):
+                # occupant left
+                continue
+            if obj:
+                self.check_avatar_sha(obj, gajim.contacts.get_gc_contact(
+                    self.account, self.room_jid, nick))
+            self.draw_avatar(nick)
+            self.ask_avatar(nick, jid)
+        return True
+
+    def stop_avatar_queue(self):
+        self.avatar_queue.clear()
+        self.avatar_presences.clear()
+        if self.avatar_queue_id:
+            GLib.source_remove(self.avatar_queue_id)
+            self.avatar_queue_id = None
 
     def get_role_iter(self, role):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            role_name = self.model[role_iter][Column.NICK]
-            if role == role_name:
-                return role_iter
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        return self.role_iters.get(role)
 
-    def remove_contact(self, nick):
+    def remove_contact_row(self, nick):
         """
-        Remove a user from the contacts_list
+        Remove the row of a user from the contacts_list, and the row of its role
+        if it was the last user with it
         """
         iter_ = self.get_contact_iter(nick)
         if not iter_:
+            return False
+        del self.nick_rows[nick]
+        parent_iter = self.model.iter_parent(iter_)
+        self.model.remove(iter_)
+        if self.model.iter_n_children(parent_iter) == 0:
+            del self.role_iters[self.model[parent_iter][Column.NICK]]
+            self.model.remove(parent_iter)
+        return True
+
+    def remove_contact(self, nick):
+        """
+        Remove a user from the contacts_list
+        """
+        if not self.get_contact_iter(nick):
             return
         gc_contact = gajim.contacts.get_gc_contact(self.account, self.room_jid,
                 nick)
         if gc_contact:
             gajim.contacts.remove_gc_contact(self.account, gc_contact)
-        parent_iter = self.model.iter_parent(iter_)
-        self.model.remove(iter_)
-        if self.model.iter_n_children(parent_iter) == 0:
-            self.model.remove(parent_iter)
+        self.remove_contact_row(nick)
 
     def send_message(self, message, xhtml=None, process_commands=True):
         """
@@ -2057,6 +2179,7 @@ class GroupchatControl(ChatControlBase):
 
         # Preventing autorejoin from being activated
         self.autorejoin = False
+        self.stop_avatar_queue()
 
         gajim.ged.remove_event_handler('gc-presence-received', ged.GUI1,
             self._nec_gc_presence_received)
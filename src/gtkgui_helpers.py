@@ -36,6 +36,8 @@ from gi.repository import GLib
 from gi.repository import Pango
 import os
 import sys
+import hashlib
+import collections
 try:
     from PIL import Image
 except:
@@ -627,21 +629,108 @@ def get_scaled_pixbuf(pixbuf, kind):
 
     return get_scaled_pixbuf_by_size(pixbuf, width, height)
 
-def get_avatar_pixbuf_from_cache(fjid, use_local=True):
+class AvatarCache:
     """
-    Check if jid has cached avatar and if that avatar is valid image (can be
-    shown)
+    Avatars returned by get_avatar_pixbuf_from_cache
 
-    Returns None if there is no image in vcard/
-    Returns 'ask' if cached vcard should not be used (user changed his vcard, so
-    we have new sha) or if we don't have the vcard
+    What the avatar of a jid is gets remembered until its vCard or local avatar
+    changes, or until a connection gets another SHA for it in a presence. The
+    decoded images are kept by SHA and size, the least recently used ones are
+    dropped when they take more than avatar_cache_size MiB.
+
+    The same pixbuf is given to every caller, so it must not be modified: use a
+    copy to draw on it.
     """
-    jid, nick = gajim.get_room_and_nick_from_fjid(fjid)
-    if gajim.config.get('hide_avatar_of_transport') and\
-            gajim.jid_is_transport(jid):
-        # don't show avatar for the transport itself
-        return None
+    def __init__(self):
+        # {jid: {(nick, use_local): (announced shas, avatar sha or None)}}
+        self.jids = {}
+        # {(avatar sha, width, height): pixbuf}, least recently used first
+        self.pixbufs = collections.OrderedDict()
+        self.size = 0
+        self.counters = {'hits': 0, 'misses': 0, 'decoded': 0, 'scaled': 0,
+            'evicted': 0}
+
+    @staticmethod
+    def get_announced_shas(jid, fjid):
+        """
+        The SHAs of the avatars of jid and fjid known by the connections, the
+        cached avatar is out of date if they change
+        """
+        return tuple((conn.vcard_shas.get(jid), conn.vcard_shas.get(fjid)) \
+            for conn in gajim.connections.values())
+
+    def get_avatar(self, jid, nick, use_local, announced_shas):
+        """
+        Return the SHA of the avatar of jid, None if it has none, or False if
+        it is not known
+        """
+        entry = self.jids.get(jid, {}).get((nick, use_local))
+        if entry and entry[0] == announced_shas:
+            self.counters['hits'] += 1
+            return entry[1]
+        self.counters['misses'] += 1
+        return False
 
+    def set_avatar(self, jid, nick, use_local, announced_shas, sha):
+        self.jids.setdefault(jid, {})[(nick, use_local)] = (announced_shas, sha)
+
+    def get_pixbuf(self, sha, width=0, height=0):
+        key = (sha, width, height)
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            self.pixbufs.move_to_end(key)
+        return pixbuf
+
+    def add_pixbuf(self, sha, pixbuf, width=0, height=0):
+        key = (sha, width, height)
+        if key in self.pixbufs:
+            self.size -= self._get_pixbuf_size(self.pixbufs.pop(key))
+        self.pixbufs[key] = pixbuf
+        self.size += self._get_pixbuf_size(pixbuf)
+        max_size = gajim.config.get('avatar_cache_size') * 1024 * 1024
+        while self.size > max_size and len(self.pixbufs) > 1:
+            pixbuf = self.pixbufs.popitem(last=False)[1]
+            self.size -= self._get_pixbuf_size(pixbuf)
+            self.counters['evicted'] += 1
+
+    @staticmethod
+    def _get_pixbuf_size(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    def invalidate(self, jid, nick=None):
+        """
+        Forget the avatar of jid, or only the one of the occupant nick if jid
+        is a room
+        """
+        if nick is None:
+            self.jids.pop(jid, None)
+            return
+        entries = self.jids.get(jid, {})
+        for use_local in (True, False):
+            entries.pop((nick, use_local), None)
+
+    def clear(self):
+        self.jids.clear()
+        self.pixbufs.clear()
+        self.size = 0
+
+    def get_stats(self):
+        stats = dict(self.counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] * 100.0 / lookups if lookups else 0
+        stats['images'] = len(self.pixbufs)
+        stats['size'] = self.size / 1024
+        return stats
+
+avatar_cache = AvatarCache()
+
+def _load_avatar_pixbuf(fjid, jid, nick, use_local):
+    """
+    Read the avatar of fjid from disk
+
+    Return 'ask' or None like get_avatar_pixbuf_from_cache, or a (sha,
+    pixbuf) tuple
+    """
     if any(jid in gajim.contacts.get_gc_list(acc) for acc in \
     gajim.contacts.get_accounts()):
         is_groupchat_contact = True
@@ -651,11 +740,9 @@ def get_avatar_pixbuf_from_cache(fjid, use_local=True):
     puny_jid = helpers.sanitize_filename(jid)
     if is_groupchat_contact:
         puny_nick = helpers.sanitize_filename(nick)
-        path = os.path.join(gajim.VCARD_PATH, puny_jid, puny_nick)
         local_avatar_basepath = os.path.join(gajim.AVATAR_PATH, puny_jid,
                 puny_nick) + '_local'
     else:
-        path = os.path.join(gajim.VCARD_PATH, puny_jid)
         local_avatar_basepath = os.path.join(gajim.AVATAR_PATH, puny_jid) + \
                 '_local'
     if use_local:
@@ -665,19 +752,77 @@ def get_avatar_pixbuf_from_cache(fjid, use_local=True):
                 avatar_file = open(local_avatar_path, 'rb')
                 avatar_data = avatar_file.read()
                 avatar_file.close()
-                return get_pixbuf_from_data(avatar_data)
-
-    if not os.path.isfile(path):
-        return 'ask'
+                pixbuf = get_pixbuf_from_data(avatar_data)
+                if pixbuf is None:
+                    return None
+                return 'local:' + hashlib.sha1(avatar_data).hexdigest(), pixbuf
 
     vcard_dict = list(gajim.connections.values())[0].get_cached_vcard(fjid,
             is_groupchat_contact)
-    if not vcard_dict: # This can happen if cached vcard is too old
+    if not vcard_dict: # We don't have it or the cached vcard is too old
         return 'ask'
     if 'PHOTO' not in vcard_dict:
         return None
     pixbuf = vcard.get_avatar_pixbuf_encoded_mime(vcard_dict['PHOTO'])[0]
-    return pixbuf
+    if pixbuf is None:
+        return None
+    sha = vcard_dict['PHOTO'].get('SHA')
+    if not sha:
+        sha = hashlib.sha1(vcard_dict['PHOTO']['BINVAL'].encode('utf-8')).\
+            hexdigest()
+    return sha, pixbuf
+
+def get_avatar_pixbuf_from_cache(fjid, use_local=True, kind=None):
+    """
+    Check if jid has cached avatar and if that avatar is valid image (can be
+    shown)
+
+    Returns None if there is no image in vcard/
+    Returns 'ask' if cached vcard should not be used (user changed his vcard, so
+    we have new sha) or if we don't have the vcard
+    If kind is given, the avatar is scaled like get_scaled_pixbuf does, and
+    None is returned if avatars of this kind are not shown
+    The returned pixbuf is shared with the other callers and must not be
+    modified
+    """
+    jid, nick = gajim.get_room_and_nick_from_fjid(fjid)
+    if gajim.config.get('hide_avatar_of_transport') and\
+            gajim.jid_is_transport(jid):
+        # don't show avatar for the transport itself
+        return None
+
+    announced_shas = avatar_cache.get_announced_shas(jid, fjid)
+    sha = avatar_cache.get_avatar(jid, nick, use_local, announced_shas)
+    pixbuf = None
+    if sha:
+        pixbuf = avatar_cache.get_pixbuf(sha)
+    if sha is False or (sha and pixbuf is None):
+        avatar = _load_avatar_pixbuf(fjid, jid, nick, use_local)
+        if avatar == 'ask':
+            # not remembered, we get a vcard-received event when it comes
+            return avatar
+        if avatar is None:
+            sha = None
+        else:
+            sha, pixbuf = avatar
+            avatar_cache.add_pixbuf(sha, pixbuf)
+            avatar_cache.counters['decoded'] += 1
+        avatar_cache.set_avatar(jid, nick, use_local, announced_shas, sha)
+    if sha is None:
+        return None
+    if not kind:
+        return pixbuf
+
+    width = gajim.config.get(kind + '_avatar_width')
+    height = gajim.config.get(kind + '_avatar_height')
+    if width < 1 or height < 1:
+        return None
+    scaled = avatar_cache.get_pixbuf(sha, width, height)
+    if scaled is None:
+        scaled = get_scaled_pixbuf_by_size(pixbuf, width, height)
+        avatar_cache.add_pixbuf(sha, scaled, width, height)
+        avatar_cache.counters['scaled'] += 1
+    return scaled
 
 def make_gtk_month_python_month(month):
     """
@@ -82,6 +82,8 @@ from common import socks5
 from common import helpers
 from common import passwords
 from common import logging_helpers
+from common import special_text
+from common import image_fetcher
 from common.connection_handlers_events import OurShowEvent, \
     FileRequestErrorEvent, FileTransferCompletedEvent
 from common.connection import Connection
@@ -560,6 +562,10 @@ class Interface:
     def handle_event_vcard(self, obj):
         # ('VCARD', account, data)
         '''vcard holds the vcard data'''
+        if obj.jid in obj.conn.room_jids:
+            gtkgui_helpers.avatar_cache.invalidate(obj.jid, obj.resource)
+        else:
+            gtkgui_helpers.avatar_cache.invalidate(obj.jid)
         our_jid = gajim.get_jid_from_account(obj.conn.name)
         if obj.jid == our_jid:
             if obj.nickname:
@@ -1179,11 +1185,7 @@ class Interface:
                 time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
         if obj.conn.archiving_313_supported and gajim.config.get_per('accounts',
         account, 'sync_logs_with_server'):
-            mam_id = gajim.config.get_per('accounts', account, 'last_mam_id')
-            if mam_id:
-                obj.conn.request_archive(after=mam_id)
-            else:
-                obj.conn.request_archive(start='2013-02-24T03:51:42Z')
+            obj.conn.request_archive_catchup()
 
         invisible_show = gajim.SHOW_LIST.index('invisible')
         # We cannot join rooms if we are invisible
@@ -1630,7 +1632,7 @@ class Interface:
                 self.handle_event_subscribed_presence],
             'unsubscribed-presence-received': [
                 self.handle_event_unsubscribed_presence],
-            'vcard-received': [self.handle_event_vcard],
+            'vcard-received': [(self.handle_event_vcard, ged.PREGUI)],
             'zeroconf-name-conflict': [self.handle_event_zc_name_conflict],
         }
 
@@ -1878,96 +1880,30 @@ class Interface:
         return self._invalid_XML_chars_re
 
     def make_regexps(self):
-        # regexp meta characters are:  . ^ $ * + ? { } [ ] \ | ( )
-        # one escapes the metachars with \
-        # \S matches anything but ' ' '\t' '\n' '\r' '\f' and '\v'
-        # \s matches any whitespace character
-        # \w any alphanumeric character
-        # \W any non-alphanumeric character
-        # \b means word boundary. This is a zero-width assertion that
-        #    matches only at the beginning or end of a word.
-        # ^ matches at the beginning of lines
-        #
-        # * means 0 or more times
-        # + means 1 or more times
-        # ? means 0 or 1 time
-        # | means or
-        # [^*] anything but '*' (inside [] you don't have to escape metachars)
-        # [^\s*] anything but whitespaces and '*'
-        # (?<!\S) is a one char lookbehind assertion and asks for any leading
-        #         whitespace
-        # and mathces beginning of lines so we have correct formatting detection
-        # even if the the text is just '*foo*'
-        # (?!\S) is the same thing but it's a lookahead assertion
-        # \S*[^\s\W] --> in the matching string don't match ? or ) etc.. if at
-        #                the end
-        # so http://be) will match http://be and http://be)be) will match
-        # http://be)be
-
-        legacy_prefixes = r"((?<=\()(www|ftp)\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$"\
-            r"&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+(?=\)))"\
-            r"|((www|ftp)\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]"\
-            r"|%[A-Fa-f0-9]{2})+"\
-            r"\.([A-Za-z0-9\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+)"
-        # NOTE: it's ok to catch www.gr such stuff exist!
-
-        # FIXME: recognize xmpp: and treat it specially
-        links = r"((?<=\()[A-Za-z][A-Za-z0-9\+\.\-]*:"\
-            r"([\w\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]|%[A-Fa-f0-9]{2})+"\
-            r"(?=\)))|(\w[\w\+\.\-]*:([^<>\s]|%[A-Fa-f0-9]{2})+)"
-
-        # 2nd one: at_least_one_char@at_least_one_char.at_least_one_char
-        mail = r'\bmailto:\S*[^\s\W]|' r'\b\S+@\S+\.\S*[^\s\W]'
-
-        # detects eg. *b* *bold* *bold bold* test *bold* *bold*! (*bold*)
-        # doesn't detect (it's a feature :P) * bold* *bold * * bold * test*bold*
-        formatting = r'|(?<!\w)' r'\*[^\s*]' r'([^*]*[^\s*])?' r'\*(?!\w)|'\
-            r'(?<!\S)' r'/[^\s/]' r'([^/]*[^\s/])?' r'/(?!\S)|'\
-            r'(?<!\w)' r'_[^\s_]' r'([^_]*[^\s_])?' r'_(?!\w)'
-
-        basic_pattern = links + '|' + mail + '|' + legacy_prefixes
-
-        link_pattern = basic_pattern
-        self.link_pattern_re = re.compile(link_pattern, re.I | re.U)
-
-        if gajim.config.get('ascii_formatting'):
-            basic_pattern += formatting
-        self.basic_pattern = basic_pattern
+        self._basic_pattern_re = None
+        self._emot_and_basic_re = None
 
-        emoticons_pattern = ''
+        self.link_pattern_re = re.compile(special_text.LINK_PATTERN,
+            re.I | re.U)
+
+        ascii_formatting = gajim.config.get('ascii_formatting')
+        self.basic_pattern = special_text.get_basic_pattern(ascii_formatting)
+
+        emoticons = ()
         if gajim.config.get('emoticons_theme'):
-            # When an emoticon is bordered by an alpha-numeric character it is
-            # NOT expanded.  e.g., foo:) NO, foo :) YES, (brb) NO, (:)) YES, etc
-            # We still allow multiple emoticons side-by-side like :P:P:P
-            # sort keys by length so :qwe emot is checked before :q
-            keys = sorted(self.emoticons, key=len, reverse=True)
-            emoticons_pattern_prematch = ''
-            emoticons_pattern_postmatch = ''
-            emoticon_length = 0
-            for emoticon in keys: # travel thru emoticons list
-                emoticon_escaped = re.escape(emoticon) # espace regexp metachars
-                # | means or in regexp
-                emoticons_pattern += emoticon_escaped + '|'
-                if (emoticon_length != len(emoticon)):
-                    # Build up expressions to match emoticons next to others
-                    emoticons_pattern_prematch  = \
-                        emoticons_pattern_prematch[:-1]  + ')|(?<='
-                    emoticons_pattern_postmatch = \
-                        emoticons_pattern_postmatch[:-1] + ')|(?='
-                    emoticon_length = len(emoticon)
-                emoticons_pattern_prematch += emoticon_escaped  + '|'
-                emoticons_pattern_postmatch += emoticon_escaped + '|'
-            # We match from our list of emoticons, but they must either have
-            # whitespace, or another emoticon next to it to match successfully
-            # [\w.] alphanumeric and dot (for not matching 8) in (2.8))
-            emoticons_pattern = '|' + r'(?:(?<![\w.]' + \
-                emoticons_pattern_prematch[:-1] + '))' + '(?:' + \
-                emoticons_pattern[:-1] + ')' + r'(?:(?![\w]' + \
-                emoticons_pattern_postmatch[:-1] + '))'
+            emoticons = self.emoticons
+        # finds the special text in one pass, the emoticons with a trie
+        self.special_text_tokenizer = special_text.SpecialTextTokenizer(
+            emoticons, ascii_formatting)
+
+        emoticons_pattern = ''
+        if self.special_text_tokenizer.emoticons_pattern:
+            emoticons_pattern = '|' + \
+                self.special_text_tokenizer.emoticons_pattern
 
         # because emoticons match later (in the string) they need to be after
         # basic matches that may occur earlier
-        self.emot_and_basic = basic_pattern + emoticons_pattern
+        self.emot_and_basic = self.basic_pattern + emoticons_pattern
 
         # needed for xhtml display
         self.emot_only = emoticons_pattern
@@ -2534,6 +2470,9 @@ class Interface:
         notifications. An avatar can be given as a pixmap directly or as an
         decoded image
         """
+        if not puny_nick:
+            # the avatars of occupants are forgotten when their vCard comes
+            gtkgui_helpers.avatar_cache.invalidate(jid)
         puny_jid = helpers.sanitize_filename(jid)
         path_to_file = os.path.join(gajim.AVATAR_PATH, puny_jid)
         if puny_nick:
@@ -2593,6 +2532,8 @@ class Interface:
         """
         Remove avatar files of a jid
         """
+        if not puny_nick:
+            gtkgui_helpers.avatar_cache.invalidate(jid)
         puny_jid = helpers.sanitize_filename(jid)
         path_to_file = os.path.join(gajim.AVATAR_PATH, puny_jid)
         if puny_nick:
@@ -2820,6 +2761,7 @@ class Interface:
         self.emot_and_basic = None
         self.sth_at_sth_dot_sth = None
         self.emot_only = None
+        self.special_text_tokenizer = None
         self.emoticons = []
         self.emoticons_animations = {}
         self.emoticons_images = {}
@@ -2906,6 +2848,8 @@ class Interface:
             self.handle_event_file_rcv_completed,
             self.handle_event_file_progress,
             self.handle_event_file_error)
+        gajim.image_fetcher = image_fetcher.ImageFetcher(
+            gajim.IMAGE_CACHE_PATH)
         gajim.proxy65_manager = proxy65_manager.Proxy65Manager(gajim.idlequeue)
         gajim.default_session_type = ChatControlSession
 
@@ -74,6 +74,7 @@ del config_path
 from common import gajim
 import gtkgui_helpers
 from common.logger import LOG_DB_PATH, JIDConstant, KindConstant
+from common.logger import has_fts_index, build_fts_query, JidCache
 from common import helpers
 import dialogs
 
@@ -117,11 +118,13 @@ class HistoryManager:
         self.welcome_vbox = xml.get_object('welcome_vbox')
 
         self.jids_already_in = []  # holds jids that we already have in DB
+        self.jid_cache = JidCache()
         self.AT_LEAST_ONE_DELETION_DONE = False
 
         self.con = sqlite.connect(LOG_DB_PATH, timeout=20.0,
                 isolation_level='IMMEDIATE')
         self.cur = self.con.cursor()
+        self.fts_available = has_fts_index(self.cur)
 
         self._init_jids_listview()
         self._init_logs_listview()
@@ -294,10 +297,23 @@ class HistoryManager:
             jid_is_from_pm = self._jid_is_from_pm(jid)
             if not jid_is_from_pm:  # it's normal jid with resource
                 jid = jid.split('/', 1)[0]  # remove the resource
-        self.cur.execute('SELECT jid_id FROM jids WHERE jid = ?', (jid,))
-        jid_id = self.cur.fetchone()[0]
+        jid_id = self._get_cached_jid(jid)[0]
         return str(jid_id)
 
+    def _get_cached_jid(self, jid):
+        """
+        Return (jid_id, type) of jid, or None if jid is not in DB
+        """
+        cached = self.jid_cache.get(jid)
+        if cached is not None:
+            return cached
+        self.cur.execute('SELECT jid_id, type FROM jids WHERE jid = ?', (jid,))
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        self.jid_cache.set(jid, row[0], row[1])
+        return row
+
     def _get_jid_from_jid_id(self, jid_id):
         """
         jids table has jid and jid_id
@@ -319,10 +335,8 @@ class HistoryManager:
         """
         possible_room_jid = jid.split('/', 1)[0]
 
-        self.cur.execute('SELECT jid_id FROM jids WHERE jid = ? AND type = ?',
-                (possible_room_jid, JIDConstant.ROOM_TYPE))
-        row = self.cur.fetchone()
-        if row is None:
+        row = self._get_cached_jid(possible_room_jid)
+        if row is None or row[1] != JIDConstant.ROOM_TYPE:
             return False
         else:
             return True
@@ -331,11 +345,10 @@ class HistoryManager:
         """
         Return True/False if given id is room type or not eg. if it is room
         """
-        self.cur.execute('SELECT type FROM jids WHERE jid = ?', (jid,))
-        row = self.cur.fetchone()
+        row = self._get_cached_jid(jid)
         if row is None:
             raise
-        elif row[0] == JIDConstant.ROOM_TYPE:
+        elif row[1] == JIDConstant.ROOM_TYPE:
             return True
         else:  # normal type
             return False
@@ -408,15 +421,34 @@ class HistoryManager:
         Ask db and fill listview with results that match text
         """
         self.search_results_liststore.clear()
-        like_sql = '%' + text + '%'
-        self.cur.execute('''
-                SELECT log_line_id, jid_id, time, message, subject, contact_name
-                FROM logs
-                WHERE message LIKE ? OR subject LIKE ?
-                ORDER BY time
-                ''', (like_sql, like_sql))
+        results = None
+        if self.fts_available:
+            fts_query = build_fts_query(text)
+            if not fts_query:
+                return
+            try:
+                self.cur.execute('''
+                        SELECT log_line_id, jid_id, time, logs.message,
+                        logs.subject, contact_name
+                        FROM logs_fts
+                        JOIN logs ON logs.log_line_id = logs_fts.rowid
+                        WHERE logs_fts MATCH ?
+                        ORDER BY logs_fts.rank
+                        ''', (fts_query,))
+                results = self.cur.fetchall()
+            except sqlite.OperationalError:
+                pass
+        if results is None:
+            like_sql = '%' + text + '%'
+            self.cur.execute('''
+                    SELECT log_line_id, jid_id, time, message, subject,
+                    contact_name
+                    FROM logs
+                    WHERE message LIKE ? OR subject LIKE ?
+                    ORDER BY time
+                    ''', (like_sql, like_sql))
+            results = self.cur.fetchall()
 
-        results = self.cur.fetchall()
         for row in results:
             # exposed in UI (TreeViewColumns) are only
             # JID, time, message, subject, nickname
@@ -566,6 +598,7 @@ class HistoryManager:
                                 DELETE FROM jids
                                 WHERE jid_id = ?
                                 ''', (jid_id,))
+                self.jid_cache.remove_jid_id(int(jid_id))
 
             self.con.commit()
 
@@ -116,6 +116,10 @@ class HistoryWindow:
         self.completion_dict = {}
         self.accounts_seen_online = [] # Update dict when new accounts connect
         self.jids_to_search = []
+        self._shown_date = None # (jid, year, month, day) asked to the logger
+        self._loaded_date = None # (jid, year, month, day) in the textview
+        self._scroll_to_time = None # scroll there once lines are loaded
+        self._search = None # (text, year, month, day) asked to the logger
 
         # This will load history too
         task = self._fill_completion_dict()
@@ -359,14 +363,23 @@ class HistoryWindow:
         widget.clear_marks()
         month = gtkgui_helpers.make_gtk_month_python_month(month)
         days_in_this_month = calendar.monthrange(year, month)[1]
-        try:
-            log_days = gajim.logger.get_days_with_logs(self.jid, year, month,
-                days_in_this_month, self.account)
-        except exceptions.PysqliteOperationalError as e:
-            dialogs.ErrorDialog(_('Disk Error'), str(e))
-            return
-        for day in log_days:
-            widget.mark_day(day)
+        jid = self.jid
+
+        def on_days_with_logs(log_days):
+            # user may have moved to another month or contact in the meantime
+            if self.jid != jid or widget.get_date()[:2] != (year,
+            gtkgui_helpers.make_python_month_gtk_month(month)):
+                return
+            for day in log_days:
+                widget.mark_day(day)
+
+        def on_error(e):
+            if isinstance(e, exceptions.PysqliteOperationalError):
+                dialogs.ErrorDialog(_('Disk Error'), str(e))
+
+        gajim.logger.run_async(gajim.logger.get_days_with_logs, jid, year,
+            month, days_in_this_month, self.account,
+            callback=on_days_with_logs, error_callback=on_error)
 
     def _get_string_show_from_constant_int(self, show):
         if show == ShowConstant.ONLINE:
@@ -390,9 +403,17 @@ class HistoryWindow:
         """
         self.history_buffer.set_text('') # clear the buffer first
         self.last_time_printout = 0
+        date = (self.jid, year, month, day)
+        self._shown_date = date
+        gajim.logger.run_async(gajim.logger.get_conversation_for_date,
+            self.jid, year, month, day, self.account,
+            callback=lambda lines: self._on_conversation_for_date(lines, date))
+
+    def _on_conversation_for_date(self, lines, date):
+        if date != self._shown_date:
+            # another day has been selected since we asked for this one
+            return
         show_status = self.show_status_checkbutton.get_active()
-
-        lines = gajim.logger.get_conversation_for_date(self.jid, year, month, day, self.account)
         # lines holds list with tupples that have:
         # contact_name, time, kind, show, message
         for line in lines:
@@ -404,6 +425,10 @@ class HistoryWindow:
                 continue
             self._add_new_line(line[0], line[1], line[2], line[3], line[4],
                     line[5], line[6])
+        self._loaded_date = date
+        if self._scroll_to_time is not None:
+            self._scroll_to_result(self._scroll_to_time)
+            self._scroll_to_time = None
 
     def _add_new_line(self, contact_name, tim, kind, show, message, subject, additional_data):
         """
@@ -520,12 +545,24 @@ class HistoryWindow:
         text = self.search_entry.get_text()
         model = self.results_treeview.get_model()
         model.clear()
+        self._search = None
         if text == '':
             self.results_window.set_property('visible', False)
             return
         else:
             self.results_window.set_property('visible', True)
 
+        year, month, day = False, False, False
+        if self.search_in_date.get_active():
+            year, month, day = self.calendar.get_date() # integers
+            month = gtkgui_helpers.make_gtk_month_python_month(month)
+        search = (text, year, month, day)
+        self._search = search
+
+        def on_error(e):
+            if isinstance(e, exceptions.PysqliteOperationalError):
+                dialogs.ErrorDialog(_('Disk Error'), str(e))
+
         # perform search in preselected jids
         # jids are preselected with the query_entry
         for jid in self.jids_to_search:
@@ -537,38 +574,41 @@ class HistoryWindow:
                 # This may leed to wrong self nick in the displayed history (Uggh!)
                 account = list(gajim.contacts.get_accounts())[0]
 
-            year, month, day = False, False, False
-            if self.search_in_date.get_active():
-                year, month, day = self.calendar.get_date() # integers
-                month = gtkgui_helpers.make_gtk_month_python_month(month)
-
-            show_status = self.show_status_checkbutton.get_active()
-
             # contact_name, time, kind, show, message, subject
-            results = gajim.logger.get_search_results_for_query(
-                                    jid, text, account, year, month, day)
-            #FIXME:
-            # add "subject:  | message: " in message column if kind is single
-            # also do we need show at all? (we do not search on subject)
-            for row in results:
-                if not show_status and row[2] in (KindConstant.GCSTATUS,
-                KindConstant.STATUS):
-                    continue
-                contact_name = row[0]
-                if not contact_name:
-                    kind = row[2]
-                    if kind == KindConstant.CHAT_MSG_SENT: # it's us! :)
-                        contact_name = gajim.nicks[account]
-                    else:
-                        contact_name = self.completion_dict[jid][InfoColumn.NAME]
-                tim = row[1]
-                message = row[4]
-                local_time = time.localtime(tim)
-                date = time.strftime('%Y-%m-%d', local_time)
-
-                #  jid (to which log is assigned to), name, date, message,
-                # time (full unix time)
-                model.append((jid, contact_name, date, message, str(tim)))
+            gajim.logger.run_async(gajim.logger.get_search_results_for_query,
+                jid, text, account, year, month, day,
+                callback=lambda results, jid=jid, account=account:
+                self._on_search_results(results, search, jid, account),
+                error_callback=on_error)
+
+    def _on_search_results(self, results, search, jid, account):
+        if search is not self._search:
+            # another search has been started since we asked for this one
+            return
+        model = self.results_treeview.get_model()
+        show_status = self.show_status_checkbutton.get_active()
+        #FIXME:
+        # add "subject:  | message: " in message column if kind is single
+        # also do we need show at all? (we do not search on subject)
+        for row in results:
+            if not show_status and row[2] in (KindConstant.GCSTATUS,
+            KindConstant.STATUS):
+                continue
+            contact_name = row[0]
+            if not contact_name:
+                kind = row[2]
+                if kind == KindConstant.CHAT_MSG_SENT: # it's us! :)
+                    contact_name = gajim.nicks[account]
+                else:
+                    contact_name = self.completion_dict[jid][InfoColumn.NAME]
+            tim = row[1]
+            message = row[4]
+            local_time = time.localtime(tim)
+            date = time.strftime('%Y-%m-%d', local_time)
+
+            #  jid (to which log is assigned to), name, date, message,
+            # time (full unix time)
+            model.append((jid, contact_name, date, message, str(tim)))
 
     def on_results_treeview_row_activated(self, widget, path, column):
         """
@@ -597,7 +637,11 @@ class HistoryWindow:
 
         self.calendar.select_day(day)
         unix_time = model[path][Column.TIME]
-        self._scroll_to_result(unix_time)
+        if self._loaded_date == self._shown_date:
+            self._scroll_to_result(unix_time)
+        else:
+            # lines of that day are still being read from the database
+            self._scroll_to_time = unix_time
         #FIXME: one day do not search just for unix_time but the whole and user
         # specific format of the textbuffer line [time] nick: message
         # and highlight all that
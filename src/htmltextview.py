@@ -522,7 +522,7 @@ class HtmlHandler(xml.sax.handler.ContentHandler):
         return tag
 
     def _update_img(self, output, attrs, img_mark, tags):
-        '''Callback function called after the function helpers.download_image.
+        '''Callback function called once gajim.image_fetcher got the image.
         '''
         mem, alt = output
         self._process_img(attrs, (mem, alt, img_mark, tags))
@@ -549,9 +549,9 @@ class HtmlHandler(xml.sax.handler.ContentHandler):
             else:
                 if self.conv_textview:
                     img_mark = self.textbuf.create_mark(None, self.iter, True)
-                    gajim.thread_interface(helpers.download_image, [
-                        self.conv_textview.account, attrs], self._update_img,
-                        [attrs, img_mark, self._get_style_tags()])
+                    gajim.image_fetcher.fetch(self.conv_textview.account,
+                        attrs, self._update_img, attrs, img_mark,
+                        self._get_style_tags())
                     alt = attrs.get('alt', '')
                     if alt:
                         alt += '\n'
@@ -751,6 +751,26 @@ class SignalObject(dbus.service.Object):
             return DBUS_BOOLEAN(False)
         return DBUS_BOOLEAN(True)
 
+    @dbus.service.method(INTERFACE, in_signature='s', out_signature='a(ssud)')
+    def events_profiling(self, action):
+        """
+        Control the profiling of event handlers and return the collected
+        statistics. action can be 'start', 'stop', 'reset' or empty
+        """
+        if action == 'start':
+            gajim.ged.enable_profiling(True)
+        elif action == 'stop':
+            gajim.ged.enable_profiling(False)
+        elif action == 'reset':
+            gajim.ged.reset_profiling_stats()
+        result = dbus.Array([], signature='(ssud)')
+        for event_name, handler, calls, total in \
+        gajim.ged.get_profiling_stats():
+            result.append(dbus.Struct((DBUS_STRING(event_name),
+                DBUS_STRING(handler), dbus.UInt32(calls), DBUS_DOUBLE(total)),
+                signature='ssud'))
+        return result
+
     @dbus.service.method(INTERFACE, in_signature='s', out_signature='b')
     def prefs_del(self, key):
         if not key:
@@ -81,6 +81,7 @@ class Column(IntEnum):
     LOCATION_PIXBUF = 8
     AVATAR_PIXBUF = 9  # avatar_pixbuf
     PADLOCK_PIXBUF = 10  # use for account row only
+    SORT_KEY = 11  # the model is sorted on it, see _get_sort_key
 
 empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
@@ -248,7 +249,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 gajim.interface.jabber_state_images['16'][show],
                 _('Merged accounts'), 'account', '', 'all', None, None, None,
-                None, None, None] + [None] * self.nb_ext_renderers)
+                None, None, None, self._get_sort_key('account', 'all')] + \
+                [None] * self.nb_ext_renderers)
             self._iters['MERGED']['account'] = it
         else:
             show = gajim.SHOW_LIST[gajim.connections[account].connected]
@@ -264,7 +266,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 gajim.interface.jabber_state_images['16'][show],
                 GLib.markup_escape_text(account), 'account', our_jid,
-                account, None, None, None, None, None, tls_pixbuf] +
+                account, None, None, None, None, None, tls_pixbuf,
+                self._get_sort_key('account', account)] +
                 [None] * self.nb_ext_renderers)
             self._iters[account]['account'] = it
 
@@ -324,7 +327,9 @@ class RosterWindow:
         iter_group = self.model.append(iter_parent,
             [gajim.interface.jabber_state_images['16']['closed'],
             GLib.markup_escape_text(group), 'group', group, account, None,
-            None, None, None, None, None] + [None] * self.nb_ext_renderers)
+            None, None, None, None, None,
+            self._get_sort_key('group', account, group)] + \
+            [None] * self.nb_ext_renderers)
         self.draw_group(group, account)
         self._iters[account_group]['groups'][group] = iter_group
         return iter_group
@@ -361,7 +366,8 @@ class RosterWindow:
             for child_iter in parent_iters:
                 it = self.model.append(child_iter, [None,
                     contact.get_shown_name(), 'contact', contact.jid, account,
-                    None, None, None, None, None, None] + \
+                    None, None, None, None, None, None,
+                    self._get_sort_key('contact', account, contact.jid)] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(it)
                 if contact.jid in self._iters[account]['contacts']:
@@ -390,7 +396,8 @@ class RosterWindow:
                 # for more
                 i_ = self.model.append(child_iterG, [None,
                     contact.get_shown_name(), typestr, contact.jid, account,
-                    None, None, None, None, None, None] + \
+                    None, None, None, None, None, None,
+                    self._get_sort_key(typestr, account, contact.jid)] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(i_)
                 if contact.jid in self._iters[account]['contacts']:
@@ -650,7 +657,9 @@ class RosterWindow:
         child_iterA = self._get_account_iter(account, self.model)
         self._iters[account]['contacts'][jid] = [self.model.append(child_iterA,
             [None, gajim.nicks[account], 'self_contact', jid, account, None,
-            None, None, None, None, None] + [None] * self.nb_ext_renderers)]
+            None, None, None, None, None,
+            self._get_sort_key('self_contact', account, jid)] + \
+            [None] * self.nb_ext_renderers)]
 
         self.draw_completely(jid, account)
         self.draw_account(account)
@@ -1176,6 +1185,13 @@ class RosterWindow:
         if not child_iters:
             return False
 
+        # Move the rows if needed, before they are drawn
+        sort_key = self._get_sort_key(self.model[child_iters[0]][Column.TYPE],
+            account, jid, contact_instances)
+        for child_iter in child_iters:
+            if self.model[child_iter][Column.SORT_KEY] != sort_key:
+                self.model[child_iter][Column.SORT_KEY] = sort_key
+
         name = GLib.markup_escape_text(contact.get_shown_name())
 
         # gets number of unread gc marked messages
@@ -1359,13 +1375,11 @@ class RosterWindow:
         if not iters or not gajim.config.get('show_avatars_in_roster'):
             return
         jid = self.model[iters[0]][Column.JID]
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid)
+        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid, kind='roster')
         if pixbuf in (None, 'ask'):
-            scaled_pixbuf = empty_pixbuf
-        else:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'roster')
+            pixbuf = empty_pixbuf
         for child_iter in iters:
-            self.model[child_iter][Column.AVATAR_PIXBUF] = scaled_pixbuf
+            self.model[child_iter][Column.AVATAR_PIXBUF] = pixbuf
         return False
 
     def draw_completely(self, jid, account):
@@ -1448,7 +1462,7 @@ class RosterWindow:
                 self.draw_group(group, account)
             self.draw_account(account)
 
-        self.model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
         self.tree.set_model(self.modelfilter)
         self.tree.thaw_child_notify()
         self.starting_filtering = False
@@ -1461,8 +1475,7 @@ class RosterWindow:
         self.modelfilter = None
         self.model = Gtk.TreeStore(*self.columns)
 
-        self.model.set_sort_func(1, self._compareIters)
-        self.model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
         self.modelfilter = self.model.filter_new()
         self.modelfilter.set_visible_func(self._visible_func)
         self.modelfilter.connect('row-has-child-toggled',
@@ -1721,114 +1734,41 @@ class RosterWindow:
             return self.rfilter_string in model[titer][Column.NAME].lower()
         return True
 
-    def _compareIters(self, model, iter1, iter2, data=None):
-        """
-        Compare two iters to sort them
-        """
-        name1 = model[iter1][Column.NAME]
-        name2 = model[iter2][Column.NAME]
-        if not name1 or not name2:
-            return 0
-        name1 = name1
-        name2 = name2
-        type1 = model[iter1][Column.TYPE]
-        type2 = model[iter2][Column.TYPE]
-        if type1 == 'self_contact':
-            return -1
-        if type2 == 'self_contact':
-            return 1
-        if type1 == 'group':
-            name1 = model[iter1][Column.JID]
-            if name1:
-                name1 = name1
-            name2 = model[iter2][Column.JID]
-            if name2:
-                name2 = name2
-            if name1 == _('Transports'):
-                return 1
-            if name2 == _('Transports'):
-                return -1
-            if name1 == _('Not in Roster'):
-                return 1
-            if name2 == _('Not in Roster'):
-                return -1
-            if name1 == _('Groupchats'):
-                return 1
-            if name2 == _('Groupchats'):
-                return -1
-        account1 = model[iter1][Column.ACCOUNT]
-        account2 = model[iter2][Column.ACCOUNT]
-        if not account1 or not account2:
-            return 0
-        account1 = account1
-        account2 = account2
-        if type1 == 'account':
-            return locale.strcoll(account1, account2)
-        jid1 = model[iter1][Column.JID]
-        jid2 = model[iter2][Column.JID]
-        if type1 == 'contact':
-            lcontact1 = gajim.contacts.get_contacts(account1, jid1)
-            contact1 = gajim.contacts.get_first_contact_from_jid(account1, jid1)
-            if not contact1:
-                return 0
-            name1 = contact1.get_shown_name()
-        if type2 == 'contact':
-            lcontact2 = gajim.contacts.get_contacts(account2, jid2)
-            contact2 = gajim.contacts.get_first_contact_from_jid(account2, jid2)
-            if not contact2:
-                return 0
-            name2 = contact2.get_shown_name()
-        # We first compare by show if sort_by_show_in_roster is True or if it's
-        # a child contact
-        if type1 == 'contact' and type2 == 'contact' and \
-        gajim.config.get('sort_by_show_in_roster'):
+    def _get_sort_key(self, type_, account, jid=None, contact_instances=None):
+        """
+        Return the sort key of a row, so the model sorts its rows with the
+        default comparison of strings
+
+        The self contact goes first. Then accounts are sorted by name, groups
+        by name with the special groups last, and contacts by name, account
+        and jid, after their show if sort_by_show_in_roster is True. Must be
+        called again when one of those changes, draw_contact does it.
+        """
+        if type_ == 'self_contact':
+            return helpers.get_sort_key(0)
+        if type_ == 'account':
+            return helpers.get_sort_key(1, account)
+        if type_ == 'group':
+            special_groups = {_('Groupchats'): 1, _('Not in Roster'): 2,
+                _('Transports'): 3}
+            return helpers.get_sort_key(1, special_groups.get(jid, 0),
+                jid.lower())
+        if not contact_instances:
+            contact_instances = gajim.contacts.get_contacts(account, jid)
+        if not contact_instances:
+            return helpers.get_sort_key(1)
+        contact = contact_instances[0]
+        parts = [1]
+        if type_ == 'contact' and gajim.config.get('sort_by_show_in_roster'):
             cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
                 'invisible': 5, 'offline': 6, 'not in roster': 7, 'error': 8}
-            s = self.get_show(lcontact1)
-            show1 = cshow.get(s, 9)
-            s = self.get_show(lcontact2)
-            show2 = cshow.get(s, 9)
-            removing1 = False
-            removing2 = False
-            if show1 == 6 and jid1 in gajim.to_be_removed[account1]:
-                removing1 = True
-            if show2 == 6 and jid2 in gajim.to_be_removed[account2]:
-                removing2 = True
-            if removing1 and not removing2:
-                return 1
-            if removing2 and not removing1:
-                return -1
-            sub1 = contact1.sub
-            sub2 = contact2.sub
+            show = cshow.get(self.get_show(contact_instances), 9)
+            removing = show == 6 and jid in gajim.to_be_removed[account]
             # none and from goes after
-            if sub1 not in ['none', 'from'] and sub2 in ['none', 'from']:
-                return -1
-            if sub1 in ['none', 'from'] and sub2 not in ['none', 'from']:
-                return 1
-            if show1 < show2:
-                return -1
-            elif show1 > show2:
-                return 1
-        # We compare names
-        cmp_result = locale.strcoll(name1.lower(), name2.lower())
-        if cmp_result < 0:
-            return -1
-        if cmp_result > 0:
-            return 1
-        if type1 == 'contact' and type2 == 'contact':
-            # We compare account names
-            cmp_result = locale.strcoll(account1.lower(), account2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-            # We compare jids
-            cmp_result = locale.strcoll(jid1.lower(), jid2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-        return 0
+            parts += [removing, contact.sub in ('none', 'from'), show]
+        parts += [contact.get_shown_name().lower(), account.lower(),
+            jid.lower()]
+        return helpers.get_sort_key(*parts)
 
 ################################################################################
 ### FIXME: Methods that don't belong to roster window...
@@ -1925,7 +1865,7 @@ class RosterWindow:
                         jid_with_resource = contact1.jid
                         if contact1.resource:
                             jid_with_resource += '/' + contact1.resource
-                        gajim.connections[account].request_vcard(
+                        gajim.connections[account].queue_vcard_request(
                             jid_with_resource)
                     else:
                         host = gajim.get_server_from_jid(contact1.jid)
@@ -2463,6 +2403,7 @@ class RosterWindow:
         for account in gajim.connections:
             gajim.connections[account].quit(True)
             self.close_all(account)
+        gajim.logger.flush_pending_writes()
         if gajim.interface.systray_enabled:
             gajim.interface.hide_systray()
         self.save_done = True
@@ -2592,7 +2533,7 @@ class RosterWindow:
                 # transport just signed in.
                 # request avatars
                 for jid_ in gajim.transport_avatar[account][jid]:
-                    obj.conn.request_vcard(jid_)
+                    obj.conn.queue_vcard_request(jid_)
 
         if obj.contact:
             self.chg_contact_status(obj.contact, obj.show, obj.status, account)
@@ -5770,10 +5711,10 @@ class RosterWindow:
         self.save_done = False
         # [icon, name, type, jid, account, editable, mood_pixbuf,
         # activity_pixbuf, tune_pixbuf, location_pixbuf, avatar_pixbuf,
-        # padlock_pixbuf]
+        # padlock_pixbuf, sort_key]
         self.columns = [Gtk.Image, str, str, str, str,
             GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf,
-            GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf]
+            GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, str]
         self.xml = gtkgui_helpers.get_gtk_builder('roster_window.ui')
         self.window = self.xml.get_object('roster_window')
         app.add_window(self.window)
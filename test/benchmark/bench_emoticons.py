@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''
+Measure how long finding the special text of messages takes
+
+The spans found by the regular expression of the basic pattern followed by
+every emoticon, which detect_and_print_special_text used, are compared with
+the ones of SpecialTextTokenizer on short chat lines, emoticon floods and
+long pasted texts. The emoticons of all the themes shipped with Gajim are used
+so the theme is a big one.
+
+Run from the test directory: python3 -m benchmark.bench_emoticons [messages]
+'''
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+from common.special_text import get_basic_pattern, SpecialTextTokenizer
+
+NB_MESSAGES = 2000
+EMOTICONS_DIR = os.path.join(lib.gajim_root, 'data', 'emoticons')
+WORDS = ('hello', 'world', 'the', 'meeting', 'is', 'at', '8', 'tomorrow',
+    'see', 'you', '(later)', 'ok.', 'foo:bar', '2.8)', '*really*', 'fine,')
+LINKS = ('http://www.gajim.org/', 'www.example.org/path?a=1', 'me@example.org',
+    'xmpp:gajim@conference.gajim.org?join')
+
+def get_old_emoticons_pattern(emoticons):
+    '''
+    The emoticons pattern make_regexps built before SpecialTextTokenizer: one
+    alternative per emoticon, and per emoticon length around it
+    '''
+    keys = sorted(emoticons, key=len, reverse=True)
+    emoticons_pattern = ''
+    emoticons_pattern_prematch = ''
+    emoticons_pattern_postmatch = ''
+    emoticon_length = 0
+    for emoticon in keys:
+        emoticon_escaped = re.escape(emoticon)
+        emoticons_pattern += emoticon_escaped + '|'
+        if (emoticon_length != len(emoticon)):
+            emoticons_pattern_prematch  = \
+                emoticons_pattern_prematch[:-1]  + ')|(?<='
+            emoticons_pattern_postmatch = \
+                emoticons_pattern_postmatch[:-1] + ')|(?='
+            emoticon_length = len(emoticon)
+        emoticons_pattern_prematch += emoticon_escaped  + '|'
+        emoticons_pattern_postmatch += emoticon_escaped + '|'
+    return '|' + r'(?:(?<![\w.]' + emoticons_pattern_prematch[:-1] + '))' + \
+        '(?:' + emoticons_pattern[:-1] + ')' + r'(?:(?![\w]' + \
+        emoticons_pattern_postmatch[:-1] + '))'
+
+def get_emoticons():
+    '''
+    The emoticons of all the themes, in upper case like Interface.emoticons
+    '''
+    emoticons = set()
+    for theme in os.listdir(EMOTICONS_DIR):
+        path = os.path.join(EMOTICONS_DIR, theme, 'emoticons.py')
+        if not os.path.isfile(path):
+            continue
+        namespace = {}
+        with open(path, encoding='utf-8') as f:
+            exec(f.read(), namespace)
+        for emots in namespace['emoticons'].values():
+            emoticons.update(emot.upper() for emot in emots)
+    return sorted(emoticons)
+
+def get_messages(emoticons, nb):
+    random.seed(42)
+    chat, flood, pasted = [], [], []
+    for i in range(nb):
+        words = [random.choice(WORDS) for j in range(random.randint(3, 15))]
+        words.append(random.choice(emoticons))
+        if i % 5 == 0:
+            words.append(random.choice(LINKS))
+        random.shuffle(words)
+        chat.append(' '.join(words))
+        flood.append(''.join(random.choice(emoticons) for j in range(120)))
+    for i in range(max(1, nb // 50)):
+        pasted.append('\n'.join(random.choice(chat) for j in range(400)))
+    return (('chat lines', chat), ('emoticon floods', flood),
+        ('pasted texts', pasted))
+
+def find_with_regex(regex, messages):
+    count = 0
+    for message in messages:
+        for match in regex.finditer(message):
+            count += 1
+    return count
+
+def find_with_tokenizer(tokenizer, messages):
+    count = 0
+    for message in messages:
+        for span in tokenizer.tokenize(message):
+            count += 1
+    return count
+
+def main():
+    nb = NB_MESSAGES
+    if len(sys.argv) > 1:
+        nb = int(sys.argv[1])
+    emoticons = get_emoticons()
+    print('%d emoticons' % len(emoticons))
+
+    start = time.perf_counter()
+    regex = re.compile(get_basic_pattern(True) + \
+        get_old_emoticons_pattern(emoticons), re.IGNORECASE + re.UNICODE)
+    print('%-16s build: %8.2f ms' % ('regex',
+        (time.perf_counter() - start) * 1000))
+    start = time.perf_counter()
+    tokenizer = SpecialTextTokenizer(emoticons, True)
+    print('%-16s build: %8.2f ms' % ('tokenizer',
+        (time.perf_counter() - start) * 1000))
+
+    for name, messages in get_messages(emoticons, nb):
+        start = time.perf_counter()
+        found_regex = find_with_regex(regex, messages)
+        regex_time = time.perf_counter() - start
+        start = time.perf_counter()
+        found_tokenizer = find_with_tokenizer(tokenizer, messages)
+        tokenizer_time = time.perf_counter() - start
+        assert found_regex == found_tokenizer
+        print('%-16s %5d messages, %6d specials: regex %8.2f ms, '
+            'tokenizer %8.2f ms' % (name, len(messages), found_regex,
+            regex_time * 1000, tokenizer_time * 1000))
+
+if __name__ == '__main__':
+    main()
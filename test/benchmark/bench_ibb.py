@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+'''
+Measure the throughput of an In-Band Bytestream file transfer
+
+Both sides of the transfer run in this process and exchange their stanzas
+through a loopback stand-in for the XMPP server, which delivers each stanza
+after a fixed one-way latency. The transfer time is counted on that simulated
+clock, the CPU time is the real time spent building and parsing the stanzas.
+
+Run from the test directory: python3 -m benchmark.bench_ibb [size in KiB]
+[round trip time in ms]
+'''
+import os
+import sys
+import time
+import heapq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+import nbxmpp
+
+from common import gajim
+from common.file_props import FilesProp
+from common.protocol.bytestream import ConnectionIBBytestream
+
+from mock import Mock
+
+SIZE = 4 * 1024 * 1024
+RTT = 0.05
+ROUNDS = 3
+
+SENDER_JID = 'sender@localhost/bench'
+RECEIVER_JID = 'receiver@localhost/bench'
+
+class LoopbackServer:
+    '''
+    Deliver the stanzas sent by one side to the other one after latency
+    seconds
+    '''
+    def __init__(self, latency):
+        self.latency = latency
+        self.now = 0.0
+        self.queue = []
+        self.nb_stanzas = 0
+        self.next_id = 0
+
+    def send(self, peer, stanza):
+        if not stanza.getID():
+            self.next_id += 1
+            stanza.setID('bench%d' % self.next_id)
+        self.nb_stanzas += 1
+        heapq.heappush(self.queue, (self.now + self.latency, self.nb_stanzas,
+            peer, stanza))
+        return stanza.getID()
+
+    def run(self):
+        while self.queue:
+            self.now, _, peer, stanza = heapq.heappop(self.queue)
+            peer.deliver(stanza)
+
+class Stream:
+    '''
+    The client stream of one side, what handlers get as conn argument
+    '''
+    def __init__(self, server):
+        self.server = server
+        self.peer = None
+        self.errors = []
+
+    def send(self, stanza):
+        return self.server.send(self.peer, stanza)
+
+    def Event(self, *args):
+        self.errors.append(args)
+
+class Account(ConnectionIBBytestream):
+    def __init__(self, name, server):
+        ConnectionIBBytestream.__init__(self)
+        self.name = name
+        self.connection = Stream(server)
+
+    def deliver(self, stanza):
+        '''
+        Route the stanza to the handlers like the dispatcher of nbxmpp does
+        '''
+        try:
+            if stanza.getName() != 'iq':
+                return
+            if stanza.getType() == 'set' and (stanza.getTag('open') or \
+            stanza.getTag('close')):
+                self.IBBIqHandler(self.connection, stanza)
+            else:
+                self.IBBAllIqHandler(self.connection, stanza)
+        except nbxmpp.NodeProcessed:
+            pass
+
+def get_file_props(account, sid, filename, size, type_):
+    file_props = FilesProp.getNewFileProp(account, sid)
+    file_props.transport_sid = 'bench_ibb'
+    file_props.type_ = type_
+    file_props.file_name = filename
+    file_props.size = size
+    file_props.elapsed_time = 0
+    file_props.stalled = False
+    return file_props
+
+def transfer(src, dst, size, block_size, window_size, rtt):
+    gajim.config.set('ft_ibb_window_size', window_size)
+    server = LoopbackServer(rtt / 2)
+    sender = Account('sender', server)
+    receiver = Account('receiver', server)
+    sender.connection.peer = receiver
+    receiver.connection.peer = sender
+    sent_props = get_file_props('sender', 'bench_ibb_s', src, size, 's')
+    received_props = get_file_props('receiver', 'bench_ibb_r', dst, size, 'r')
+
+    start_cpu = time.process_time()
+    with open(src, 'rb') as fp:
+        sender.OpenStream('bench_ibb_s', RECEIVER_JID, fp, block_size)
+        server.run()
+    cpu_time = time.process_time() - start_cpu
+
+    errors = sender.connection.errors + receiver.connection.errors
+    FilesProp.deleteFileProp(sent_props)
+    FilesProp.deleteFileProp(received_props)
+    sender.cleanup()
+    receiver.cleanup()
+    if errors or not received_props.completed:
+        raise Exception('transfer failed: %s' % errors)
+    return server.now, cpu_time, server.nb_stanzas
+
+def main():
+    size = SIZE
+    rtt = RTT
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1]) * 1024
+    if len(sys.argv) > 2:
+        rtt = float(sys.argv[2]) / 1000
+    gajim.socks5queue = Mock()
+    src = os.path.join(lib.configdir, 'bench_ibb_src')
+    dst = os.path.join(lib.configdir, 'bench_ibb_dst')
+    with open(src, 'wb') as f:
+        f.write(os.urandom(size))
+    modes = (
+        ('4096 bytes blocks, 1 in flight', 4096, 1),
+        ('4096 bytes blocks, 8 in flight', 4096, 8),
+        ('16384 bytes blocks, 1 in flight', 16384, 1),
+        ('16384 bytes blocks, 8 in flight', 16384, 8))
+    try:
+        for name, block_size, window_size in modes:
+            timings = []
+            for i in range(ROUNDS):
+                timings.append(transfer(src, dst, size, block_size,
+                    window_size, rtt))
+                with open(src, 'rb') as f1, open(dst, 'rb') as f2:
+                    if f1.read() != f2.read():
+                        raise Exception('%s: received file differs' % name)
+            duration, cpu_time, nb_stanzas = min(timings)
+            kib = size / 1024
+            print('%s: %.1f KiB/s with a %d ms round trip, %d stanzas, '
+                '%.2f ms of CPU per KiB' % (name, kib / duration, rtt * 1000,
+                nb_stanzas, cpu_time * 1000 / kib))
+    finally:
+        for filename in (src, dst):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''
+Measure how long the occupant list of a group chat takes to handle the
+presences received when joining a big room
+
+The presences are replayed on the occupant list of a GroupchatControl the way
+_nec_gc_presence_received handles them: a flood of available presences from
+new occupants, then a status change of each of them, then some of them
+leave. The old lookups, which walk the whole model, are measured against the
+nick and role indexes, with the occupants added one by one or all at once
+when our own presence comes.
+
+Run from the test directory: python3 -m benchmark.bench_muc_join [occupants]
+'''
+import os
+import sys
+import time
+import types
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+from gi.repository import Gtk
+from gi.repository import GdkPixbuf
+
+from common import gajim
+from common import contacts as contacts_module
+from groupchat_control import GroupchatControl, Column
+
+from gajim_mocks import MockInterface, MockConnection
+
+NB_OCCUPANTS = 5000
+ACCOUNT = 'bench'
+ROOM_JID = 'room@conference.example.org'
+SHOWS = ('online', 'away', 'chat', 'xa', 'dnd')
+
+def scan_contact_iter(self, nick):
+    '''
+    get_contact_iter before the nick index
+    '''
+    role_iter = self.model.get_iter_first()
+    while role_iter:
+        user_iter = self.model.iter_children(role_iter)
+        while user_iter:
+            if nick == self.model[user_iter][Column.NICK]:
+                return user_iter
+            else:
+                user_iter = self.model.iter_next(user_iter)
+        role_iter = self.model.iter_next(role_iter)
+    return None
+
+def scan_role_iter(self, role):
+    '''
+    get_role_iter before the role index
+    '''
+    role_iter = self.model.get_iter_first()
+    while role_iter:
+        role_name = self.model[role_iter][Column.NICK]
+        if role == role_name:
+            return role_iter
+        role_iter = self.model.iter_next(role_iter)
+    return None
+
+def get_control(scan):
+    '''
+    A GroupchatControl with only what the occupant list needs
+    '''
+    ctrl = GroupchatControl.__new__(GroupchatControl)
+    ctrl.account = ACCOUNT
+    ctrl.room_jid = ROOM_JID
+    ctrl.nick = 'me'
+    ctrl.is_anonymous = True
+    ctrl.is_continued = False
+    ctrl.nb_ext_renderers = 0
+    ctrl.columns = [Gtk.Image, str, str, str, GdkPixbuf.Pixbuf, str]
+    ctrl.model = Gtk.TreeStore(*ctrl.columns)
+    ctrl.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+    ctrl.nick_rows = {}
+    ctrl.role_iters = {}
+    ctrl.join_presences = collections.OrderedDict()
+    ctrl.bulk_joining = False
+    ctrl.avatar_queue = collections.deque()
+    ctrl.avatar_presences = {}
+    ctrl.avatar_queue_id = None
+    ctrl.list_treeview = Gtk.TreeView()
+    if scan:
+        ctrl.get_contact_iter = types.MethodType(scan_contact_iter, ctrl)
+        ctrl.get_role_iter = types.MethodType(scan_role_iter, ctrl)
+    return ctrl
+
+def get_role(i):
+    if i % 100 == 0:
+        return 'moderator'
+    if i % 10 == 0:
+        return 'visitor'
+    return 'participant'
+
+def replay_join(ctrl, nb_occupants, bulk):
+    nicks = ['occupant%d' % i for i in range(nb_occupants)]
+    timings = []
+
+    start = time.perf_counter()
+    for i, nick in enumerate(nicks):
+        if bulk:
+            ctrl.join_presences[nick] = types.SimpleNamespace(nick=nick,
+                show=SHOWS[i % len(SHOWS)], role=get_role(i),
+                affiliation='none', status='', real_jid='')
+        elif not ctrl.get_contact_iter(nick):
+            ctrl.add_contact_to_roster(nick, SHOWS[i % len(SHOWS)],
+                get_role(i), 'none', '', '')
+            ctrl.draw_all_roles()
+    if bulk:
+        ctrl.add_join_presences()
+        ctrl.stop_avatar_queue()
+    timings.append(('join', time.perf_counter() - start))
+
+    # our own presence
+    ctrl.list_treeview.set_model(ctrl.model)
+    ctrl.list_treeview.expand_all()
+
+    start = time.perf_counter()
+    for i, nick in enumerate(nicks):
+        if ctrl.get_contact_iter(nick):
+            gc_c = gajim.contacts.get_gc_contact(ACCOUNT, ROOM_JID, nick)
+            gc_c.show = SHOWS[(i + 1) % len(SHOWS)]
+            ctrl.draw_contact(nick)
+    timings.append(('status changes', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for nick in nicks[::10]:
+        ctrl.remove_contact(nick)
+        ctrl.draw_all_roles()
+    timings.append(('leaves', time.perf_counter() - start))
+
+    if len(ctrl.nick_rows) != nb_occupants - len(nicks[::10]):
+        raise Exception('nick index out of sync')
+    return timings
+
+def main():
+    nb_occupants = NB_OCCUPANTS
+    if len(sys.argv) > 1:
+        nb_occupants = int(sys.argv[1])
+    gajim.interface = MockInterface()
+    gajim.contacts = contacts_module.LegacyContactsAPI()
+    gajim.connections = {}
+    conn = MockConnection(ACCOUNT)
+    conn.blocked_all = False
+    gajim.config.set('ask_avatars_on_startup', False)
+    gajim.config.set('show_avatars_in_roster', False)
+    modes = (
+        ('linear scan', True, False),
+        ('nick and role indexes', False, False),
+        ('nick and role indexes, bulk join', False, True))
+    for name, scan, bulk in modes:
+        gajim.contacts.remove_room(ACCOUNT, ROOM_JID)
+        timings = replay_join(get_control(scan), nb_occupants, bulk)
+        print('%s, %d occupants: %s' % (name, nb_occupants, ', '.join(
+            '%s %.2f s' % timing for timing in timings)))
+
+if __name__ == '__main__':
+    main()
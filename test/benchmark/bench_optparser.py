@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''
+Measure how long OptionsParser.read takes on a synthetic 50k lines config
+
+Run from the test directory: python3 -m benchmark.bench_optparser
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from common import defs
+from common import config
+from common import optparser
+from common import caps_cache
+
+from mock import Mock
+
+NB_LINES = 50000
+ROUNDS = 5
+
+def write_config(filename, nb_lines):
+    '''
+    Write a config file with nb_lines lines, mostly contacts and rooms options
+    like in a long-lived profile
+    '''
+    lines = ['version = %s\n' % defs.version.split('-', 1)[0]]
+    i = 0
+    while len(lines) < nb_lines:
+        jid = 'contact%d@example.org' % i
+        lines.append('contacts.%s.gpg_enabled = False\n' % jid)
+        lines.append('contacts.%s.speller_language = \n' % jid)
+        room = 'room%d@conference.example.org' % i
+        lines.append('rooms.%s.speller_language = \n' % room)
+        lines.append('rooms.%s.muc_restore_lines = -2\n' % room)
+        i += 1
+    with open(filename, 'w') as f:
+        f.writelines(lines[:nb_lines])
+
+def main():
+    filename = os.path.join(lib.configdir, 'bench_config')
+    write_config(filename, NB_LINES)
+    gajim.logger = Mock()
+    caps_cache.capscache = Mock()
+
+    timings = []
+    for i in range(ROUNDS):
+        gajim.config = config.Config()
+        parser = optparser.OptionsParser(filename)
+        start = time.perf_counter()
+        parser.read()
+        timings.append(time.perf_counter() - start)
+    print('OptionsParser.read on %d lines: best %.1f ms, mean %.1f ms' % (
+        NB_LINES, min(timings) * 1000, sum(timings) / ROUNDS * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+'''
+Measure how long the roster model takes to be filled and sorted
+
+A model shaped like the one of RosterWindow (account, groups, contacts) is
+filled with sorting disabled, then sorted, the way _before_fill and
+_after_fill do it, and then a part of the contacts change their show. The
+sort function the roster used before, which is called for each comparison, is
+measured against the sort key column sorted by GTK itself.
+
+Run from the test directory: python3 -m benchmark.bench_roster_fill [contacts]
+'''
+import os
+import sys
+import time
+import locale
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+from gi.repository import Gtk
+from gi.repository import GdkPixbuf
+
+from common import gajim
+from common import contacts as contacts_module
+from roster_window import RosterWindow, Column
+
+NB_CONTACTS = 5000
+NB_GROUPS = 30
+ACCOUNT = 'bench'
+SHOWS = ('online', 'away', 'chat', 'xa', 'dnd', 'offline', 'offline')
+SUBS = ('both', 'both', 'to', 'from', 'none')
+
+def compare_iters(model, iter1, iter2, roster):
+    '''
+    RosterWindow._compareIters before the sort key column
+    '''
+    name1 = model[iter1][Column.NAME]
+    name2 = model[iter2][Column.NAME]
+    if not name1 or not name2:
+        return 0
+    type1 = model[iter1][Column.TYPE]
+    type2 = model[iter2][Column.TYPE]
+    if type1 == 'self_contact':
+        return -1
+    if type2 == 'self_contact':
+        return 1
+    if type1 == 'group':
+        name1 = model[iter1][Column.JID]
+        name2 = model[iter2][Column.JID]
+        if name1 == _('Transports'):
+            return 1
+        if name2 == _('Transports'):
+            return -1
+        if name1 == _('Not in Roster'):
+            return 1
+        if name2 == _('Not in Roster'):
+            return -1
+        if name1 == _('Groupchats'):
+            return 1
+        if name2 == _('Groupchats'):
+            return -1
+    account1 = model[iter1][Column.ACCOUNT]
+    account2 = model[iter2][Column.ACCOUNT]
+    if not account1 or not account2:
+        return 0
+    if type1 == 'account':
+        return locale.strcoll(account1, account2)
+    jid1 = model[iter1][Column.JID]
+    jid2 = model[iter2][Column.JID]
+    if type1 == 'contact':
+        lcontact1 = gajim.contacts.get_contacts(account1, jid1)
+        contact1 = gajim.contacts.get_first_contact_from_jid(account1, jid1)
+        if not contact1:
+            return 0
+        name1 = contact1.get_shown_name()
+    if type2 == 'contact':
+        lcontact2 = gajim.contacts.get_contacts(account2, jid2)
+        contact2 = gajim.contacts.get_first_contact_from_jid(account2, jid2)
+        if not contact2:
+            return 0
+        name2 = contact2.get_shown_name()
+    if type1 == 'contact' and type2 == 'contact' and \
+    gajim.config.get('sort_by_show_in_roster'):
+        cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
+            'invisible': 5, 'offline': 6, 'not in roster': 7, 'error': 8}
+        show1 = cshow.get(roster.get_show(lcontact1), 9)
+        show2 = cshow.get(roster.get_show(lcontact2), 9)
+        removing1 = show1 == 6 and jid1 in gajim.to_be_removed[account1]
+        removing2 = show2 == 6 and jid2 in gajim.to_be_removed[account2]
+        if removing1 and not removing2:
+            return 1
+        if removing2 and not removing1:
+            return -1
+        sub1 = contact1.sub
+        sub2 = contact2.sub
+        if sub1 not in ['none', 'from'] and sub2 in ['none', 'from']:
+            return -1
+        if sub1 in ['none', 'from'] and sub2 not in ['none', 'from']:
+            return 1
+        if show1 < show2:
+            return -1
+        elif show1 > show2:
+            return 1
+    cmp_result = locale.strcoll(name1.lower(), name2.lower())
+    if cmp_result:
+        return cmp_result
+    if type1 == 'contact' and type2 == 'contact':
+        cmp_result = locale.strcoll(account1.lower(), account2.lower())
+        if cmp_result:
+            return cmp_result
+        return locale.strcoll(jid1.lower(), jid2.lower())
+    return 0
+
+def add_contacts(nb_contacts):
+    gajim.contacts = contacts_module.LegacyContactsAPI()
+    gajim.contacts.add_account(ACCOUNT)
+    gajim.to_be_removed = {ACCOUNT: []}
+    groups = ['Group %d' % i for i in range(NB_GROUPS)] + [_('Transports')]
+    jids = []
+    for i in range(nb_contacts):
+        jid = 'contact%d@example.org' % i
+        contact = gajim.contacts.create_contact(jid, ACCOUNT,
+            name='Contact %d' % ((i * 7919) % nb_contacts),
+            groups=[groups[i % len(groups)]], show=SHOWS[i % len(SHOWS)],
+            sub=SUBS[i % len(SUBS)])
+        gajim.contacts.add_contact(ACCOUNT, contact)
+        jids.append(jid)
+    return groups, jids
+
+def get_roster():
+    roster = RosterWindow.__new__(RosterWindow)
+    roster.columns = [Gtk.Image, str, str, str, str, GdkPixbuf.Pixbuf,
+        GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf,
+        GdkPixbuf.Pixbuf, str]
+    roster.model = Gtk.TreeStore(*roster.columns)
+    return roster
+
+def fill(roster, groups, jids, sort_key):
+    '''
+    Return the time taken to add the rows and the time taken to sort them
+    '''
+    model = roster.model
+    if sort_key:
+        model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+    else:
+        model.set_sort_func(Column.NAME, compare_iters, roster)
+        model.set_sort_column_id(Column.NAME, Gtk.SortType.ASCENDING)
+    start = time.perf_counter()
+    # disable sorting like _before_fill
+    model.set_sort_column_id(-2, Gtk.SortType.ASCENDING)
+    key = None
+    if sort_key:
+        key = roster._get_sort_key('account', ACCOUNT)
+    account_iter = model.append(None, [None, ACCOUNT, 'account', '', ACCOUNT,
+        None, None, None, None, None, None, key])
+    group_iters = {}
+    for group in groups:
+        if sort_key:
+            key = roster._get_sort_key('group', ACCOUNT, group)
+        group_iters[group] = model.append(account_iter, [None, group, 'group',
+            group, ACCOUNT, None, None, None, None, None, None, key])
+    for jid in jids:
+        contact = gajim.contacts.get_first_contact_from_jid(ACCOUNT, jid)
+        if sort_key:
+            key = roster._get_sort_key('contact', ACCOUNT, jid)
+        model.append(group_iters[contact.groups[0]], [None,
+            contact.get_shown_name(), 'contact', jid, ACCOUNT, None, None,
+            None, None, None, None, key])
+    filled = time.perf_counter()
+    # enable sorting like _after_fill
+    if sort_key:
+        model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+    else:
+        model.set_sort_column_id(Column.NAME, Gtk.SortType.ASCENDING)
+    return filled - start, time.perf_counter() - filled
+
+def change_shows(roster, jids, sort_key):
+    '''
+    Change the show of a tenth of the contacts and draw them like
+    draw_contact, so their rows move
+    '''
+    model = roster.model
+    iters = {}
+    def find_iters(model, path, iter_, data):
+        if model[iter_][Column.TYPE] == 'contact':
+            iters[model[iter_][Column.JID]] = iter_
+    model.foreach(find_iters, None)
+    start = time.perf_counter()
+    for i, jid in enumerate(jids[::10]):
+        contact = gajim.contacts.get_first_contact_from_jid(ACCOUNT, jid)
+        contact.show = SHOWS[(SHOWS.index(contact.show) + 1) % len(SHOWS)]
+        iter_ = iters[jid]
+        if sort_key:
+            model[iter_][Column.SORT_KEY] = roster._get_sort_key('contact',
+                ACCOUNT, jid)
+        model[iter_][Column.NAME] = contact.get_shown_name()
+    return time.perf_counter() - start
+
+def get_order(model):
+    order = []
+    def add_row(model, path, iter_, data):
+        order.append(model[iter_][Column.JID])
+    model.foreach(add_row, None)
+    return order
+
+def main():
+    nb_contacts = NB_CONTACTS
+    if len(sys.argv) > 1:
+        nb_contacts = int(sys.argv[1])
+    gajim.config.set('sort_by_show_in_roster', True)
+    orders = []
+    for name, sort_key in (('sort function', False), ('sort key column',
+    True)):
+        groups, jids = add_contacts(nb_contacts)
+        roster = get_roster()
+        fill_time, sort_time = fill(roster, groups, jids, sort_key)
+        orders.append(get_order(roster.model))
+        shows_time = change_shows(roster, jids, sort_key)
+        print('%s, %d contacts: fill %.2f s, sort %.2f s, show changes %.2f s'
+            % (name, nb_contacts, fill_time, sort_time, shows_time))
+    if orders[0] != orders[1]:
+        print('the rows are not in the same order')
+
+if __name__ == '__main__':
+    main()
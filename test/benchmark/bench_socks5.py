@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''
+Measure the throughput of a SOCKS5 file transfer over the loopback interface
+
+Only the data transfer is measured, the SOCKS5 negotiation is skipped.
+
+Run from the test directory: python3 -m benchmark.bench_socks5 [size in MiB]
+'''
+import os
+import sys
+import time
+import select
+import socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lib
+lib.setup_env()
+
+from common import socks5
+from common.file_props import FilesProp
+
+from mock import Mock
+
+SIZE = 256 * 1024 * 1024
+ROUNDS = 3
+
+def write_file(filename, size):
+    chunk = os.urandom(1024 * 1024)
+    with open(filename, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(chunk[:size - written])
+            written += len(chunk)
+
+def get_connected_sockets():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server = listener.accept()[0]
+    listener.close()
+    client.setblocking(False)
+    server.setblocking(False)
+    return client, server
+
+def get_actor(sid, sock, filename, size, type_):
+    actor = socks5.Socks5(Mock(), None, None, None, None, sid)
+    actor.queue = Mock()
+    actor._sock = sock
+    actor.fd = sock.fileno()
+    actor._send = sock.send
+    actor._recv = sock.recv
+    actor.connected = True
+    actor.state = 7
+    file_props = FilesProp.getNewFileProp('bench', sid + type_)
+    file_props.type_ = type_
+    file_props.file_name = filename
+    file_props.size = size
+    file_props.elapsed_time = 0
+    file_props.last_time = time.time()
+    file_props.received_len = 0
+    file_props.stalled = False
+    actor.file_props = file_props
+    return actor
+
+def transfer(src, dst, size, use_sendfile, fixed_buffer):
+    client, server = get_connected_sockets()
+    sid = 'bench%s%s%s' % (use_sendfile, fixed_buffer, time.time())
+    sender = get_actor(sid, client, src, size, 's')
+    receiver = get_actor(sid, server, dst, size, 'r')
+    sender.use_sendfile = use_sendfile
+    if fixed_buffer:
+        # behave like before the buffer was adaptive
+        sender._adapt_buffer = receiver._adapt_buffer = lambda length: None
+
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    sending = True
+    while not receiver.file_props.completed:
+        if receiver.file_props.error:
+            raise Exception('receiver error %s' % receiver.file_props.error)
+        wlist = [client] if sending else []
+        readable, writable = select.select([server], wlist, [], 5)[:2]
+        if writable and sender.write_next() == -1:
+            sending = False
+        if readable:
+            receiver.get_file_contents(0)
+    duration = time.perf_counter() - start
+    cpu_time = time.process_time() - start_cpu
+    sender.disconnect()
+    receiver.disconnect()
+    return duration, cpu_time
+
+def main():
+    size = SIZE
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1]) * 1024 * 1024
+    src = os.path.join(lib.configdir, 'bench_socks5_src')
+    dst = os.path.join(lib.configdir, 'bench_socks5_dst')
+    write_file(src, size)
+    modes = (
+        ('64 KiB buffers', False, True),
+        ('adaptive buffers', False, False),
+        ('sendfile + adaptive buffers', True, False))
+    try:
+        for name, use_sendfile, fixed_buffer in modes:
+            if use_sendfile and not hasattr(os, 'sendfile'):
+                continue
+            timings = []
+            for i in range(ROUNDS):
+                timings.append(transfer(src, dst, size, use_sendfile,
+                    fixed_buffer))
+                if os.path.getsize(dst) != size:
+                    raise Exception('%s: received file has a wrong size' % name)
+            duration, cpu_time = min(timings)
+            mib = size / 1024 / 1024
+            print('%s: %.1f MiB/s, %.2f ms of CPU per MiB' % (name,
+                mib / duration, cpu_time * 1000 / mib))
+    finally:
+        for filename in (src, dst):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,18 @@ modules = ( 'unit.test_protocol_caps',
             'unit.test_contacts',
             'unit.test_account',
             'unit.test_gui_interface',
+            'unit.test_logger',
+            'unit.test_ged',
+            'unit.test_nec',
+            'unit.test_file_props',
+            'unit.test_vcard_requests',
+            'unit.test_avatar_cache',
+            'unit.test_mam_catchup',
+            'unit.test_special_text',
+            'unit.test_image_fetcher',
+            'unit.test_sort_key',
+            'unit.test_signature_verifier',
+            'unit.test_presence_keyid',
           )
 
 if use_x:
@@ -0,0 +1,69 @@
+'''
+Tests for the cache of decoded avatars
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from gtkgui_helpers import AvatarCache
+
+class FakePixbuf:
+    def __init__(self, size):
+        self.size = size
+
+    def get_rowstride(self):
+        return self.size
+
+    def get_height(self):
+        return 1024
+
+class TestAvatarCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = AvatarCache()
+        gajim.config.set('avatar_cache_size', 1)
+
+    def tearDown(self):
+        gajim.config.set('avatar_cache_size', 32)
+
+    def test_announced_sha_change(self):
+        self.cache.set_avatar('a@example.org', None, True, (('sha1', None),),
+            'sha1')
+        self.assertEqual(self.cache.get_avatar('a@example.org', None, True,
+            (('sha1', None),)), 'sha1')
+        self.assertIs(self.cache.get_avatar('a@example.org', None, True,
+            (('sha2', None),)), False)
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 50)
+
+    def test_invalidate(self):
+        room = 'room@conference.example.org'
+        self.cache.set_avatar(room, 'nick1', True, (), 'sha1')
+        self.cache.set_avatar(room, 'nick2', True, (), None)
+        self.cache.invalidate(room, 'nick1')
+        self.assertIs(self.cache.get_avatar(room, 'nick1', True, ()), False)
+        self.assertIsNone(self.cache.get_avatar(room, 'nick2', True, ()))
+        self.cache.invalidate(room)
+        self.assertIs(self.cache.get_avatar(room, 'nick2', True, ()), False)
+
+    def test_memory_budget(self):
+        for i in range(4):
+            self.cache.add_pixbuf('sha%d' % i, FakePixbuf(400))
+        # 400 KiB each, only two fit in 1 MiB
+        self.assertIsNone(self.cache.get_pixbuf('sha0'))
+        self.assertIsNone(self.cache.get_pixbuf('sha1'))
+        self.assertIsNotNone(self.cache.get_pixbuf('sha2'))
+        self.cache.add_pixbuf('sha2', FakePixbuf(100), 32, 32)
+        self.cache.add_pixbuf('sha4', FakePixbuf(400))
+        # sha2 was used last, sha3 goes
+        self.assertIsNone(self.cache.get_pixbuf('sha3'))
+        self.assertIsNotNone(self.cache.get_pixbuf('sha2'))
+        self.assertIsNotNone(self.cache.get_pixbuf('sha2', 32, 32))
+        self.assertEqual(self.cache.get_stats()['evicted'], 3)
+        self.assertEqual(self.cache.size, 900 * 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ import unittest
 import lib
 lib.setup_env()
 
-from common.contacts import CommonContact, Contact, GC_Contact, LegacyContactsAPI
+from common.contacts import (CommonContact, Contact, GC_Contact, Contacts,
+    LegacyContactsAPI)
 from nbxmpp import NS_MUC
 
 from common import caps_cache
@@ -124,6 +125,87 @@ class TestContacts(unittest.TestCase):
         self.assertEqual(2, len(self.contacts.get_contacts_from_group(account, group)))
         self.assertEqual(0, len(self.contacts.get_contacts_from_group(account, '')))
 
+    def test_groups_index_follows_changes(self):
+        account = "account"
+        contact = self.contacts.create_contact(jid="test1@gajim.org",
+                account=account, groups=["GroupA"])
+        self.contacts.add_contact(account, contact)
+
+        contact.groups.append("GroupB")
+        self.assertEqual([contact],
+                self.contacts.get_contacts_from_group(account, "GroupB"))
+
+        contact.groups = ["GroupC"]
+        self.assertEqual([], self.contacts.get_contacts_from_group(account,
+                "GroupA"))
+        self.assertEqual([contact],
+                self.contacts.get_contacts_from_group(account, "GroupC"))
+
+        self.contacts.remove_contact(account, contact)
+        self.assertEqual([], self.contacts.get_contacts_from_group(account,
+                "GroupC"))
+
+    def test_metacontacts_family_lookup(self):
+        account = "account"
+        self.contacts.add_account(account)
+        self.contacts.define_metacontacts(account, {'tag': [
+                {'jid': 'test1@gajim.org', 'tag': 'tag'},
+                {'jid': 'test2@gajim.org', 'tag': 'tag'}]})
+
+        family = self.contacts.get_metacontacts_family(account,
+                'test2@gajim.org')
+        self.assertEqual(['test1@gajim.org', 'test2@gajim.org'],
+                [data['jid'] for data in family])
+        self.assertTrue(self.contacts.has_brother(account, 'test1@gajim.org',
+                [account]))
+
+        self.contacts.define_metacontacts(account, {})
+        self.assertEqual([], self.contacts.get_metacontacts_family(account,
+                'test2@gajim.org'))
+
+
+class TestContactsCounters(unittest.TestCase):
+
+    def setUp(self):
+        self.contacts = Contacts()
+
+    def _add(self, jid, show, groups, resource=''):
+        contact = Contact(jid=jid, account="account", show=show, groups=groups,
+                sub='both', resource=resource)
+        self.contacts.add_contact(contact)
+        return contact
+
+    def test_online_total(self):
+        contact = self._add("test1@gajim.org", 'online', ["GroupA"])
+        self._add("test2@gajim.org", 'offline', ["GroupA", "GroupB"])
+        self._add("transport.gajim.org", 'online', [])
+
+        self.assertEqual((1, 2), self.contacts.get_nb_online_total())
+        self.assertEqual((2, 3), self.contacts.get_nb_online_total(
+                with_transports=True))
+        self.assertEqual((1, 2), self.contacts.get_nb_online_total("GroupA"))
+        self.assertEqual((0, 1), self.contacts.get_nb_online_total("GroupB"))
+
+        contact.show = 'offline'
+        self.assertEqual((0, 2), self.contacts.get_nb_online_total("GroupA"))
+
+        self.contacts.remove_jid("test2@gajim.org")
+        self.assertEqual((0, 0), self.contacts.get_nb_online_total("GroupB"))
+        self.assertEqual((0, 1), self.contacts.get_nb_online_total())
+
+    def test_first_resource_is_counted(self):
+        first = self._add("test1@gajim.org", 'online', ["GroupA"], 'home')
+        self._add("test1@gajim.org", 'away', ["GroupA"], 'work')
+        self.assertEqual((1, 1), self.contacts.get_nb_online_total("GroupA"))
+
+        self.contacts.remove_contact(first)
+        self.assertEqual((1, 1), self.contacts.get_nb_online_total("GroupA"))
+
+    def test_not_in_roster_is_not_counted(self):
+        self._add("test1@gajim.org", 'online', ["Not in roster"])
+        self.assertEqual((0, 0), self.contacts.get_nb_online_total())
+
+
 
 if __name__ == "__main__":
     unittest.main()
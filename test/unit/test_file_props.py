@@ -0,0 +1,87 @@
+'''
+Tests for the lookups of file transfers
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.file_props import FilesProp
+
+class TestFilesProp(unittest.TestCase):
+
+    def tearDown(self):
+        for fp in FilesProp.getAllFileProp():
+            FilesProp.deleteFileProp(fp)
+
+    def test_get_by_account(self):
+        fp1 = FilesProp.getNewFileProp('acc1', 'sid1')
+        fp2 = FilesProp.getNewFileProp('acc1', 'sid2')
+        fp3 = FilesProp.getNewFileProp('acc2', 'sid1')
+        self.assertEqual(FilesProp.getFilePropByAccount('acc1'), [fp1, fp2])
+        self.assertEqual(FilesProp.getFilePropByAccount('acc2'), [fp3])
+        self.assertEqual(FilesProp.getFilePropByAccount('acc3'), [])
+
+    def test_get_by_sid_and_type(self):
+        fp1 = FilesProp.getNewFileProp('acc1', 'sid1')
+        fp2 = FilesProp.getNewFileProp('acc2', 'sid1')
+        fp2.type_ = 'r'
+        self.assertIs(FilesProp.getFilePropBySid('sid1'), fp1)
+        self.assertIs(FilesProp.getFilePropByType('r', 'sid1'), fp2)
+        self.assertIsNone(FilesProp.getFilePropByType('s', 'sid1'))
+
+        FilesProp.deleteFileProp(fp1)
+        self.assertIs(FilesProp.getFilePropBySid('sid1'), fp2)
+        fp2.type_ = 's'
+        self.assertIsNone(FilesProp.getFilePropByType('r', 'sid1'))
+        self.assertIs(FilesProp.getFilePropByType('s', 'sid1'), fp2)
+
+    def test_get_by_transport_sid(self):
+        fp = FilesProp.getNewFileProp('acc1', 'sid1')
+        self.assertIsNone(FilesProp.getFilePropByTransportSid('acc1', 'ibb1'))
+        fp.transport_sid = 'ibb1'
+        self.assertIs(FilesProp.getFilePropByTransportSid('acc1', 'ibb1'), fp)
+        self.assertIsNone(FilesProp.getFilePropByTransportSid('acc2', 'ibb1'))
+
+        fp.sid = 'sid2'
+        self.assertIs(FilesProp.getFileProp('acc1', 'sid2'), fp)
+        self.assertIsNone(FilesProp.getFileProp('acc1', 'sid1'))
+        self.assertIs(FilesProp.getFilePropByTransportSid('acc1', 'ibb1'), fp)
+        self.assertIs(FilesProp.getFilePropBySid('sid2'), fp)
+        self.assertIsNone(FilesProp.getFilePropBySid('sid1'))
+
+        FilesProp.deleteFileProp(fp)
+        self.assertIsNone(FilesProp.getFilePropByTransportSid('acc1', 'ibb1'))
+        self.assertEqual(FilesProp.getAllFileProp(), [])
+
+    def test_replace(self):
+        fp1 = FilesProp.getNewFileProp('acc1', 'sid1')
+        fp1.transport_sid = 'ibb1'
+        fp2 = FilesProp.getNewFileProp('acc1', 'sid1')
+        self.assertIs(FilesProp.getFilePropBySid('sid1'), fp2)
+        self.assertIsNone(FilesProp.getFilePropByTransportSid('acc1', 'ibb1'))
+        # fp1 is not known anymore, changing it does not touch the indexes
+        fp1.transport_sid = 'ibb2'
+        self.assertIsNone(FilesProp.getFilePropByTransportSid('acc1', 'ibb2'))
+        FilesProp.deleteFileProp(fp1)
+        self.assertIs(FilesProp.getFileProp('acc1', 'sid1'), fp2)
+
+    def test_order_kept(self):
+        fp1 = FilesProp.getNewFileProp('acc1', 'sid1')
+        fp2 = FilesProp.getNewFileProp('acc2', 'sid1')
+        fp2.type_ = 's'
+        fp1.type_ = 's'
+        fp1.transport_sid = 'ibb1'
+        self.assertIs(FilesProp.getFilePropBySid('sid1'), fp1)
+        self.assertIs(FilesProp.getFilePropByType('s', 'sid1'), fp1)
+        self.assertEqual(FilesProp.getAllFileProp(), [fp1, fp2])
+
+    def test_sid_of_unknown_file_props(self):
+        fp1 = FilesProp.getNewFileProp('acc1', 'sid1')
+        FilesProp.deleteFileProp(fp1)
+        with self.assertRaises(KeyError):
+            fp1.sid = 'sid2'
+        self.assertEqual(FilesProp.getAllFileProp(), [])
+
+if __name__ == '__main__':
+    unittest.main()
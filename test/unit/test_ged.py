@@ -0,0 +1,70 @@
+'''
+Tests for the global events dispatcher
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import ged
+
+class TestGlobalEventsDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.ged = ged.GlobalEventsDispatcher()
+        self.calls = []
+
+    def _handler(self, name):
+        def handler(*args):
+            self.calls.append(name)
+        return handler
+
+    def test_handlers_called_by_priority(self):
+        first = self._handler('first')
+        second = self._handler('second')
+        third = self._handler('third')
+        self.ged.register_event_handler('ev', ged.GUI1, third)
+        self.ged.register_event_handler('ev', ged.PRECORE, first)
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('last'))
+        self.ged.register_event_handler('ev', ged.CORE, second)
+        self.ged.raise_event('ev')
+        self.assertEqual(self.calls, ['first', 'second', 'third', 'last'])
+
+    def test_remove_handler(self):
+        handler = self._handler('removed')
+        self.ged.register_event_handler('ev', ged.CORE, handler)
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('kept'))
+        self.ged.remove_event_handler('ev', ged.CORE, handler)
+        self.ged.raise_event('ev')
+        self.assertEqual(self.calls, ['kept'])
+        # unknown handlers are ignored
+        self.ged.remove_event_handler('ev', ged.CORE, handler)
+
+    def test_handler_returning_true_stops_dispatch(self):
+        self.ged.register_event_handler('ev', ged.CORE, lambda: True)
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('gui'))
+        self.assertTrue(self.ged.raise_event('ev'))
+        self.assertEqual(self.calls, [])
+
+    def test_profiling(self):
+        handler = self._handler('h')
+        self.ged.register_event_handler('ev', ged.CORE, handler)
+        self.ged.raise_event('ev')
+        self.assertEqual(self.ged.get_profiling_stats(), [])
+
+        self.ged.enable_profiling(True)
+        self.ged.raise_event('ev')
+        self.ged.raise_event('ev')
+        stats = self.ged.get_profiling_stats()
+        self.assertEqual(len(stats), 1)
+        event_name, name, calls, total = stats[0]
+        self.assertEqual(event_name, 'ev')
+        self.assertEqual(name, ged.handler_name(handler))
+        self.assertEqual(calls, 2)
+        self.assertGreaterEqual(total, 0)
+
+        self.ged.reset_profiling_stats()
+        self.assertEqual(self.ged.get_profiling_stats(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+Tests for the cache of the images of XHTML-IM messages
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from common import helpers
+from common.image_fetcher import ImageCache, ImageFetcher
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        gajim.config.set('image_cache_size', 1)
+
+    def tearDown(self):
+        gajim.config.set('image_cache_size', 50)
+        shutil.rmtree(self.path)
+
+    def test_least_recently_used_evicted(self):
+        cache = ImageCache(self.path)
+        image = b'x' * 400 * 1024
+        cache.set('http://a/1.png', image)
+        cache.set('http://a/2.png', image)
+        self.assertEqual(cache.get('http://a/1.png'), image)
+        cache.set('http://a/3.png', image)
+        self.assertIsNone(cache.get('http://a/2.png'))
+        self.assertEqual(cache.get('http://a/3.png'), image)
+        stats = cache.get_stats()
+        self.assertEqual((stats['images'], stats['evicted']), (2, 1))
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        # too big for the whole cache
+        cache.set('http://a/4.png', b'x' * 2 * 1024 * 1024)
+        self.assertIsNone(cache.get('http://a/4.png'))
+
+    def test_kept_between_runs(self):
+        ImageCache(self.path).set('http://a/1.png', b'png')
+        open(os.path.join(self.path, 'interrupted.tmp'), 'wb').close()
+        cache = ImageCache(self.path)
+        self.assertEqual(cache.get('http://a/1.png'), b'png')
+        self.assertEqual(os.listdir(self.path),
+            [ImageCache.get_name('http://a/1.png')])
+
+class TestImageFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.download_image = helpers.download_image
+        self.downloads = []
+        def download_image(account, attrs):
+            self.downloads.append(attrs['src'])
+            if attrs['src'].endswith('broken.png'):
+                return (b'', 'Broken image')
+            return (b'png', '')
+        helpers.download_image = download_image
+
+    def tearDown(self):
+        helpers.download_image = self.download_image
+        shutil.rmtree(self.path)
+
+    def test_downloaded_once(self):
+        fetcher = ImageFetcher(self.path)
+        for i in range(2):
+            for src in ('http://a/1.png', 'http://a/broken.png'):
+                fetcher._get_image('account', {'src': src})
+        self.assertEqual(fetcher._get_image('account',
+            {'src': 'http://a/1.png'}), (b'png', ''))
+        self.assertEqual(self.downloads, ['http://a/1.png',
+            'http://a/broken.png', 'http://a/broken.png'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+'''
+Tests for the in-memory helpers of the logs and cache databases
+'''
+import json
+import base64
+import sqlite3
+import unittest
+from collections import OrderedDict
+
+import lib
+lib.setup_env()
+
+from common.logger import JidCache, build_fts_query, store_vcard
+from common.logger import fts5_available, LOGS_FTS_SCHEMA
+from common.logger import VCARDS_SCHEMA, LOGS_STANZA_ID_INDEX, Logger
+
+class TestJidCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = JidCache(size=2)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a@b'))
+        self.cache.set('a@b', 1, 0)
+        self.assertEqual(self.cache.get('a@b'), (1, 0))
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a@b', 1, 0)
+        self.cache.set('c@d', 2, 1)
+        self.cache.get('a@b')
+        self.cache.set('e@f', 3, 0)
+        self.assertIsNone(self.cache.get('c@d'))
+        self.assertEqual(self.cache.get('a@b'), (1, 0))
+
+    def test_preload_keeps_last_rows(self):
+        self.cache.preload([('a@b', 1, 0), ('c@d', 2, 1), ('e@f', 3, 0)])
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('a@b'))
+
+    def test_remove_jid_id(self):
+        self.cache.set('a@b', 1, 0)
+        self.cache.remove_jid_id(1)
+        self.assertIsNone(self.cache.get('a@b'))
+
+
+class TestFtsQuery(unittest.TestCase):
+
+    def test_words_are_prefixes(self):
+        self.assertEqual(build_fts_query('hel wor'),
+            'message : ("hel"* "wor"*)')
+
+    def test_phrase(self):
+        self.assertEqual(build_fts_query('"hello world" foo*'),
+            'message : ("hello world" "foo"*)')
+
+    def test_operators_are_quoted(self):
+        self.assertEqual(build_fts_query('a OR NEAR('),
+            'message : ("a"* "OR"* "NEAR("*)')
+
+    def test_empty(self):
+        self.assertEqual(build_fts_query('  ""  '), '')
+
+    @unittest.skipUnless(fts5_available(), 'sqlite has no FTS5 support')
+    def test_subject_not_searched(self):
+        con = sqlite3.connect(':memory:')
+        con.execute('CREATE TABLE logs (log_line_id INTEGER PRIMARY KEY, '
+            'message TEXT, subject TEXT)')
+        con.executescript(LOGS_FTS_SCHEMA)
+        con.executemany('INSERT INTO logs (message, subject) VALUES (?, ?)',
+            [('hello world', 'other'), ('other', 'hello world')])
+        rows = con.execute('SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?',
+            (build_fts_query('hel wor'),)).fetchall()
+        self.assertEqual(rows, [(1,)])
+
+
+class TestVcardStore(unittest.TestCase):
+
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.cur = self.con.cursor()
+        self.cur.executescript(VCARDS_SCHEMA)
+
+    def tearDown(self):
+        self.con.close()
+
+    def get_photo_count(self):
+        self.cur.execute('SELECT COUNT(*) FROM vcard_photos')
+        return self.cur.fetchone()[0]
+
+    def test_photo_stored_once(self):
+        binval = base64.b64encode(b'image').decode('utf-8')
+        vcard = {'FN': 'Test', 'PHOTO': {'TYPE': 'image/png',
+            'BINVAL': binval}}
+        store_vcard(self.cur, 'a@example.org', '', vcard)
+        store_vcard(self.cur, 'room@conference.example.org', 'a', vcard)
+        self.assertEqual(self.get_photo_count(), 1)
+        self.cur.execute('SELECT data FROM vcards WHERE jid = ?',
+            ('a@example.org',))
+        data = json.loads(self.cur.fetchone()[0])
+        self.assertEqual(data, {'FN': 'Test', 'PHOTO': {'TYPE': 'image/png'}})
+        # the original dict is left alone
+        self.assertEqual(vcard['PHOTO']['BINVAL'], binval)
+
+    def test_unused_photo_removed(self):
+        binval = base64.b64encode(b'image').decode('utf-8')
+        store_vcard(self.cur, 'a@example.org', '', {'PHOTO': {
+            'BINVAL': binval}})
+        store_vcard(self.cur, 'a@example.org', '', {'FN': 'Test'})
+        self.assertEqual(self.get_photo_count(), 0)
+
+
+LOGS_SCHEMA = '''
+    CREATE TABLE jids(
+            jid_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            jid TEXT UNIQUE,
+            type INTEGER
+    );
+
+    CREATE TABLE unread_messages(
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            jid_id INTEGER,
+            shown BOOLEAN default 0
+    );
+
+    CREATE TABLE logs(
+            log_line_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+            jid_id INTEGER,
+            contact_name TEXT,
+            time INTEGER,
+            kind INTEGER,
+            show INTEGER,
+            message TEXT,
+            subject TEXT,
+            additional_data TEXT DEFAULT '{}',
+            stanza_id TEXT
+    );
+    '''
+
+class TestSaveMany(unittest.TestCase):
+
+    def setUp(self):
+        # a Logger on an in-memory database, used from this thread
+        self.logger = Logger.__new__(Logger)
+        self.logger.worker = None
+        self.logger.commit_timout_id = None
+        self.logger.jid_cache = JidCache()
+        self.logger.recent_stanza_ids = OrderedDict()
+        self.logger.con = sqlite3.connect(':memory:')
+        self.logger.cur = self.logger.con.cursor()
+        self.logger.cur.executescript(LOGS_SCHEMA + LOGS_STANZA_ID_INDEX)
+        self.logger.get_jids_already_in_db()
+        self.logger.get_jid_id('a@example.org')
+
+    def tearDown(self):
+        self.logger.con.close()
+
+    def save(self, msg, tim, stanza_id=None):
+        return self.logger.save_many([('a@example.org', 'to', tim, msg, None,
+            None, stanza_id)])
+
+    def test_duplicate_archive_id(self):
+        self.assertEqual(self.save('hello', 1000, 'id1'), 1)
+        self.assertEqual(self.save('hello again', 5000, 'id1'), 0)
+        # not in the recent ids anymore, found in the database
+        self.logger.recent_stanza_ids.clear()
+        self.assertEqual(self.save('hello again', 5000, 'id1'), 0)
+
+    def test_duplicate_text(self):
+        self.assertEqual(self.save('hello', 1000), 1)
+        self.assertEqual(self.save('hello', 1100, 'id1'), 0)
+        self.assertEqual(self.save('hello', 2000, 'id2'), 1)
+
+    def test_page(self):
+        rows = [('a@example.org', 'to', 1000 + i, 'msg%d' % (i % 3), None,
+            None, 'id%d' % i) for i in range(6)]
+        self.assertEqual(self.logger.save_many(rows), 3)
+        self.logger.cur.execute('SELECT COUNT(*) FROM logs')
+        self.assertEqual(self.logger.cur.fetchone()[0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Tests for the catch-up of the message archive (XEP-0313)
+'''
+import time
+import unittest
+
+import lib
+lib.setup_env()
+
+import nbxmpp
+
+from common import gajim
+from common.message_archiving import ConnectionArchive313
+from common.message_archiving import MAM_RESULTS_ARRIVED
+
+ACCOUNT = 'mam_test'
+
+class FakeConnection(ConnectionArchive313):
+    def __init__(self):
+        ConnectionArchive313.__init__(self)
+        self.name = ACCOUNT
+        self.awaiting_answers = {}
+        self.requests = []
+
+    def request_archive(self, start=None, end=None, with_=None, after=None,
+    max=None):
+        queryid = 'query%d' % len(self.requests)
+        self.requests.append((start, end, after))
+        self.awaiting_answers[queryid] = (MAM_RESULTS_ARRIVED, )
+        return queryid
+
+def get_fin(last, complete):
+    fin = nbxmpp.Node('fin', attrs={'complete': complete})
+    set_ = fin.addChild('set', namespace=nbxmpp.NS_RSM)
+    if last:
+        set_.setTagData('last', last)
+    return fin
+
+class TestMamCatchup(unittest.TestCase):
+
+    def setUp(self):
+        gajim.config.add_per('accounts', ACCOUNT)
+        gajim.config.set_per('accounts', ACCOUNT, 'last_mam_id', 'id0')
+        gajim.config.set_per('accounts', ACCOUNT, 'last_mam_time',
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() -
+            10 * 3600)))
+        gajim.config.set('mam_max_queries', 4)
+        self.conn = FakeConnection()
+
+    def tearDown(self):
+        self.conn.cleanup()
+        gajim.config.del_per('accounts', ACCOUNT)
+
+    def answer(self, queryid, last, complete='false'):
+        del self.conn.awaiting_answers[queryid]
+        self.conn._mam_page_received(self.conn.mam_running.pop(queryid),
+            get_fin(last, complete))
+
+    def test_periods(self):
+        self.conn.request_archive_catchup()
+        self.assertEqual(len(self.conn.requests), 4)
+        start, end, after = self.conn.requests[0]
+        self.assertEqual((start, after), (None, 'id0'))
+        self.assertIsNotNone(end)
+        start, end, after = self.conn.requests[3]
+        self.assertIsNotNone(start)
+        self.assertEqual((end, after), (None, None))
+
+    def test_only_last_id_known(self):
+        gajim.config.set_per('accounts', ACCOUNT, 'last_mam_time', '')
+        self.conn.request_archive_catchup()
+        self.assertEqual(self.conn.requests, [(None, None, 'id0')])
+
+    def test_sync_point(self):
+        self.conn.request_archive_catchup()
+        self.answer('query1', 'id2', 'true')
+        # the first period is not complete yet
+        self.assertEqual(gajim.config.get_per('accounts', ACCOUNT,
+            'last_mam_id'), 'id0')
+        self.answer('query0', 'id1')
+        self.assertEqual(gajim.config.get_per('accounts', ACCOUNT,
+            'last_mam_id'), 'id1')
+        # next page of the first period
+        self.assertEqual(self.conn.requests[4][2], 'id1')
+        self.answer('query4', None, 'true')
+        self.assertEqual(gajim.config.get_per('accounts', ACCOUNT,
+            'last_mam_id'), 'id2')
+        self.answer('query2', None, 'true')
+        self.answer('query3', 'id3', 'true')
+        counters = self.conn.get_mam_counters()
+        self.assertEqual((counters['complete'], counters['pages']), (4, 5))
+        self.assertEqual(gajim.config.get_per('accounts', ACCOUNT,
+            'last_mam_id'), 'id3')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+'''
+Tests for the network events controller
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from common import ged
+from common import nec
+
+class BaseEvent(nec.NetworkIncomingEvent):
+    name = 'base'
+
+class PrunableEvent(nec.NetworkIncomingEvent):
+    name = 'prunable'
+    base_network_events = ['base']
+    prunable = True
+
+class DerivedPrunableEvent(nec.NetworkIncomingEvent):
+    name = 'derived-prunable'
+    base_network_events = ['prunable']
+    prunable = True
+
+class SideEffectEvent(nec.NetworkIncomingEvent):
+    name = 'side-effect'
+    base_network_events = ['base']
+    generated = 0
+
+    def generate(self):
+        SideEffectEvent.generated += 1
+        return True
+
+class TestNetworkEventsController(unittest.TestCase):
+
+    def setUp(self):
+        self.old_ged = gajim.ged
+        gajim.ged = ged.GlobalEventsDispatcher()
+        self.nec = nec.NetworkEventsController()
+        for event_class in (PrunableEvent, DerivedPrunableEvent,
+        SideEffectEvent):
+            self.nec.register_incoming_event(event_class)
+        SideEffectEvent.generated = 0
+        self.received = []
+
+    def tearDown(self):
+        gajim.ged = self.old_ged
+
+    def _handler(self, obj):
+        self.received.append(obj.name)
+
+    def test_unused_events_are_pruned(self):
+        self.nec.push_incoming_event(BaseEvent(None))
+        # events without side effects are never created
+        self.assertEqual(self.nec.get_counters(),
+            {'created': 2, 'dispatched': 2, 'pruned': 1})
+        # others are, even if nobody listens to them
+        self.assertEqual(SideEffectEvent.generated, 1)
+
+    def test_handler_registration_updates_graph(self):
+        gajim.ged.register_event_handler('derived-prunable', ged.GUI1,
+            self._handler)
+        self.nec.push_incoming_event(BaseEvent(None))
+        self.assertEqual(self.received, ['derived-prunable'])
+        self.assertEqual(self.nec.get_counters()['pruned'], 0)
+
+        gajim.ged.remove_event_handler('derived-prunable', ged.GUI1,
+            self._handler)
+        self.nec.reset_counters()
+        self.nec.push_incoming_event(BaseEvent(None))
+        self.assertEqual(self.received, ['derived-prunable'])
+        self.assertEqual(self.nec.get_counters()['pruned'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
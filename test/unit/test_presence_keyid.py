@@ -0,0 +1,99 @@
+'''
+Tests for the keyID given to contacts from their signed presences
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from common.connection_handlers import ConnectionHandlersBase
+from common.connection_handlers_events import PresenceReceivedEvent
+from common.connection_handlers_events import PresenceKeyIDReceivedEvent
+
+ACCOUNT = 'keyid_test'
+JID = 'contact@example.org'
+OLD_KEY = '01234567'
+NEW_KEY = '89ABCDEF'
+
+class FakeVerifier:
+    def __init__(self):
+        self.key_ids = {}
+        self.verified = []
+
+    def get_key_id(self, status, signature):
+        return self.key_ids.get((status, signature))
+
+    def verify(self, jid, status, signature, callback, *args):
+        self.verified.append((status, signature, callback))
+
+class FakeConnection(ConnectionHandlersBase):
+    USE_GPG = True
+
+    def __init__(self):
+        self.name = ACCOUNT
+        self.connected = 2
+        self.gpg_verifier = FakeVerifier()
+
+    def ask_gpg_keys(self, keyID=None):
+        return None
+
+class FakeSignature:
+    def __init__(self, data):
+        self.data = data
+
+    def getData(self):
+        return self.data
+
+class TestPresenceKeyID(unittest.TestCase):
+
+    def setUp(self):
+        gajim.config.add_per('accounts', ACCOUNT)
+        self.conn = FakeConnection()
+        gajim.connections[ACCOUNT] = self.conn
+        self.contact = gajim.contacts.create_contact(jid=JID, account=ACCOUNT,
+            resource='res', status='signed', keyID=OLD_KEY)
+        gajim.contacts.add_contact(ACCOUNT, self.contact)
+
+    def tearDown(self):
+        gajim.contacts.remove_contact(ACCOUNT, self.contact)
+        del gajim.connections[ACCOUNT]
+        gajim.config.del_per('accounts', ACCOUNT)
+
+    def get_presence(self, signature):
+        presence = PresenceReceivedEvent(None, conn=self.conn, jid=JID,
+            resource='res', status='signed', ptype=None)
+        presence._generate_keyID(FakeSignature(signature))
+        return presence
+
+    def test_key_kept_while_verifying(self):
+        presence = self.get_presence('new signature')
+        self.assertTrue(presence.keyID_pending)
+        self.conn._set_contact_keyID(self.contact, presence)
+        self.assertEqual(self.contact.keyID, OLD_KEY)
+
+        callback = self.conn.gpg_verifier.verified[0][2]
+        event = PresenceKeyIDReceivedEvent(None, conn=self.conn,
+            presence_obj=presence, keyID=NEW_KEY)
+        self.assertTrue(event.generate())
+        self.conn._nec_presence_keyid_received(event)
+        self.assertEqual(self.contact.keyID, NEW_KEY)
+        self.assertEqual(callback, presence._on_keyID_verified)
+
+    def test_key_already_verified(self):
+        self.conn.gpg_verifier.key_ids[('signed', 'signature')] = NEW_KEY
+        presence = self.get_presence('signature')
+        self.assertFalse(presence.keyID_pending)
+        self.conn._set_contact_keyID(self.contact, presence)
+        self.assertEqual(self.contact.keyID, NEW_KEY)
+        self.assertEqual(self.conn.gpg_verifier.verified, [])
+
+    def test_attached_key(self):
+        gajim.config.set_per('accounts', ACCOUNT, 'attached_gpg_keys',
+            '%s %s' % (JID, NEW_KEY))
+        presence = self.get_presence('new signature')
+        self.conn._set_contact_keyID(self.contact, presence)
+        self.assertEqual(self.contact.keyID, NEW_KEY)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+'''
+Tests for the verification of the OpenPGP signatures of presences
+'''
+import threading
+import unittest
+
+import lib
+lib.setup_env()
+
+from gi.repository import GLib
+
+from common.signature_verifier import SignatureVerifier
+
+KEY_ID = '0123456789ABCDEF'
+
+class FakeGPG:
+    def __init__(self):
+        self.verified = []
+        # verifications wait for it, so the same signature can be asked again
+        # while it is verified
+        self.release = threading.Event()
+
+    def verify(self, str_, sign, keyID=None):
+        self.verified.append((sign, keyID))
+        self.release.wait(5)
+        if sign == 'bad':
+            return ''
+        return KEY_ID
+
+class TestSignatureVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.gpg = FakeGPG()
+        self.verifier = SignatureVerifier(self.gpg)
+
+    def verify(self, *signatures):
+        results = []
+        loop = GLib.MainLoop()
+        def on_verified(key_id, signature):
+            results.append((signature, key_id))
+            if len(results) == len(signatures):
+                loop.quit()
+        for signature in signatures:
+            self.verifier.verify('contact@example.org', 'status', signature,
+                on_verified, signature)
+        self.gpg.release.set()
+        GLib.timeout_add_seconds(5, loop.quit)
+        loop.run()
+        return sorted(results)
+
+    def test_verified_once(self):
+        self.assertIsNone(self.verifier.get_key_id('status', 'good'))
+        self.assertEqual(self.verify('good', 'bad', 'good'),
+            [('bad', ''), ('good', KEY_ID), ('good', KEY_ID)])
+        self.assertEqual(sorted(self.gpg.verified), [('bad', None),
+            ('good', None)])
+        self.assertEqual(self.verifier.get_key_id('status', 'good'), KEY_ID)
+        self.assertEqual(self.verifier.get_key_id('status', 'bad'), '')
+        self.assertIsNone(self.verifier.get_key_id('other status', 'good'))
+
+    def test_last_key_of_jid(self):
+        self.verify('good')
+        self.verify('new')
+        self.assertEqual(self.gpg.verified, [('good', None), ('new', KEY_ID)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+'''
+Tests for the sort keys of the roster and occupant list rows
+'''
+import random
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.helpers import get_sort_key
+
+class TestSortKey(unittest.TestCase):
+
+    def assertSortsLike(self, tuples):
+        self.assertEqual(sorted(tuples), sorted(tuples,
+            key=lambda parts: get_sort_key(*parts)))
+
+    def test_numbers(self):
+        self.assertSortsLike([(n,) for n in (0, 1, 9, 10, 99, 100, 12345)])
+        self.assertSortsLike([(True, 3), (False, 10), (False, 2)])
+
+    def test_strings(self):
+        self.assertSortsLike([(s,) for s in ('', 'a', 'ab', 'b', 'a b', 'é',
+            'contact 10', 'contact 9', '中')])
+
+    def test_mixed(self):
+        random.seed(0)
+        tuples = [(random.randint(0, 12), ''.join(random.choice('ab c')
+            for i in range(random.randint(0, 3))), random.randint(0, 120))
+            for j in range(500)]
+        self.assertSortsLike(tuples)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+'''
+Tests for the tokenizer of the special text of messages
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.special_text import SpecialTextTokenizer
+
+EMOTICONS = (':)', ':-)', ':))', ':P', '(BRB)', '8)', 'XD')
+
+class TestSpecialTextTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = SpecialTextTokenizer(EMOTICONS, True)
+
+    def get_specials(self, text, emoticons=True):
+        return [text[start:end] for start, end in self.tokenizer.tokenize(text,
+            emoticons=emoticons)]
+
+    def test_emoticons_borders(self):
+        self.assertEqual(self.get_specials('hi :) (brb) :p'),
+            [':)', '(brb)', ':p'])
+        self.assertEqual(self.get_specials('2.8) a8) (:)) 8)b'), [':))'])
+
+    def test_emoticons_side_by_side(self):
+        self.assertEqual(self.get_specials(':P:P:P'), [':P', ':P', ':P'])
+        # the longest emoticon followed by something that fits wins
+        self.assertEqual(self.get_specials(':))XD :)a'), [':))', 'XD'])
+
+    def test_links_and_formatting(self):
+        text = 'see http://gajim.org/ and *this*:) or mailto:a@b.org :-)'
+        self.assertEqual(self.get_specials(text), ['http://gajim.org/',
+            '*this*', ':)', 'mailto:a@b.org', ':-)'])
+        self.assertEqual(self.get_specials(text, emoticons=False),
+            ['http://gajim.org/', '*this*', 'mailto:a@b.org'])
+        tokenizer = SpecialTextTokenizer(EMOTICONS, False)
+        self.assertEqual(list(tokenizer.tokenize('*this* www.gajim.org')),
+            [(7, 20)])
+
+    def test_no_emoticons(self):
+        tokenizer = SpecialTextTokenizer()
+        self.assertEqual(list(tokenizer.tokenize('hi :) www.gajim.org')),
+            [(6, 19)])
+        self.assertEqual(list(tokenizer.tokenize('')), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+'''
+Tests for the scheduling of the vCard requests asked to get avatars
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import connection_handlers
+from common.connection_handlers import ConnectionVcard, VCARD_MAX_IN_FLIGHT
+
+class FakeConnection(ConnectionVcard):
+    def __init__(self):
+        ConnectionVcard.__init__(self)
+        self.connection = object()
+        self.connected = 2
+        self.sent = []
+
+    def request_vcard(self, jid=None, groupchat_jid=None):
+        self.sent.append(groupchat_jid or jid)
+
+class TestVcardRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+
+    def test_in_flight_limit(self):
+        jids = ['user%d@example.org' % i for i in range(VCARD_MAX_IN_FLIGHT +
+            2)]
+        for jid in jids:
+            self.conn.queue_vcard_request(jid)
+        self.assertEqual(self.conn.sent, jids[:VCARD_MAX_IN_FLIGHT])
+        self.conn._vcard_request_answered(jids[0], True)
+        self.assertEqual(self.conn.sent, jids[:VCARD_MAX_IN_FLIGHT + 1])
+        counters = self.conn.get_vcard_counters()
+        self.assertEqual(counters['in_flight'], VCARD_MAX_IN_FLIGHT)
+        self.assertEqual(counters['waiting'], 1)
+
+    def test_deduplicate_and_priority(self):
+        for i in range(VCARD_MAX_IN_FLIGHT):
+            self.conn.queue_vcard_request('busy%d@example.org' % i)
+        self.conn.queue_vcard_request('a@example.org')
+        self.conn.queue_vcard_request('b@example.org')
+        self.conn.queue_vcard_request('b@example.org', visible=True)
+        self.conn.queue_vcard_request('busy0@example.org')
+        self.assertEqual(self.conn.get_vcard_counters()['deduplicated'], 2)
+        self.conn._vcard_request_answered('busy0@example.org', True)
+        self.conn._vcard_request_answered('busy1@example.org', True)
+        self.conn._vcard_request_answered('busy2@example.org', True)
+        self.assertEqual(self.conn.sent[VCARD_MAX_IN_FLIGHT:],
+            ['b@example.org', 'a@example.org'])
+
+    def test_no_avatar(self):
+        self.conn.queue_vcard_request('room@conf.example.org/nick',
+            'room@conf.example.org/nick')
+        self.conn._vcard_request_answered('room@conf.example.org/nick', False)
+        self.conn.queue_vcard_request('room@conf.example.org/nick',
+            'room@conf.example.org/nick')
+        self.assertEqual(len(self.conn.sent), 1)
+        self.assertEqual(self.conn.get_vcard_counters()['skipped'], 1)
+        self.conn.queue_vcard_request('room@conf.example.org/nick',
+            'room@conf.example.org/nick', avatar_changed=True)
+        self.assertEqual(len(self.conn.sent), 2)
+
+    def test_timeout(self):
+        self.conn.queue_vcard_request('a@example.org')
+        self.conn.vcard_in_flight['a@example.org'] -= \
+            connection_handlers.VCARD_REQUEST_TIMEOUT + 1
+        self.conn.send_queued_vcard_requests()
+        self.assertEqual(self.conn.get_vcard_counters()['timed_out'], 1)
+        self.conn.queue_vcard_request('a@example.org')
+        self.assertEqual(self.conn.sent, ['a@example.org', 'a@example.org'])
+
+    def test_timeout_without_traffic(self):
+        jids = ['user%d@example.org' % i for i in range(VCARD_MAX_IN_FLIGHT +
+            1)]
+        for jid in jids:
+            self.conn.queue_vcard_request(jid)
+        self.assertIsNotNone(self.conn.vcard_timeout_id)
+        for jid in jids[:VCARD_MAX_IN_FLIGHT]:
+            self.conn.vcard_in_flight[jid] -= \
+                connection_handlers.VCARD_REQUEST_TIMEOUT
+        self.conn._on_vcard_request_timeout()
+        self.assertEqual(self.conn.sent, jids)
+        self.assertIsNotNone(self.conn.vcard_timeout_id)
+
+    def test_reset(self):
+        jids = ['user%d@example.org' % i for i in range(VCARD_MAX_IN_FLIGHT +
+            1)]
+        for jid in jids:
+            self.conn.queue_vcard_request(jid)
+        self.conn.reset_vcard_queue()
+        self.assertIsNone(self.conn.vcard_timeout_id)
+        self.conn.queue_vcard_request(jids[0])
+        self.assertEqual(self.conn.sent, jids[:VCARD_MAX_IN_FLIGHT] + jids[:1])
+        counters = self.conn.get_vcard_counters()
+        self.assertEqual((counters['in_flight'], counters['waiting']), (1, 0))
+
+if __name__ == '__main__':
+    unittest.main()